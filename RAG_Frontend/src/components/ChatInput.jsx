@@ -2,8 +2,9 @@ import React, { useState, useRef } from "react";
 import { motion } from "framer-motion";
 import { FaMicrophone, FaPaperPlane, FaImage } from "react-icons/fa";
 import axios from "axios";
+import { uploadAndWait, ingestError } from "../ingest";
 
-const ChatInput = ({ onSend }) => {
+const ChatInput = ({ onSend, onUploadStatus }) => {
   const [message, setMessage] = useState("");
   const [listening, setListening] = useState(false);
   const [file, setFile] = useState(null);
@@ -52,31 +53,41 @@ const ChatInput = ({ onSend }) => {
     setMessage("");
     if (!message.trim() && !file) return;
 
+    if (file) {
+      // one chat entry per upload, updated in place until the ingest job finishes
+      const id = `upload-${Date.now()}`;
+      const show = (answer) =>
+        onUploadStatus?.({ id, message: message.trim() || `📎 ${file.name}`, responseData: { synthesis: { answer } } });
+
+      show(`⏳ Uploading ${file.name}...`);
+      try {
+        const result = await uploadAndWait("http://127.0.0.1:8000", file, {
+          onStatus: (job) => show(`⏳ Indexing ${file.name}: ${job.stage}...`),
+        });
+        show(
+          result.status === "duplicate"
+            ? `✅ ${file.name} is already indexed (${result.chunks_indexed} chunks).`
+            : `✅ ${file.name} indexed (${result.chunks_indexed} chunks).`
+        );
+      } catch (error) {
+        console.error("❌ Upload failed:", error);
+        show(`⚠️ Indexing ${file.name} failed: ${ingestError(error)}`);
+      } finally {
+        setFile(null);
+      }
+      return;
+    }
+
     // Show user message instantly
     onSend?.({ message, responseData: { synthesis: { answer: "Thinking..." } } });
 
     try {
-      let responseData = null;
-
-      if (file) {
-        const formData = new FormData();
-        formData.append("file", file);
-
-        const uploadRes = await axios.post(
-          "http://127.0.0.1:8000/ingest/upload",
-          formData,
-          { headers: { "Content-Type": "multipart/form-data" } }
-        );
-
-        responseData = { synthesis: { answer: "✅ File uploaded successfully!" } };
-      } else {
-        const res = await axios.post("http://127.0.0.1:8000/query", {
-          q: message,
-          top_k: 3,
-        });
+      const res = await axios.post("http://127.0.0.1:8000/query", {
+        q: message,
+        top_k: 3,
+      });
 
-        responseData = res.data?.synthesis ? res.data : { synthesis: res.data };
-      }
+      const responseData = res.data?.synthesis ? res.data : { synthesis: res.data };
 
       // Update parent with AI response
       onSend?.({ message, responseData });
@@ -86,8 +97,6 @@ const ChatInput = ({ onSend }) => {
         message,
         responseData: { synthesis: { answer: "⚠️ Failed to get response." } },
       });
-    } finally {
-      setFile(null);
     }
   };
 
@@ -126,6 +126,15 @@ const ChatInterface = () => {
     }
   };
 
+  // upload progress from ChatInput: one entry per upload, updated in place
+  const handleUploadStatus = ({ id, message, responseData }) => {
+    setMessages((prev) =>
+      prev.some((m) => m.id === id)
+        ? prev.map((m) => (m.id === id ? { ...m, responseData } : m))
+        : [...prev, { id, message, responseData }]
+    );
+  };
+
   return (
     <div className="relative flex flex-col flex-grow h-full bg-gray-50 rounded-xl shadow-inner overflow-hidden">
       {/* Header */}
@@ -198,7 +207,7 @@ const ChatInterface = () => {
         transition={{ type: "spring", stiffness: 80 }}
         className="bg-white p-4 border-t border-gray-200 shadow-inner"
       >
-        <ChatInput onSend={handleSend} />
+        <ChatInput onSend={handleSend} onUploadStatus={handleUploadStatus} />
       </motion.div>
     </div>
   );
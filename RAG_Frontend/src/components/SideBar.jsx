@@ -14,6 +14,8 @@ const Sidebar = () => {
 
     const name = backendFile.filename || backendFile.fileObj?.name || "Unknown";
 
+    const ext = name.lastIndexOf(".") > 0 ? name.slice(name.lastIndexOf(".")) : "";
+
     const lowerName = name.toLowerCase();
     if (lowerName.endsWith(".pdf")) {
       icon = FaFilePdf;
@@ -33,8 +35,9 @@ const Sidebar = () => {
         type,
         icon,
         doc_id: backendFile.doc_id,
-        url: backendFile.filename
-          ? `http://localhost:8000/storage/${backendFile.filename}`
+        // the backend stores uploads as <doc_id><extension>
+        url: backendFile.doc_id
+          ? `http://localhost:8000/storage/${backendFile.doc_id}${ext}`
           : null,
         fileObj: backendFile.fileObj || null,
       },
@@ -1,12 +1,13 @@
 import React, { useRef, useState } from "react";
 import { motion } from "framer-motion";
 import { FaCloudUploadAlt } from "react-icons/fa";
-import axios from "axios";
+import { uploadAndWait, ingestError } from "../ingest";
 
 const UploadArea = ({ onFileUpload }) => {
   const fileInputRef = useRef(null);
   const [fileName, setFileName] = useState(null);
   const [uploading, setUploading] = useState(false);
+  const [status, setStatus] = useState(null);
 
   const handleUpload = async (e) => {
     const file = e.target.files[0];
@@ -14,27 +15,27 @@ const UploadArea = ({ onFileUpload }) => {
 
     setFileName(file.name);
     setUploading(true);
+    setStatus("Uploading...");
 
     try {
-      const formData = new FormData();
-      formData.append("file", file);
-
-      const res = await axios.post("http://localhost:8000/ingest/upload", formData, {
-        headers: { "Content-Type": "multipart/form-data" },
+      // resolves once the ingest job is done, rejects if it failed
+      const result = await uploadAndWait("http://localhost:8000", file, {
+        onStatus: (job) => setStatus(`Indexing: ${job.stage}...`),
       });
+      setStatus(result.status === "duplicate" ? "Already indexed" : `Indexed (${result.chunks_indexed} chunks)`);
 
-      if (res.data) {
-        // Return backend response to Sidebar for adding to list
-        if (onFileUpload) onFileUpload({
-          ...res.data,
-          fileObj: file,
-        });
-      }
+      // Return backend response to Sidebar for adding to list
+      if (onFileUpload) onFileUpload({
+        ...result,
+        fileObj: file,
+      });
     } catch (err) {
       console.error("Upload failed:", err);
-      alert("Upload failed. Check console for details.");
+      setStatus(`Failed: ${ingestError(err)}`);
+      alert(`Indexing ${file.name} failed: ${ingestError(err)}`);
     } finally {
       setUploading(false);
+      e.target.value = ""; // allow choosing the same file again
     }
   };
 
@@ -66,7 +67,7 @@ const UploadArea = ({ onFileUpload }) => {
           onClick={() => fileInputRef.current.click()}
           className="px-5 py-2 text-sm font-semibold text-white bg-[#234C6A] rounded-full shadow-md hover:bg-[#1d3f59] hover:shadow-lg transition-all"
         >
-          {uploading ? "Uploading..." : "Choose File"}
+          {uploading ? status : "Choose File"}
         </button>
 
         {fileName && (
@@ -79,6 +80,10 @@ const UploadArea = ({ onFileUpload }) => {
             {fileName}
           </motion.p>
         )}
+
+        {fileName && status && !uploading && (
+          <p className="text-xs text-gray-500 truncate max-w-[180px]">{status}</p>
+        )}
       </div>
     </motion.div>
   );
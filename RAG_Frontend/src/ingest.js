@@ -0,0 +1,36 @@
+import axios from "axios";
+
+const POLL_INTERVAL_MS = 1000;
+const POLL_TIMEOUT_MS = 30 * 60 * 1000; // large scanned PDFs can take a while
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Human-readable reason from an axios error or a failed job
+export const ingestError = (err) =>
+  err?.response?.data?.detail || err?.message || "Unknown error";
+
+// Upload a file and wait until the backend has indexed it.
+// /ingest/upload only queues a job (202 + job_id), so the job is polled until
+// it is "done" (resolves with the upload response merged with the job result)
+// or "failed" (rejects with the job's error). Content that is already indexed
+// comes back as status "duplicate" without a job.
+// onStatus(job) is called on every poll, for progress display.
+export const uploadAndWait = async (baseUrl, file, { onStatus } = {}) => {
+  const formData = new FormData();
+  formData.append("file", file);
+
+  const { data } = await axios.post(`${baseUrl}/ingest/upload`, formData, {
+    headers: { "Content-Type": "multipart/form-data" },
+  });
+  if (!data.job_id) return data;
+
+  const deadline = Date.now() + POLL_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    const { data: job } = await axios.get(`${baseUrl}/ingest/jobs/${data.job_id}`);
+    onStatus?.(job);
+    if (job.status === "done") return { ...data, ...job.result, status: "done" };
+    if (job.status === "failed") throw new Error(job.error || "Indexing failed");
+    await sleep(POLL_INTERVAL_MS);
+  }
+  throw new Error("Timed out waiting for indexing to finish");
+};
@@ -0,0 +1,144 @@
+# app/answer_cache.py
+# In-memory semantic cache of synthesized answers. An entry is the normalized
+# query embedding plus the ordered chunk ids its answer was generated from. A
+# new query hits when a cached query is within ANSWER_CACHE_THRESHOLD cosine
+# similarity AND retrieval returned the same chunk set, so re-indexing (new,
+# changed or deleted chunks) turns old answers into misses instead of serving
+# them. The embeddings live in one preallocated float32 matrix: a lookup is a
+# single matrix-vector product over at most ANSWER_CACHE_SIZE rows.
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .config import ANSWER_CACHE_SIZE, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL
+
+_lock = threading.Lock()
+_matrix: Optional[np.ndarray] = None  # (ANSWER_CACHE_SIZE, dim), allocated on first store
+_valid = np.zeros(max(ANSWER_CACHE_SIZE, 0), dtype=bool)
+_created = np.zeros(max(ANSWER_CACHE_SIZE, 0), dtype=np.float64)
+_last_used = np.zeros(max(ANSWER_CACHE_SIZE, 0), dtype=np.float64)
+_entries: List[Optional[Dict]] = [None] * max(ANSWER_CACHE_SIZE, 0)
+_counters = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "expired": 0, "lookup_us": 0.0}
+
+
+def enabled() -> bool:
+    return ANSWER_CACHE_SIZE > 0
+
+
+def _normalize(vector: Sequence[float]) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+def _live(now: float) -> np.ndarray:
+    # valid, unexpired rows; expired ones are dropped on the way
+    if ANSWER_CACHE_TTL > 0:
+        expired = _valid & (now - _created > ANSWER_CACHE_TTL)
+        if expired.any():
+            _valid[expired] = False
+            for i in np.flatnonzero(expired):
+                _entries[i] = None
+            _counters["expired"] += int(expired.sum())
+    return _valid
+
+
+def _similar(query: np.ndarray, now: float) -> np.ndarray:
+    # rows within the threshold, most similar first
+    if _matrix is None or _matrix.shape[1] != query.shape[0]:
+        return np.empty(0, dtype=np.int64)
+    sims = _matrix @ query
+    rows = np.flatnonzero(_live(now) & (sims >= ANSWER_CACHE_THRESHOLD))
+    return rows[np.argsort(-sims[rows])]
+
+
+def lookup(query_vector: Sequence[float], chunk_ids: Sequence) -> Optional[Dict]:
+    """
+    Cached answer for a query whose retrieval returned `chunk_ids`:
+    {"answer", "chunk_ids" (order the answer's citation numbers refer to),
+    "query", "similarity", "age_s"} or None.
+    """
+    if not enabled():
+        return None
+    t0 = time.perf_counter()
+    query = _normalize(query_vector)
+    wanted = frozenset(map(str, chunk_ids))
+    now = time.time()
+    with _lock:
+        hit = None
+        rows = _similar(query, now)
+        for row in rows:
+            entry = _entries[row]
+            if entry["id_set"] == wanted:
+                _last_used[row] = now
+                hit = {
+                    "answer": entry["answer"],
+                    "chunk_ids": entry["chunk_ids"],
+                    "query": entry["query"],
+                    "similarity": round(float(_matrix[row] @ query), 4),
+                    "age_s": round(now - _created[row], 1),
+                }
+                break
+        if hit:
+            _counters["hits"] += 1
+        else:
+            _counters["misses"] += 1
+            if len(rows):
+                _counters["stale"] += 1  # a similar question was answered from different chunks
+        _counters["lookup_us"] += (time.perf_counter() - t0) * 1e6
+    return hit
+
+
+def store(query_vector: Sequence[float], chunk_ids: Sequence, answer: str, query: str = ""):
+    """
+    Cache `answer`, generated from `chunk_ids` in this order. An entry for a
+    similar query whose chunk set no longer matches is overwritten; otherwise
+    an empty row is used, else the least recently used one.
+    """
+    global _matrix
+    if not enabled():
+        return
+    vector = _normalize(query_vector)
+    now = time.time()
+    with _lock:
+        if _matrix is None or _matrix.shape[1] != vector.shape[0]:
+            # first entry (or the embedding model changed size): start over
+            _matrix = np.zeros((ANSWER_CACHE_SIZE, vector.shape[0]), dtype=np.float32)
+            _valid[:] = False
+            _entries[:] = [None] * ANSWER_CACHE_SIZE
+        similar = _similar(vector, now)
+        if len(similar):
+            row = int(similar[0])
+        elif not _valid.all():
+            row = int(np.argmin(_valid))
+        else:
+            row = int(np.argmin(_last_used))
+            _counters["evictions"] += 1
+        _matrix[row] = vector
+        _valid[row] = True
+        _created[row] = _last_used[row] = now
+        ids = [str(i) for i in chunk_ids]
+        _entries[row] = {"answer": answer, "chunk_ids": ids, "id_set": frozenset(ids), "query": query}
+
+
+def clear():
+    with _lock:
+        _valid[:] = False
+        _entries[:] = [None] * len(_entries)
+
+
+def stats() -> Dict:
+    with _lock:
+        lookups = _counters["hits"] + _counters["misses"]
+        return {
+            "enabled": enabled(),
+            "entries": int(_live(time.time()).sum()),
+            "max_entries": ANSWER_CACHE_SIZE,
+            "threshold": ANSWER_CACHE_THRESHOLD,
+            "ttl_s": ANSWER_CACHE_TTL,
+            **{k: v for k, v in _counters.items() if k != "lookup_us"},
+            "hit_rate": round(_counters["hits"] / lookups, 4) if lookups else None,
+            "avg_lookup_us": round(_counters["lookup_us"] / lookups, 1) if lookups else None,
+        }
@@ -1,18 +1,158 @@
-import math
-from typing import List
-
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-    tokens = text.split()
-    if not tokens:
-        return []
-    chunks = []
-    i = 0
-    n = len(tokens)
-    while i < n:
-        j = min(i + chunk_size, n)
-        chunk = " ".join(tokens[i:j])
-        chunks.append(chunk)
-        if j == n:
-            break
-        i = j - overlap
-    return chunks
+# app/chunking.py
+# Token-aware, sentence-aligned chunking over a stream of pages.
+# Chunks are packed with whole sentences up to the embedding model's input
+# limit (counted with its own tokenizer), overlap by up to CHUNK_OVERLAP_TOKENS
+# tokens (whole trailing sentences plus the end of the one before them, cut at
+# a token boundary when the tokenizer gives offsets), and carry character
+# offsets into the document text (the page texts joined with "\n").
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .config import CHUNK_OVERLAP_TOKENS
+from . import provenance
+
+# a sentence runs up to terminal punctuation (incl. the Devanagari danda)
+# followed by whitespace, or up to a line break
+_SENTENCE = re.compile(r"\S.*?(?:[.!?।]+(?=\s)|(?=\n)|$)", re.S)
+
+CountTokens = Callable[[List[str]], List[int]]
+TokenOffsets = Callable[[str], Optional[List[Tuple[int, int]]]]
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """(start, end) character spans of the sentences in `text`."""
+    spans = []
+    for m in _SENTENCE.finditer(text):
+        start, end = m.start(), m.end()
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        spans.append((start, end))
+    return spans
+
+
+def _split_long(text: str, start: int, max_tokens: int, token_offsets: Optional[TokenOffsets]) -> List[Tuple[int, int, int]]:
+    # a sentence over the budget is cut at token boundaries: (start, end, n_tokens)
+    offsets = token_offsets(text) if token_offsets is not None else None
+    if offsets:
+        pieces = []
+        for i in range(0, len(offsets), max_tokens):
+            group = offsets[i:i + max_tokens]
+            pieces.append((start + group[0][0], start + group[-1][1], len(group)))
+        return pieces
+    # no offset mapping (slow tokenizer): fall back to whitespace words, one token each
+    words = [m.span() for m in re.finditer(r"\S+", text)]
+    return [
+        (start + words[i][0], start + words[min(i + max_tokens, len(words)) - 1][1], min(max_tokens, len(words) - i))
+        for i in range(0, len(words), max_tokens)
+    ]
+
+
+def iter_sentences(
+    pages: Iterable[Dict],
+    count_tokens: CountTokens,
+    max_tokens: int,
+    token_offsets: Optional[TokenOffsets] = None,
+    table: Optional[Dict] = None
+) -> Iterator[Dict]:
+    """
+    Sentences of a page stream as {"text", "start", "end", "page", "tokens"},
+    offsets into the joined document text. Sentences longer than `max_tokens`
+    are split into token-bounded pieces. Page and sentence starts are recorded
+    in `table` (see provenance.new_table) as they are read.
+    """
+    offset = 0
+    for page in pages:
+        text = page.get("text", "")
+        if table is not None:
+            provenance.add_page(table, offset, page["page"])
+        spans = split_sentences(text)
+        counts = count_tokens([text[s:e] for s, e in spans]) if spans else []
+        for (s, e), n in zip(spans, counts):
+            if table is not None:
+                provenance.add_sentence(table, offset + s)
+            pieces = [(s, e, n)] if n <= max_tokens else _split_long(text[s:e], s, max_tokens, token_offsets)
+            for ps, pe, pn in pieces:
+                yield {"text": text[ps:pe], "start": offset + ps, "end": offset + pe, "page": page["page"], "tokens": pn}
+        offset += len(text) + 1  # "\n" between pages
+
+
+def _tail(sent: Dict, n: int, count_tokens: CountTokens, token_offsets: Optional[TokenOffsets]) -> Optional[Dict]:
+    # the last `n` tokens of a sentence, cut at a token boundary (None without an offset mapping)
+    if n <= 0 or token_offsets is None:
+        return None
+    offsets = token_offsets(sent["text"])
+    if not offsets or len(offsets) <= n:
+        return None
+    cut = offsets[-n][0]
+    text = sent["text"][cut:].lstrip()
+    if not text:
+        return None
+    start = sent["end"] - len(text)
+    tokens = count_tokens([text])[0]  # re-tokenized on its own it can differ by a token
+    if tokens > n:
+        return None
+    return {"text": text, "start": start, "end": sent["end"], "page": sent["page"], "tokens": tokens}
+
+
+def _chunk(sentences: List[Dict]) -> Dict:
+    return {
+        "text": " ".join(s["text"] for s in sentences),
+        "start": sentences[0]["start"],
+        "end": sentences[-1]["end"],
+        "pages": sorted({s["page"] for s in sentences}),
+        "tokens": sum(s["tokens"] for s in sentences),
+    }
+
+
+def iter_token_chunks(
+    pages: Iterable[Dict],
+    count_tokens: CountTokens,
+    max_tokens: int,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    token_offsets: Optional[TokenOffsets] = None,
+    table: Optional[Dict] = None
+) -> Iterator[Dict]:
+    """
+    Pack whole sentences into chunks of at most `max_tokens` tokens.
+    Each chunk after the first starts with the previous chunk's last
+    `overlap_tokens` tokens. These are its trailing sentences, plus the end of
+    the sentence before them cut with `token_offsets`. Without offsets (slow
+    tokenizers), only whole sentences are carried. Yields
+    {"text", "start", "end", "pages", "tokens"} with `start`/`end` character
+    offsets into the document text; only one chunk of sentences is held in memory.
+    `table` collects the provenance intervals (see iter_sentences).
+    """
+    buf: List[Dict] = []
+    total = 0
+    fresh = False  # buf holds sentences not emitted yet
+    for sent in iter_sentences(pages, count_tokens, max_tokens, token_offsets, table):
+        if buf and total + sent["tokens"] > max_tokens:
+            if fresh:
+                yield _chunk(buf)
+            # carry the last `overlap_tokens` tokens of this chunk over as overlap:
+            # whole trailing sentences, then the end of the sentence before them
+            keep, kept = [], 0
+            for s in reversed(buf):
+                if kept + s["tokens"] > overlap_tokens:
+                    piece = _tail(s, overlap_tokens - kept, count_tokens, token_offsets)
+                    if piece is not None:
+                        keep.insert(0, piece)
+                        kept += piece["tokens"]
+                    break
+                keep.insert(0, s)
+                kept += s["tokens"]
+            while keep and kept + sent["tokens"] > max_tokens:
+                kept -= keep.pop(0)["tokens"]
+            buf, total = keep, kept
+        buf.append(sent)
+        total += sent["tokens"]
+        fresh = True
+    if buf and fresh:
+        yield _chunk(buf)
+
+
+def chunk_text(text: str, count_tokens: CountTokens, max_tokens: int, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+               token_offsets: Optional[TokenOffsets] = None) -> List[str]:
+    """Chunk a single string (see iter_token_chunks)."""
+    pages = [{"page": 1, "text": text}]
+    return [c["text"] for c in iter_token_chunks(pages, count_tokens, max_tokens, overlap_tokens, token_offsets)]
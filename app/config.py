@@ -1,15 +1,83 @@
 # app/config.py
 import os
 
+INDEX_BACKEND = os.getenv("INDEX_BACKEND", "qdrant")  # qdrant | local (in-process, no server; see local_index.py)
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "index/vectors")
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float16")  # float16 halves the matrix size; float32 for exact scores
+LOCAL_ANN_THRESHOLD = int(os.getenv("LOCAL_ANN_THRESHOLD", "50000"))  # vectors before search switches to the IVF index
+LOCAL_ANN_NPROBE = int(os.getenv("LOCAL_ANN_NPROBE", "8"))  # IVF lists scanned per query
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
 QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "documents")
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "1") == "1"  # use gRPC (port QDRANT_GRPC_PORT) if grpcio is installed
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_PROFILE = os.getenv("QDRANT_PROFILE", "balanced")  # fast | balanced | compact (see indexer.COLLECTION_PROFILES)
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "128"))  # points per upsert request
+UPSERT_PARALLEL = int(os.getenv("UPSERT_PARALLEL", "2"))  # upsert requests in flight
+UPSERT_WAIT = os.getenv("UPSERT_WAIT", "0") == "1"  # 0: don't wait per batch, barrier once per document
 STORAGE_DIR = os.getenv("UPLOAD_DIR", "storage")
-VECTOR_DIM = int(os.getenv("VECTOR_DIM", "512"))  # unified vector dimension (images -> 512; text padded if needed)
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", "index/uploads")  # uploads being received or re-indexed (keep out of STORAGE_DIR, which is served)
+DOCUMENTS_DB_PATH = os.getenv("DOCUMENTS_DB_PATH", "index/documents.sqlite3")  # which content each doc_id holds
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))  # read/hash/write block size
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(2 * 1024**3)))  # reject larger uploads (0 = no limit)
+# text and image embeddings live in separate named vectors; their sizes come from the models
+TEXT_VECTOR_NAME = "text"
+IMAGE_VECTOR_NAME = "image"
 # TEXT_EMBED_MODEL = os.getenv("TEXT_EMBED_MODEL", "all-MiniLM-L6-v2")
 TEXT_EMBED_MODEL = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
 IMAGE_CLIP_MODEL = os.getenv("IMAGE_CLIP_MODEL", "ViT-B-32")  # for open_clip usage
-CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "150"))  # words per chunk
-CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")  # "small" → "medium", "large", etc.
+TROCR_MODEL = os.getenv("TROCR_MODEL", "microsoft/trocr-base-handwritten")
+MODEL_IDLE_TTL = float(os.getenv("MODEL_IDLE_TTL", "0"))  # seconds idle before a model is unloaded (0 = never)
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))  # evict LRU models above this (0 = unlimited)
+MODEL_RETRY_SECS = float(os.getenv("MODEL_RETRY_SECS", "60"))  # get_optional() retries a failed load after this long
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "0"))  # tokens per chunk (0 = the embedding model's max_seq_length)
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "16"))  # trailing sentences repeated in the next chunk, in tokens
+INGEST_WINDOW = int(os.getenv("INGEST_WINDOW", "256"))  # chunks embedded + upserted per streaming window
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))  # chunks per encode() forward pass
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "index/embeddings.sqlite3")
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "1024"))  # LRU-evicted above this (0 = no cache)
+# retrieval
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "index/lexical.sqlite3")  # BM25 index (keep out of STORAGE_DIR, which is served)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")  # dense | sparse | hybrid
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))  # hits fetched per leg before fusion
+RRF_K = int(os.getenv("RRF_K", "60"))
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"  # cross-encoder rerank between retrieval and synthesis
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))  # hits over-fetched for reranking
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "800"))  # past this, keep retrieval order
+RERANK_MAX_CHARS = int(os.getenv("RERANK_MAX_CHARS", "2000"))  # passage text sent to the cross-encoder
+QUERY_EMBED_WORKERS = int(os.getenv("QUERY_EMBED_WORKERS", "2"))  # threads encoding queries (bounds CPU use per worker)
+QUERY_EMBED_TIMEOUT = float(os.getenv("QUERY_EMBED_TIMEOUT", "10"))  # seconds per query encode (incl. waiting for a thread)
+QUERY_SEARCH_TIMEOUT = float(os.getenv("QUERY_SEARCH_TIMEOUT", "10"))  # seconds per vector / BM25 search
+# synthesizer (Ollama)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))  # cached answers, LRU-evicted (0 = no cache)
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # min cosine similarity between queries for a hit
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))  # seconds an answer stays valid (0 = until evicted)
+LLM_URL = os.getenv("LLM_URL", "http://localhost:11434")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama3.2:3b")
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))  # seconds to open a connection
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "90"))  # seconds waiting for response data
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "8"))  # pooled keep-alive connections to the LLM server
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "")  # HF id or local path of LLM_MODEL's tokenizer, for prompt budgets (empty = estimate with the embedding tokenizer)
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "1536"))  # whole prompt incl. instructions and question (0 = no limit)
+PACK_DEDUP_THRESHOLD = float(os.getenv("PACK_DEDUP_THRESHOLD", "0.8"))  # word 3-gram containment above which a passage is a duplicate
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "1"))  # generations sent to the LLM at once (Ollama's OLLAMA_NUM_PARALLEL)
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "8"))  # requests waiting for a slot before new ones get 429
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))  # seconds waiting for a slot before 503 (0 = no limit)
+LLM_DEGRADE = os.getenv("LLM_DEGRADE", "0") == "1"  # when the LLM is saturated, answer with retrieval results only instead of 429/503
+# background ingestion
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))  # concurrent ingest jobs
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "16"))  # waiting jobs before uploads are rejected
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "500"))  # finished jobs kept for status lookups
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "1"))  # >1 extracts/OCRs PDF pages in a process pool
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "4"))  # pages per process-pool task
+OCR_BATCH_PAGES = int(os.getenv("OCR_BATCH_PAGES", "4"))  # scanned PDF pages OCR'd per batch
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "0.80"))  # lines below this are re-read by TrOCR
+OCR_HANDWRITING_GAP_RATIO = float(os.getenv("OCR_HANDWRITING_GAP_RATIO", "0.12"))  # fewer blank rows than this -> handwritten
+TROCR_BATCH_SIZE = int(os.getenv("TROCR_BATCH_SIZE", "16"))
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "1"))
+ASR_CONCURRENCY = int(os.getenv("ASR_CONCURRENCY", "1"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "1"))
 # app/config.py
 # QDRANT_HOST = "localhost"
 # QDRANT_PORT = 6333
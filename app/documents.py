@@ -0,0 +1,104 @@
+# app/documents.py
+# Which content each document holds. A document's id is the SHA-256 of the
+# content it was first uploaded with, and as long as that is still its
+# content nothing is stored here. Documents whose content no longer matches
+# their id get a row: one replaced through PUT /documents/{doc_id}, or a new
+# upload whose hash is already taken as the id of a replaced document. Upload
+# dedup goes through owner(), so re-uploading a document's old content isn't
+# mistaken for a duplicate of what it holds now.
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+from .config import DOCUMENTS_DB_PATH
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(DOCUMENTS_DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(DOCUMENTS_DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY, content_hash TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS documents_content ON documents (content_hash)")
+        _conn = conn
+    return _conn
+
+
+def _row(conn: sqlite3.Connection, doc_id: str) -> Optional[str]:
+    row = conn.execute("SELECT content_hash FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+    return row[0] if row else None
+
+
+def content_hash(doc_id: str) -> str:
+    """SHA-256 of the content doc_id currently holds."""
+    with _lock:
+        return _row(_get_conn(), doc_id) or doc_id
+
+
+def owner(content_hash: str) -> Optional[str]:
+    """The doc_id holding this content, or None if its natural id was reused for other content."""
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute("SELECT doc_id FROM documents WHERE content_hash = ? LIMIT 1", (content_hash,)).fetchone()
+        if row:
+            return row[0]
+        return content_hash if _row(conn, content_hash) is None else None
+
+
+def assign(content_hash: str) -> str:
+    """
+    doc_id for newly uploaded content: the owner if there is one, else an id
+    derived from the hash (recorded, so the next upload of it finds it).
+    """
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute("SELECT doc_id FROM documents WHERE content_hash = ? LIMIT 1", (content_hash,)).fetchone()
+        if row:
+            return row[0]
+        if _row(conn, content_hash) is None:
+            return content_hash
+        n = 1
+        while True:
+            doc_id = hashlib.sha256(f"{content_hash}\0{n}".encode()).hexdigest()
+            if _row(conn, doc_id) is None:
+                break
+            n += 1
+        with conn:
+            conn.execute("INSERT INTO documents (doc_id, content_hash) VALUES (?, ?)", (doc_id, content_hash))
+        return doc_id
+
+
+def set_content_hash(doc_id: str, content_hash: str):
+    """Record that doc_id now holds this content (after a successful replace)."""
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            if content_hash == doc_id:
+                conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))  # back to its original content
+                return
+            conn.execute(
+                "INSERT INTO documents (doc_id, content_hash) VALUES (?, ?) "
+                "ON CONFLICT(doc_id) DO UPDATE SET content_hash = excluded.content_hash",
+                (doc_id, content_hash)
+            )
+
+
+def forget(doc_id: str):
+    """doc_id was deleted; its id is free for its original content again."""
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+
+def clear():
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM documents")
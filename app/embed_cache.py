@@ -0,0 +1,164 @@
+# app/embed_cache.py
+# Disk-backed cache of embeddings (SQLite), keyed by
+# sha256(model name, model fingerprint, normalized content), so repeated
+# boilerplate and unchanged chunks of a re-uploaded document skip the encoder.
+# Bounded by EMBED_CACHE_MAX_MB with least-recently-used eviction.
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, Sequence, Union
+
+import numpy as np
+
+from .config import EMBED_CACHE_PATH, EMBED_CACHE_MAX_MB
+
+_conn = None
+_lock = threading.Lock()
+_bytes = 0  # total vector bytes stored
+_counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+_WS = re.compile(r"\s+")
+
+
+def enabled() -> bool:
+    return EMBED_CACHE_MAX_MB > 0
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn, _bytes
+    if _conn is None:
+        os.makedirs(os.path.dirname(EMBED_CACHE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(EMBED_CACHE_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB, last_used REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)")
+        _bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        _conn = conn
+    return _conn
+
+
+def model_fingerprint(model) -> str:
+    """
+    Cheap identity of a torch model's weights: a sample of its first, middle and
+    last parameter tensors. Changes whenever different weights are loaded.
+    """
+    params = list(model.parameters())
+    h = hashlib.sha256()
+    for p in (params[0], params[len(params) // 2], params[-1]):
+        h.update(str(tuple(p.shape)).encode())
+        h.update(p.detach().flatten()[:4096].float().cpu().numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+def normalize_text(text: str) -> str:
+    return _WS.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def make_key(model_name: str, fingerprint: str, content: Union[str, bytes]) -> bytes:
+    h = hashlib.sha256(f"{model_name}\0{fingerprint}\0".encode())
+    h.update(normalize_text(content).encode() if isinstance(content, str) else content)
+    return h.digest()
+
+
+def make_file_key(model_name: str, fingerprint: str, path: str, block_size: int = 1024 * 1024) -> bytes:
+    """make_key() for the raw bytes of a file, read in blocks instead of all at once."""
+    h = hashlib.sha256(f"{model_name}\0{fingerprint}\0".encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.digest()
+
+
+def get_many(keys: Sequence[bytes]) -> Dict[int, np.ndarray]:
+    """Cached vectors by position in `keys` (misses are absent)."""
+    if not enabled() or not keys:
+        return {}
+    found = {}
+    unique = list(dict.fromkeys(keys))
+    with _lock:
+        conn = _get_conn()
+        rows = {}
+        for i in range(0, len(unique), 500):  # stay under SQLite's variable limit
+            part = unique[i:i + 500]
+            rows.update(conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall())
+        if rows:
+            with conn:
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(time.time(), k) for k in rows])
+        for pos, key in enumerate(keys):
+            if key in rows:
+                found[pos] = np.frombuffer(rows[key], dtype=np.float32)
+        _counters["hits"] += len(found)
+        _counters["misses"] += len(keys) - len(found)
+    return found
+
+
+def put_many(keys: Sequence[bytes], vectors: np.ndarray):
+    global _bytes
+    if not enabled() or not len(keys):
+        return
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            new = dict(zip(keys, (v.tobytes() for v in vectors)))
+            for i in range(0, len(new), 500):
+                part = list(new)[i:i + 500]
+                _bytes -= conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part
+                ).fetchone()[0]
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(k, blob, now) for k, blob in new.items()]
+            )
+            _bytes += sum(len(blob) for blob in new.values())
+        _evict(conn)
+
+
+def _evict(conn: sqlite3.Connection):
+    # drop least recently used entries until 90% of the cap
+    global _bytes
+    cap = EMBED_CACHE_MAX_MB * 2**20
+    if _bytes <= cap:
+        return
+    target = int(cap * 0.9)
+    with conn:
+        while _bytes > target:
+            victims = conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 1000"
+            ).fetchall()
+            if not victims:
+                _bytes = 0
+                break
+            freed, drop = 0, []
+            for key, size in victims:
+                drop.append((key,))
+                freed += size
+                if _bytes - freed <= target:
+                    break
+            conn.executemany("DELETE FROM embeddings WHERE key = ?", drop)
+            _bytes -= freed
+            _counters["evictions"] += len(drop)
+
+
+def stats() -> Dict:
+    with _lock:
+        lookups = _counters["hits"] + _counters["misses"]
+        entries = _get_conn().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] if enabled() else 0
+        return {
+            "enabled": enabled(),
+            "entries": entries,
+            "size_mb": round(_bytes / 2**20, 2),
+            "max_mb": EMBED_CACHE_MAX_MB,
+            **_counters,
+            "hit_rate": round(_counters["hits"] / lookups, 4) if lookups else None,
+        }
@@ -1,72 +1,158 @@
 # app/embeddings.py
 import io
 import numpy as np
-from .config import TEXT_EMBED_MODEL, IMAGE_CLIP_MODEL, VECTOR_DIM
-import threading
-
-_text_model = None
-_text_model_lock = threading.Lock()
-_clip = None
-_clip_preprocess = None
-_clip_device = None
-_clip_lock = threading.Lock()
+from typing import Callable, List, Optional, Tuple
+from .config import TEXT_EMBED_MODEL, IMAGE_CLIP_MODEL, EMBED_BATCH_SIZE, CHUNK_MAX_TOKENS
+from . import embed_cache, registry
 
 def get_text_model():
-    global _text_model
-    if _text_model is None:
-        with _text_model_lock:
-            if _text_model is None:
-                from sentence_transformers import SentenceTransformer
-                _text_model = SentenceTransformer(TEXT_EMBED_MODEL)
-    return _text_model
+    return registry.get("text_embedder")
 
 
-def embed_text(text: str):
+def text_embedding_dim() -> int:
+    return get_text_model().get_sentence_embedding_dimension()
+
+
+def text_max_tokens() -> int:
+    """Chunk budget in tokens: what the model embeds, minus its special tokens."""
     model = get_text_model()
-    emb = model.encode([text], convert_to_numpy=True)[0].astype(np.float32)
-    # pad or truncate to VECTOR_DIM
-    if len(emb) < VECTOR_DIM:
-        pad = np.zeros(VECTOR_DIM - len(emb), dtype=np.float32)
-        emb = np.concatenate([emb, pad])
-    elif len(emb) > VECTOR_DIM:
-        emb = emb[:VECTOR_DIM]
+    limit = model.max_seq_length - 2  # <s> ... </s>
+    return min(CHUNK_MAX_TOKENS, limit) if CHUNK_MAX_TOKENS > 0 else limit
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """Token counts with the text model's own tokenizer (no special tokens)."""
+    tokenizer = get_text_model().tokenizer
+    return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+
+def token_offsets(text: str) -> Optional[List[Tuple[int, int]]]:
+    """Character span of each token of `text` (fast tokenizers only)."""
+    tokenizer = get_text_model().tokenizer
+    if not getattr(tokenizer, "is_fast", False):
+        return None
+    return tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+
+
+def _fingerprint(model) -> str:
+    # computed once per loaded model instance
+    fp = getattr(model, "_embed_cache_fingerprint", None)
+    if fp is None:
+        fp = model._embed_cache_fingerprint = embed_cache.model_fingerprint(model)
+    return fp
+
+
+def embed_texts(
+    texts: List[str],
+    batch_size: int = EMBED_BATCH_SIZE,
+    on_batch: Optional[Callable[[int], None]] = None
+) -> np.ndarray:
+    """
+    Embed many texts in length-sorted batches.
+    Returns a contiguous float32 matrix of shape (len(texts), model dim),
+    rows in the same order as `texts`. `on_batch(rows_done)` is called after each batch.
+    Texts found in the embedding cache, and repeats within `texts`, aren't re-encoded.
+    """
+    model = get_text_model()
+    out = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    keys = None
+    cached = {}
+    if embed_cache.enabled():
+        fp = _fingerprint(model)
+        keys = [embed_cache.make_key(TEXT_EMBED_MODEL, fp, t) for t in texts]
+        cached = embed_cache.get_many(keys)
+        for i, vec in cached.items():
+            out[i] = vec
+
+    # rows still to encode, grouped by identical content
+    groups = {}
+    for i in range(len(texts)):
+        if i not in cached:
+            groups.setdefault(keys[i] if keys else texts[i], []).append(i)
+    firsts = [rows[0] for rows in groups.values()]
+    skipped = len(texts) - len(firsts)
+
+    # longest first so each batch pads to similar lengths
+    order = sorted(firsts, key=lambda i: len(texts[i]), reverse=True)
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        out[idx] = model.encode([texts[i] for i in idx], batch_size=len(idx), convert_to_numpy=True)
+        if on_batch:
+            on_batch(skipped + start + len(idx))
+    for rows in groups.values():
+        out[rows[1:]] = out[rows[0]]
+    if keys:
+        embed_cache.put_many([keys[i] for i in firsts], out[firsts])
+    return out
+
+
+def embed_text(text: str):
+    emb = embed_texts([text])[0]
     # convert to plain list for Qdrant
     return emb.tolist()
 
 
 def get_clip_model_and_preprocess():
-    global _clip, _clip_preprocess, _clip_device
-    if _clip is None:
-        with _clip_lock:
-            if _clip is None:
-                import open_clip
-                import torch
-                model, _, preprocess = open_clip.create_model_and_transforms(
-                    IMAGE_CLIP_MODEL, pretrained='openai'
-                )
-                device = "cuda" if torch.cuda.is_available() else "cpu"
-                model.to(device)
-                _clip = model
-                _clip_preprocess = preprocess
-                _clip_device = device
-    return _clip, _clip_preprocess, _clip_device
+    return registry.get("clip")
+
+
+def image_embedding_dim() -> int:
+    # CLIP's joint embedding size; read from the model config so ingesting
+    # text-only documents doesn't have to load CLIP just to create the collection
+    import open_clip
+    cfg = open_clip.get_model_config(IMAGE_CLIP_MODEL)
+    if cfg and "embed_dim" in cfg:
+        return cfg["embed_dim"]
+    clip_model, _, _ = get_clip_model_and_preprocess()
+    return clip_model.visual.output_dim
 
 
 def embed_image_bytes(img_bytes: bytes):
+    clip_model, _, _ = get_clip_model_and_preprocess()
+    key = None
+    if embed_cache.enabled():
+        key = embed_cache.make_key(IMAGE_CLIP_MODEL, _fingerprint(clip_model), img_bytes)
+    return _embed_image(io.BytesIO(img_bytes), key)
+
+
+def embed_image_file(path):
+    """Like embed_image_bytes(), but decodes from the file (the image is never held as raw bytes)."""
+    clip_model, _, _ = get_clip_model_and_preprocess()
+    key = None
+    if embed_cache.enabled():
+        key = embed_cache.make_file_key(IMAGE_CLIP_MODEL, _fingerprint(clip_model), path)
+    return _embed_image(path, key)
+
+
+def _embed_image(source, key: Optional[bytes]):
+    # `source` is a path or file object for PIL; `key` the cache key (None: cache disabled)
+    if key:
+        hit = embed_cache.get_many([key])
+        if hit:
+            return hit[0].tolist()
     clip_model, preprocess, device = get_clip_model_and_preprocess()
     from PIL import Image
     import torch
-    image = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+    image = Image.open(source).convert("RGB")
     inp = preprocess(image).unsqueeze(0).to(device)
     with torch.no_grad():
         image_features = clip_model.encode_image(inp)
         image_features = image_features / image_features.norm(dim=-1, keepdim=True)
         emb = image_features.cpu().numpy()[0].astype(np.float32)
-    # pad/truncate to VECTOR_DIM
-    if len(emb) < VECTOR_DIM:
-        pad = np.zeros(VECTOR_DIM - len(emb), dtype=np.float32)
-        emb = np.concatenate([emb, pad])
-    elif len(emb) > VECTOR_DIM:
-        emb = emb[:VECTOR_DIM]
+    if key:
+        embed_cache.put_many([key], emb[None, :])
     # convert to plain list for Qdrant
     return emb.tolist()
+
+
+def embed_text_for_images(text: str):
+    """Encode a query with CLIP's text tower, for searching the image vectors."""
+    clip_model, _, device = get_clip_model_and_preprocess()
+    import open_clip
+    import torch
+    tokens = open_clip.tokenize([text]).to(device)
+    with torch.no_grad():
+        text_features = clip_model.encode_text(tokens)
+        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        emb = text_features.cpu().numpy()[0].astype(np.float32)
+    return emb.tolist()
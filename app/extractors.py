@@ -2,22 +2,14 @@ import io
 import os
 import tempfile
 from typing import Dict
+import numpy as np
 from PIL import Image
 import fitz  # PyMuPDF
 from docx import Document
 
-# OCR backends
-try:
-    from paddleocr import PaddleOCR
-    _paddle = PaddleOCR(use_angle_cls=True, lang='en', show_log=False)
-except Exception:
-    _paddle = None
-
-try:
-    import easyocr
-    _easy_reader = easyocr.Reader(['en'], gpu=False)
-except Exception:
-    _easy_reader = None
+# OCR/ASR models (PaddleOCR, EasyOCR, TrOCR, Whisper) are loaded lazily
+# through the shared model registry, only when a file actually needs them.
+from . import registry
 
 try:
     import pytesseract
@@ -25,22 +17,6 @@ try:
 except Exception:
     _tesseract = None
 
-# Whisper
-try:
-    import whisper
-    _whisper_model = whisper.load_model("small")
-except Exception:
-    _whisper_model = None
-
-# TrOCR (handwriting)
-try:
-    from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-    _trocr_processor = TrOCRProcessor.from_pretrained('microsoft/trocr-base-handwritten')
-    _trocr_model = VisionEncoderDecoderModel.from_pretrained('microsoft/trocr-base-handwritten')
-except Exception:
-    _trocr_processor = None
-    _trocr_model = None
-
 
 # -------------------------------
 # PDF Extraction
@@ -72,53 +48,173 @@ except Exception:
 #     return {"pages":[{"page":1, "text":text, "char_count":len(text)}], "text": text}
 
 import re
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Callable, Iterator, List, Optional, Tuple, Union
 from docx import Document
 import fitz  # PyMuPDF
-
-def extract_text_from_pdf_bytes(pdf_bytes: bytes) -> dict:
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    pages = []
-    full = []
-    for i in range(len(doc)):
+from .jobs import stage_slot
+from .provenance import segment_offsets
+from .config import (
+    PDF_WORKERS,
+    PDF_PAGES_PER_TASK,
+    OCR_BATCH_PAGES,
+    OCR_MIN_CONFIDENCE,
+    OCR_HANDWRITING_GAP_RATIO,
+    TROCR_BATCH_SIZE,
+)
+
+def _page_dict(page_number: int, text: str, ocr: Optional[Dict] = None) -> dict:
+    # line numbers are derived from sentence offsets at chunking time (see provenance.py)
+    return {
+        "page": page_number,
+        "text": text,
+        "char_count": len(text),
+        "ocr_engine": ocr["engine"] if ocr else None,
+        "ocr_route": ocr["route"] if ocr else None,
+        "ocr_confidence": ocr["confidence"] if ocr else None
+    }
+
+
+def _extract_pdf_pages(doc, start: int, end: int) -> List[dict]:
+    """
+    Extract pages [start, end) of an open document. Pages without a text
+    layer are rendered straight to pixel arrays and OCR'd in one batch.
+    """
+    texts = []
+    ocr = {}
+    scanned = []  # (position in texts, pixmap) kept alive while its array is in use
+    for i in range(start, end):
         page = doc.load_page(i)
         text = page.get_text().strip()
         if not text:
-            pix = page.get_pixmap(dpi=200)
-            img_bytes = pix.tobytes()
-            text = ocr_image_bytes(img_bytes)
-
-        # Split text into sentences ending with a full stop for line numbers
-        sentences = re.split(r'(?<=[.!?])\s+', text)
-        lines_with_numbers = [{"line_number": idx+1, "text": line.strip()} 
-                              for idx, line in enumerate(sentences) if line.strip()]
-
-        pages.append({
-            "page": i+1,
-            "text": text,
-            "char_count": len(text),
-            "lines": lines_with_numbers
-        })
-        full.append(text)
-    doc.close()
-    return {"pages": pages, "text": "\n\n".join(full)}
+            scanned.append((len(texts), page.get_pixmap(dpi=200)))
+        texts.append(text)
+
+    if scanned:
+        ocr_results = ocr_image_arrays_detailed([pixmap_to_array(pix) for _, pix in scanned])
+        for (pos, _), res in zip(scanned, ocr_results):
+            texts[pos] = res["text"]
+            ocr[pos] = res
+            print(f"[DEBUG] OCR page {start + pos + 1}: engine={res['engine']} route={res['route']} confidence={res['confidence']}")
+
+    return [_page_dict(start + k + 1, text, ocr.get(k)) for k, text in enumerate(texts)]
+
+
+def _open_pdf(source: Union[str, bytes]):
+    # a path lets PyMuPDF read pages from disk on demand instead of from a bytes blob
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def iter_pdf_pages(source: Union[str, bytes], on_page: Optional[Callable[[int, int], None]] = None) -> Iterator[dict]:
+    """
+    Yield one page dict at a time so callers can process large PDFs
+    without holding every page's text in memory. `source` is a path or PDF bytes.
+    """
+    doc = _open_pdf(source)
+    try:
+        n_pages = len(doc)
+        for start in range(0, n_pages, OCR_BATCH_PAGES):
+            for page in _extract_pdf_pages(doc, start, min(start + OCR_BATCH_PAGES, n_pages)):
+                yield page
+                if on_page:
+                    on_page(page["page"], n_pages)
+    finally:
+        doc.close()
+
+
+# -------------------------------
+# Parallel PDF Extraction
+# -------------------------------
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _init_pdf_worker():
+    # one OCR engine per process; keep torch from oversubscribing the cores
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except Exception:
+        pass
+
+
+def _extract_pdf_page_range(path: str, start: int, end: int) -> List[dict]:
+    """Worker task: open the PDF independently and extract pages [start, end)."""
+    doc = fitz.open(path)
+    try:
+        return _extract_pdf_pages(doc, start, end)
+    finally:
+        doc.close()
+
+
+def _get_pdf_pool(workers: int) -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                # spawn: forking a process that already holds torch/OCR threads can deadlock
+                _pdf_pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_pdf_worker
+                )
+    return _pdf_pool
+
+
+def iter_pdf_pages_parallel(
+    path: str,
+    workers: int = PDF_WORKERS,
+    pages_per_task: int = PDF_PAGES_PER_TASK,
+    on_page: Optional[Callable[[int, int], None]] = None
+) -> Iterator[dict]:
+    """
+    Like iter_pdf_pages, but spreads page ranges of the PDF at `path` across a
+    process pool. Pages are yielded in order; at most 2 * workers ranges are
+    in flight so memory stays bounded.
+    """
+    with fitz.open(path) as doc:
+        n_pages = len(doc)
+    pool = _get_pdf_pool(workers)
+    ranges = iter([(s, min(s + pages_per_task, n_pages)) for s in range(0, n_pages, pages_per_task)])
+    in_flight = deque()
+    for start, end in islice(ranges, 2 * workers):
+        in_flight.append(pool.submit(_extract_pdf_page_range, path, start, end))
+    try:
+        while in_flight:
+            pages = in_flight.popleft().result()
+            nxt = next(ranges, None)
+            if nxt is not None:
+                in_flight.append(pool.submit(_extract_pdf_page_range, path, *nxt))
+            for page in pages:
+                yield page
+                if on_page:
+                    on_page(page["page"], n_pages)
+    finally:
+        for fut in in_flight:
+            fut.cancel()
+
+
+def extract_text_from_pdf_bytes(pdf_bytes: bytes, on_page: Optional[Callable[[int, int], None]] = None) -> dict:
+    pages = list(iter_pdf_pages(pdf_bytes, on_page=on_page))
+    return {"pages": pages, "text": "\n\n".join(p["text"] for p in pages)}
 
 
 def extract_text_from_docx_bytes(docx_bytes: bytes) -> dict:
-    doc = Document(io.BytesIO(docx_bytes))
-    paras = [p.text for p in doc.paragraphs if p.text.strip()]
+    return extract_text_from_docx_file(io.BytesIO(docx_bytes))
 
-    # Split paragraphs into sentences for line numbers
-    lines_with_numbers = []
-    line_counter = 1
-    for para in paras:
-        sentences = re.split(r'(?<=[.!?])\s+', para)
-        for sentence in sentences:
-            if sentence.strip():
-                lines_with_numbers.append({"line_number": line_counter, "text": sentence.strip()})
-                line_counter += 1
 
+def extract_text_from_docx_file(path) -> dict:
+    doc = Document(path)
+    paras = [p.text for p in doc.paragraphs if p.text.strip()]
     text = "\n\n".join(paras)
-    return {"pages": [{"page": 1, "text": text, "char_count": len(text), "lines": lines_with_numbers}],
+    return {"pages": [{"page": 1, "text": text, "char_count": len(text)}],
             "text": text}
 
 
@@ -132,68 +228,242 @@ def extract_text_from_docx_bytes(docx_bytes: bytes) -> dict:
 #         tmp.flush()
 #         return ocr_image_file(tmp.name)
 
-def ocr_image_bytes(img_bytes: bytes) -> str:
-    import tempfile
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-        tmp.write(img_bytes)
-        tmp.flush()
-        tmp_path = tmp.name
+def pixmap_to_array(pix) -> np.ndarray:
+    """View a PyMuPDF pixmap's samples as an (h, w, n) uint8 array without copying."""
+    return np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
 
-    try:
-        return ocr_image_file(tmp_path)
-    finally:
-        import os
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
 
-def ocr_image_file(path: str) -> str:
-    text = ""
+# Each OCR line is (box as 4 [x, y] points, text, confidence)
+OcrLine = Tuple[list, str, float]
+
 
-    # PaddleOCR for printed/machine text
-    if _paddle: 
+def classify_script(img: np.ndarray) -> str:
+    """
+    Cheap printed-vs-handwritten guess from the horizontal projection profile:
+    printed pages have clean blank rows between text lines, handwriting rarely does.
+    """
+    small = img[::4, ::4]
+    gray = small.mean(axis=2) if small.ndim == 3 else small
+    rows = (gray < 128).mean(axis=1)
+    inked = np.nonzero(rows > 0)[0]
+    if inked.size == 0:
+        return "printed"
+    band = rows[inked[0]:inked[-1] + 1]
+    gap_ratio = float((band < 0.002).mean())
+    return "printed" if gap_ratio >= OCR_HANDWRITING_GAP_RATIO else "handwritten"
+
+
+def _paddle_lines(paddle, img: np.ndarray) -> List[OcrLine]:
+    res = paddle.ocr(img, cls=True)
+    return [(line[0], line[1][0], float(line[1][1])) for block in res if block for line in block]
+
+
+def _easyocr_lines(reader, images: List[np.ndarray]) -> List[List[OcrLine]]:
+    # readtext_batched needs equally sized inputs, so batch per image shape
+    out = [[] for _ in images]
+    by_shape = {}
+    for i, img in enumerate(images):
+        by_shape.setdefault(img.shape, []).append(i)
+    for idxs in by_shape.values():
+        results = reader.readtext_batched([images[i] for i in idxs])
+        for i, res in zip(idxs, results):
+            out[i] = [(box, text, float(conf)) for (box, text, conf) in res]
+    return out
+
+
+def _detect_line_boxes(img: np.ndarray) -> List[list]:
+    """Text line boxes without recognition (used to crop handwriting for TrOCR)."""
+    paddle = registry.get_optional("paddleocr")
+    if paddle:
+        res = paddle.ocr(img, det=True, rec=False, cls=False)
+        return [box for block in res if block for box in block]
+    reader = registry.get_optional("easyocr")
+    if reader:
+        horizontal, _ = reader.detect(img)
+        return [[[x0, y0], [x1, y0], [x1, y1], [x0, y1]] for x0, x1, y0, y1 in horizontal[0]]
+    return []
+
+
+def _crop(img: np.ndarray, box: list, pad: int = 2) -> np.ndarray:
+    pts = np.asarray(box, dtype=np.float32)
+    h, w = img.shape[:2]
+    x0, y0 = np.floor(pts.min(axis=0)).astype(int) - pad
+    x1, y1 = np.ceil(pts.max(axis=0)).astype(int) + pad
+    return img[max(0, y0):min(h, y1), max(0, x0):min(w, x1)]
+
+
+def _trocr_texts(trocr, images: List[np.ndarray]) -> List[str]:
+    processor, model = trocr
+    out = []
+    for start in range(0, len(images), TROCR_BATCH_SIZE):
+        batch = [Image.fromarray(img).convert("RGB") for img in images[start:start + TROCR_BATCH_SIZE]]
+        pixel_values = processor(images=batch, return_tensors="pt").pixel_values
+        generated_ids = model.generate(pixel_values)
+        out.extend(t.strip() for t in processor.batch_decode(generated_ids, skip_special_tokens=True))
+    return out
+
+
+def ocr_image_arrays_detailed(images: List[np.ndarray]) -> List[Dict]:
+    """
+    OCR a batch of RGB uint8 arrays, routing each image to an engine:
+    - printed: PaddleOCR (EasyOCR if Paddle is missing or finds nothing); lines
+      below OCR_MIN_CONFIDENCE are re-read by TrOCR from their crop only
+    - handwritten: detect line boxes, then TrOCR on the crops
+    Returns one dict per image with text, engine, route and mean confidence.
+    """
+    results = [{"text": "", "engine": None, "route": classify_script(img), "confidence": None, "lines_rerouted": 0}
+               for img in images]
+    lines: List[List[OcrLine]] = [[] for _ in images]
+    crops = []  # (image index, line index or None for whole image, crop)
+
+    with stage_slot("ocr"):
+        # models are only fetched (and so loaded) when some image needs them
+        handwritten = any(r["route"] == "handwritten" for r in results)
+        trocr = registry.get_optional("trocr") if handwritten else None
+        for i, img in enumerate(images):
+            if results[i]["route"] != "handwritten" or not trocr:
+                continue
+            try:
+                boxes = _detect_line_boxes(img)
+            except Exception as e:
+                print(f"[WARN] text detection failed: {e}")
+                boxes = []
+            if boxes:
+                lines[i] = [(box, "", 0.0) for box in boxes]
+                crops.extend((i, j, _crop(img, box)) for j, box in enumerate(boxes))
+            else:
+                crops.append((i, None, img))
+            results[i]["engine"] = "trocr"
+
+        # PaddleOCR for printed/machine text (2.6 cannot batch detection, so one call per image)
+        printed = [i for i, r in enumerate(results) if r["engine"] is None]
+        paddle = registry.get_optional("paddleocr") if printed else None
+        if paddle:
+            for i in printed:
+                try:
+                    lines[i] = _paddle_lines(paddle, images[i])
+                    if lines[i]:
+                        results[i]["engine"] = "paddle"
+                except Exception as e:
+                    print(f"[WARN] PaddleOCR failed: {e}")
+
+        pending = [i for i in printed if not lines[i]]
+        reader = registry.get_optional("easyocr") if pending else None
+        if reader:
+            try:
+                for i, found in zip(pending, _easyocr_lines(reader, [images[i] for i in pending])):
+                    lines[i] = found
+                    if found:
+                        results[i]["engine"] = "easyocr"
+            except Exception as e:
+                print(f"[WARN] EasyOCR failed: {e}")
+
+        if printed and trocr is None and any(
+            not lines[i] or any(conf < OCR_MIN_CONFIDENCE for _, _, conf in lines[i]) for i in printed
+        ):
+            trocr = registry.get_optional("trocr")
+        if trocr:
+            for i in printed:
+                if not lines[i]:
+                    # nothing recognised at all: last resort, whole image through TrOCR
+                    crops.append((i, None, images[i]))
+                    results[i]["engine"] = "trocr"
+                    continue
+                low = [j for j, (_, _, conf) in enumerate(lines[i]) if conf < OCR_MIN_CONFIDENCE]
+                crops.extend((i, j, _crop(images[i], lines[i][j][0])) for j in low)
+
+            # TrOCR for handwritten and low-confidence lines, one batched pass
+            try:
+                texts = _trocr_texts(trocr, [c for _, _, c in crops]) if crops else []
+            except Exception as e:
+                print(f"[WARN] TrOCR failed: {e}")
+                texts = [""] * len(crops)
+            for (i, j, _), text in zip(crops, texts):
+                if j is None:
+                    lines[i] = [(None, text, 0.0)]
+                elif text:
+                    box, _, _ = lines[i][j]
+                    lines[i][j] = (box, text, OCR_MIN_CONFIDENCE)
+                    if results[i]["engine"] != "trocr":
+                        results[i]["lines_rerouted"] += 1
+
+    for i, r in enumerate(results):
+        found = [(t, c) for _, t, c in lines[i] if t.strip()]
+        r["text"] = " ".join(t.strip() for t, _ in found).strip()
+        if r["engine"] in ("paddle", "easyocr"):
+            r["confidence"] = round(sum(c for _, c in found) / len(found), 4) if found else None
+            if r["lines_rerouted"]:
+                r["engine"] += "+trocr"
+    return results
+
+
+def ocr_image_arrays(images: List[np.ndarray]) -> List[str]:
+    return [r["text"] for r in ocr_image_arrays_detailed(images)]
+
+
+def ocr_image_array(img: np.ndarray) -> str:
+    return ocr_image_arrays([img])[0]
+
+
+def compare_ocr_engines(img: np.ndarray) -> Dict[str, Dict]:
+    """
+    Run every available engine on the whole image (no routing) and report
+    text, mean confidence and latency, for evaluating engines on our own scans.
+    """
+    engines = {}
+    paddle = registry.get_optional("paddleocr")
+    reader = registry.get_optional("easyocr")
+    trocr = registry.get_optional("trocr")
+    if paddle:
+        engines["paddle"] = lambda: _paddle_lines(paddle, img)
+    if reader:
+        engines["easyocr"] = lambda: _easyocr_lines(reader, [img])[0]
+    if trocr:
+        engines["trocr"] = lambda: [(None, _trocr_texts(trocr, [img])[0], 0.0)]
+
+    report = {"route": {"engine": "routed", "route": classify_script(img)}}
+    for name, run in engines.items():
+        t0 = time.perf_counter()
         try:
-            res = _paddle.predict(path, cls=True)  # remove redundant lang param
-            lines = [line[1][0] for block in res for line in block]  # flatten all lines
-            text = " ".join(lines).strip()
-            print(res)
-            print(text)
-            if text:
-                return text
+            found = run()
+            error = None
         except Exception as e:
-            print(f"[WARN] PaddleOCR failed: {e}")
+            found, error = [], str(e)
+        confs = [c for _, _, c in found if name != "trocr"]
+        report[name] = {
+            "text": " ".join(t for _, t, _ in found).strip(),
+            "confidence": round(sum(confs) / len(confs), 4) if confs else None,
+            "seconds": round(time.perf_counter() - t0, 3),
+            "error": error,
+        }
+    t0 = time.perf_counter()
+    routed = ocr_image_arrays_detailed([img])[0]
+    report["route"].update(routed, seconds=round(time.perf_counter() - t0, 3))
+    return report
 
 
-    if _easy_reader:
-        try:
-            res = _easy_reader.readtext(path)  # runs OCR on the image
-            lines = [t for (_, t, _) in res]  # extract only the recognized text part from each result
-            text = " ".join(lines).strip()   # combine all text into a single string
-            print(f"text: {text}")
-            if text:
-                return text                  # return the extracted text if any
-        except Exception:
-            pass                               # ignore any errors
-
-
-    # TrOCR for handwritten
-    if _trocr_processor and _trocr_model:
-        try:
-            img = Image.open(path).convert("RGB")
-            pixel_values = _trocr_processor(images=img, return_tensors="pt").pixel_values
-            generated_ids = _trocr_model.generate(pixel_values)
-            generated_text = _trocr_processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-            print(generated_text)
-            if generated_text.strip():
-                return generated_text.strip()
-        except Exception as e:
-            print(f"[WARN] TrOCR failed: {e}")
+def ocr_image_bytes(img_bytes: bytes) -> str:
+    # decode once in memory; no temp file round trip
+    img = np.asarray(Image.open(io.BytesIO(img_bytes)).convert("RGB"))
+    return ocr_image_array(img)
 
-    return text
+
+def ocr_image_file(path: str) -> str:
+    img = np.asarray(Image.open(path).convert("RGB"))
+    return ocr_image_array(img)
 
 
 def extract_text_from_image_bytes(img_bytes: bytes) -> Dict:
-    text = ocr_image_bytes(img_bytes)
-    return {"pages":[{"page":1, "text":text, "char_count": len(text)}], "text": text}
+    return extract_text_from_image_file(io.BytesIO(img_bytes))
+
+
+def extract_text_from_image_file(path) -> Dict:
+    # PIL decodes straight from the file; the raw bytes are never held separately
+    img = np.asarray(Image.open(path).convert("RGB"))
+    res = ocr_image_arrays_detailed([img])[0]
+    text = res["text"]
+    return {"pages":[{"page":1, "text":text, "char_count": len(text), "ocr_engine": res["engine"],
+                      "ocr_route": res["route"], "ocr_confidence": res["confidence"]}], "text": text}
 
 
 # -------------------------------
@@ -244,16 +514,28 @@ def transcribe_audio_bytes(audio_bytes: bytes, whisper_model) -> dict:
             tmp.flush()
             tmp_path = tmp.name
 
-        res = whisper_model.transcribe(tmp_path, task="translate")
-
-        segments = res.get("segments", [])
-        # Each segment has: start, end, text
-
-        return {
-            "text": res.get("text", ""),
-            "segments": segments,
-            "detected_language": res.get("language", "unknown")
-        }
+        return transcribe_audio_file(tmp_path, whisper_model)
     finally:
         if tmp_path and os.path.exists(tmp_path):
             os.unlink(tmp_path)
+
+
+def transcribe_audio_file(path: str, whisper_model) -> dict:
+    """
+    Transcribe an audio file on disk using Whisper (which streams it through ffmpeg).
+    Returns text, segments, and timestamps.
+    """
+    if whisper_model is None:
+        raise RuntimeError("No ASR model available.")
+
+    res = whisper_model.transcribe(path, task="translate")
+
+    text = res.get("text", "")
+    # Each segment has: start, end, text (+ char_start/char_end into `text`)
+    segments = segment_offsets(text, res.get("segments", []))
+
+    return {
+        "text": text,
+        "segments": segments,
+        "detected_language": res.get("language", "unknown")
+    }
@@ -1,58 +1,434 @@
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.http import models as rest
 from qdrant_client.http.models import PointStruct
+import asyncio
+import functools
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
 
+import numpy as np
 from shapely import points
 
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION", "documents")
-client = QdrantClient(url=QDRANT_URL.split("://")[-1] if "://" in QDRANT_URL else QDRANT_URL, prefer_grpc=False)
+from .config import (
+    INDEX_BACKEND,
+    TEXT_VECTOR_NAME,
+    IMAGE_VECTOR_NAME,
+    QDRANT_PREFER_GRPC,
+    QDRANT_GRPC_PORT,
+    QDRANT_PROFILE,
+    UPSERT_BATCH_SIZE,
+    UPSERT_PARALLEL,
+    UPSERT_WAIT,
+)
+from . import documents, lexical, local_index
+
+# INDEX_BACKEND=local keeps vectors in-process (local_index.py) instead of Qdrant;
+# every function below that touches vectors dispatches on it.
+_local = INDEX_BACKEND == "local"
+
+try:
+    import grpc  # noqa: F401  (qdrant-client's gRPC transport)
+    _use_grpc = QDRANT_PREFER_GRPC
+except ImportError:
+    _use_grpc = False
+client = QdrantClient(
+    url=QDRANT_URL.split("://")[-1] if "://" in QDRANT_URL else QDRANT_URL,
+    prefer_grpc=_use_grpc,
+    grpc_port=QDRANT_GRPC_PORT
+)
+# upsert requests run on a small pool so several batches are in flight at once
+_upsert_pool = ThreadPoolExecutor(max_workers=max(1, UPSERT_PARALLEL), thread_name_prefix="qdrant-upsert")
+# doc_id no point ever has; deleting it with wait=True is the consistency barrier
+_BARRIER_DOC_ID = "__barrier__"
+
+# -------------------------------
+# Collection profiles
+# -------------------------------
+# Memory/recall trade-offs for the collection. Quantized vectors stay in RAM for
+# the HNSW walk; with `vectors_on_disk` the float32 originals are only read
+# from disk to rescore the top `oversampling * limit` candidates.
+COLLECTION_PROFILES = {
+    # everything in RAM, float32 only: lowest latency, most memory
+    "fast": {
+        "quantization": None,
+        "vectors_on_disk": False,
+        "payload_on_disk": False,
+        "hnsw_m": 16,
+        "hnsw_ef_construct": 100,
+        "search_ef": 64,
+        "rescore": False,
+        "oversampling": None,
+    },
+    # int8 in RAM (~4x smaller), originals + payload on disk, rescored
+    "balanced": {
+        "quantization": "scalar",
+        "vectors_on_disk": True,
+        "payload_on_disk": True,
+        "hnsw_m": 16,
+        "hnsw_ef_construct": 128,
+        "search_ef": 128,
+        "rescore": True,
+        "oversampling": 2.0,
+    },
+    # 1 bit per dimension in RAM (~32x smaller) and a sparser graph; needs
+    # heavier oversampling, and recall drops faster on CLIP's 512-d vectors
+    "compact": {
+        "quantization": "binary",
+        "vectors_on_disk": True,
+        "payload_on_disk": True,
+        "hnsw_m": 8,
+        "hnsw_ef_construct": 100,
+        "search_ef": 128,
+        "rescore": True,
+        "oversampling": 3.0,
+    },
+}
+
+
+def collection_profile(name: str = QDRANT_PROFILE) -> dict:
+    if name not in COLLECTION_PROFILES:
+        raise ValueError(f"Unknown collection profile '{name}' (expected one of {', '.join(COLLECTION_PROFILES)})")
+    return COLLECTION_PROFILES[name]
+
+def _quantization_config(profile: dict):
+    if profile["quantization"] == "scalar":
+        return rest.ScalarQuantization(
+            scalar=rest.ScalarQuantizationConfig(type=rest.ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if profile["quantization"] == "binary":
+        return rest.BinaryQuantization(binary=rest.BinaryQuantizationConfig(always_ram=True))
+    return None
+
+def _hnsw_config(profile: dict) -> rest.HnswConfigDiff:
+    return rest.HnswConfigDiff(m=profile["hnsw_m"], ef_construct=profile["hnsw_ef_construct"])
+
+def search_params(profile: dict, hnsw_ef: Optional[int] = None, rescore: Optional[bool] = None) -> rest.SearchParams:
+    """Search-time knobs matching `profile` (explicit arguments win)."""
+    quantization = None
+    if profile["quantization"]:
+        quantization = rest.QuantizationSearchParams(
+            ignore=False,
+            rescore=profile["rescore"] if rescore is None else rescore,
+            oversampling=profile["oversampling"]
+        )
+    return rest.SearchParams(hnsw_ef=hnsw_ef or profile["search_ef"], quantization=quantization)
 
 # create collection if not exists
-def ensure_collection(dim: int = 384):
+def ensure_collection(text_dim: int, image_dim: int, profile_name: str = QDRANT_PROFILE):
+    """
+    One collection with a named vector per modality: TEXT_VECTOR_NAME at the
+    text model's native size and IMAGE_VECTOR_NAME at CLIP's. A new collection
+    gets the storage settings of `profile_name`; an existing one is left as is
+    (see apply_profile). The local backend ignores profiles.
+    """
+    if _local:
+        local_index.ensure_vectors({TEXT_VECTOR_NAME: text_dim, IMAGE_VECTOR_NAME: image_dim})
+        return
     try:
-        client.get_collection(collection_name=COLLECTION_NAME)
+        info = client.get_collection(collection_name=COLLECTION_NAME)
     except Exception:
+        profile = collection_profile(profile_name)
+        vector_params = lambda size: rest.VectorParams(
+            size=size,
+            distance=rest.Distance.COSINE,
+            on_disk=profile["vectors_on_disk"],
+            hnsw_config=_hnsw_config(profile)
+        )
         client.recreate_collection(
             collection_name=COLLECTION_NAME,
-            vectors_config=rest.VectorParams(size=dim, distance=rest.Distance.COSINE)
+            vectors_config={
+                TEXT_VECTOR_NAME: vector_params(text_dim),
+                IMAGE_VECTOR_NAME: vector_params(image_dim),
+            },
+            on_disk_payload=profile["payload_on_disk"],
+            quantization_config=_quantization_config(profile)
+        )
+        ensure_payload_indexes()
+        return
+    vectors = info.config.params.vectors
+    if not isinstance(vectors, dict) or TEXT_VECTOR_NAME not in vectors or IMAGE_VECTOR_NAME not in vectors:
+        raise RuntimeError(
+            f"Collection '{COLLECTION_NAME}' has no '{TEXT_VECTOR_NAME}'/'{IMAGE_VECTOR_NAME}' named vectors; "
+            "run qdrant.py to recreate it."
         )
+    if vectors[TEXT_VECTOR_NAME].size != text_dim or vectors[IMAGE_VECTOR_NAME].size != image_dim:
+        raise RuntimeError(
+            f"Collection '{COLLECTION_NAME}' vector sizes ({vectors[TEXT_VECTOR_NAME].size}, "
+            f"{vectors[IMAGE_VECTOR_NAME].size}) don't match the models ({text_dim}, {image_dim}); "
+            "run qdrant.py to recreate it."
+        )
+    ensure_payload_indexes()
+
+def apply_profile(profile_name: str):
+    """
+    Switch an existing collection to `profile_name` in place. Qdrant rebuilds
+    the quantized vectors / HNSW graph in the background; points stay searchable.
+    """
+    if _local:
+        raise RuntimeError("Collection profiles only apply to the Qdrant backend (INDEX_BACKEND=qdrant).")
+    profile = collection_profile(profile_name)
+    diff = rest.VectorParamsDiff(on_disk=profile["vectors_on_disk"], hnsw_config=_hnsw_config(profile))
+    client.update_collection(
+        collection_name=COLLECTION_NAME,
+        vectors_config={TEXT_VECTOR_NAME: diff, IMAGE_VECTOR_NAME: diff},
+        collection_params=rest.CollectionParamsDiff(on_disk_payload=profile["payload_on_disk"]),
+        quantization_config=_quantization_config(profile) or rest.Disabled.DISABLED
+    )
+
+# payload fields that /query can filter on
+PAYLOAD_INDEXES = {
+    "doc_id": rest.PayloadSchemaType.KEYWORD,
+    "filename": rest.PayloadSchemaType.KEYWORD,
+    "source_type": rest.PayloadSchemaType.KEYWORD,
+    "ocr_engine": rest.PayloadSchemaType.KEYWORD,
+    "page_number": rest.PayloadSchemaType.INTEGER,
+}
+
+def ensure_payload_indexes():
+    """Create the filterable payload indexes (a no-op for ones that already exist)."""
+    for field, schema in PAYLOAD_INDEXES.items():
+        client.create_payload_index(collection_name=COLLECTION_NAME, field_name=field, field_schema=schema)
+
+def build_filter(filters: Optional[dict]) -> Optional[rest.Filter]:
+    """
+    filters: {"doc_id": [...], "filename": [...], "source_type": [...], "ocr_engine": [...],
+              "page_from": int, "page_to": int} (every key optional)
+    """
+    if not filters:
+        return None
+    must = []
+    for field in ("doc_id", "filename", "source_type", "ocr_engine"):
+        values = filters.get(field)
+        if values:
+            must.append(rest.FieldCondition(key=field, match=rest.MatchAny(any=list(values))))
+    if filters.get("page_from") is not None or filters.get("page_to") is not None:
+        must.append(rest.FieldCondition(
+            key="page_number",
+            range=rest.Range(gte=filters.get("page_from"), lte=filters.get("page_to"))
+        ))
+    return rest.Filter(must=must) if must else None
+
+def _send_batch(ids: List[str], block: np.ndarray, payloads: List[dict], vector_name: str, wait: bool):
+    # one float conversion for the whole block, done on the sender thread
+    rows = block.tolist()
+    client.upsert(
+        collection_name=COLLECTION_NAME,
+        points=[
+            PointStruct(id=pid, vector={vector_name: row}, payload=payload)
+            for pid, row, payload in zip(ids, rows, payloads)
+        ],
+        wait=wait
+    )
+
+def upsert_batch(
+    vectors,
+    payloads: Sequence[dict],
+    vector_name: str = TEXT_VECTOR_NAME,
+    wait: bool = UPSERT_WAIT,
+    batch_size: int = UPSERT_BATCH_SIZE
+) -> List[str]:
+    """
+    Bulk upsert: `vectors` is an (n, dim) matrix (NumPy array or list of rows),
+    `payloads` the n matching payloads. Points are sent in `batch_size` slices,
+    UPSERT_PARALLEL requests at a time. With wait=False Qdrant only acknowledges
+    each batch; call consistency_barrier() before relying on them being searchable.
+    Returns the point ids.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if len(matrix) != len(payloads):
+        raise ValueError(f"{len(matrix)} vectors but {len(payloads)} payloads")
+    if not len(matrix):
+        return []
+
+    ids = []
+    lexical_rows = []
+    for payload in payloads:
+        if "text" not in payload:
+            payload["text"] = ""
+        pid = point_id(payload)
+        ids.append(pid)
+        if vector_name == TEXT_VECTOR_NAME and payload["text"]:
+            lexical_rows.append((pid, payload.get("doc_id"), payload["text"], payload))
+
+    t0 = time.perf_counter()
+    if _local:
+        local_index.upsert(vector_name, ids, matrix, payloads)
+        batches = 1
+    else:
+        futures = [
+            _upsert_pool.submit(
+                _send_batch, ids[i:i + batch_size], matrix[i:i + batch_size], list(payloads[i:i + batch_size]),
+                vector_name, wait
+            )
+            for i in range(0, len(ids), max(1, batch_size))
+        ]
+        for f in futures:
+            f.result()
+        batches = len(futures)
+    secs = time.perf_counter() - t0
+    print(f"[DEBUG] Upserted {len(ids)} points to {INDEX_BACKEND} in {batches} batches "
+          f"({len(ids) / secs if secs > 0 else 0.0:.0f} points/sec, wait={wait})")
+    # keep the BM25 index in step with the dense one
+    lexical.add_chunks(lexical_rows)
+    return ids
 
-def upsert_documents(items: list, vector_dim: int):
+def upsert_documents(items: list, wait: bool = UPSERT_WAIT):
     """
     items: list of dicts with structure:
     {
         'id': str,
-        'embedding': list[float],
+        'embedding': list[float] | np.ndarray,
+        'vector_name': str,  # optional, TEXT_VECTOR_NAME or IMAGE_VECTOR_NAME (default text)
         'payload': dict  # contains 'text' key
     }
+    Items are grouped by vector name and sent through upsert_batch.
     """
-    import uuid
-    from qdrant_client.http.models import PointStruct
-    points = []
+    ids = {}
+    groups = {}
     for idx, it in enumerate(items):
-        # Ensure valid UUID for point ID
-        pid = str(uuid.uuid5(uuid.UUID(it.get("doc_id")), str(idx))) if "doc_id" in it else str(uuid.uuid4())
-        embedding = it["embedding"]
-        if hasattr(embedding, "tolist"):
-            embedding = embedding.tolist()
-        payload = it.get("payload", {})
-        if "text" not in payload:
-            payload["text"] = ""
-        points.append(PointStruct(
-            id=pid,
-            vector=embedding,
-            payload=payload
-        ))
+        groups.setdefault(it.get("vector_name", TEXT_VECTOR_NAME), []).append((idx, it))
+    for vector_name, group in groups.items():
+        group_ids = upsert_batch(
+            [it["embedding"] for _, it in group],
+            [it.get("payload", {}) for _, it in group],
+            vector_name=vector_name,
+            wait=wait
+        )
+        ids.update(zip((idx for idx, _ in group), group_ids))
+    return [ids[i] for i in range(len(items))]
+
+def consistency_barrier():
+    """
+    Block until every upsert sent so far (including wait=False ones) is applied.
+    Qdrant applies a collection's updates in order, so one waited no-op write
+    queued behind them is enough. Local writes are synchronous already.
+    """
+    if _local:
+        return
+    client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=rest.FilterSelector(filter=_doc_filter(_BARRIER_DOC_ID)),
+        wait=True
+    )
+
+def point_id(payload: dict) -> str:
+    """
+    Stable point id: from (doc_id, chunk_hash) for text chunks, so an unchanged
+    chunk keeps its id when a revised document is re-indexed, else from
+    (doc_id, chunk_index). Re-upserting a chunk overwrites it.
+    """
+    if payload.get("doc_id") is not None and payload.get("chunk_hash"):
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{payload['doc_id']}/{payload['chunk_hash']}"))
+    if payload.get("doc_id") is not None and payload.get("chunk_index") is not None:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{payload['doc_id']}/{payload['chunk_index']}"))
+    return str(uuid.uuid4())
 
+def _doc_filter(doc_id: str) -> rest.Filter:
+    return rest.Filter(must=[rest.FieldCondition(key="doc_id", match=rest.MatchValue(value=doc_id))])
+
+def count_document_chunks(doc_id: str) -> int:
+    """Number of points indexed for `doc_id` (0 if none or the collection doesn't exist yet)."""
+    if _local:
+        return local_index.count(doc_id)
+    try:
+        return client.count(collection_name=COLLECTION_NAME, count_filter=_doc_filter(doc_id), exact=True).count
+    except Exception:
+        return 0
 
-    print(f"[DEBUG] Upserting {len(points)} points to Qdrant")
-    client.upsert(collection_name=COLLECTION_NAME, points=points)
+def delete_document(doc_id: str):
+    if _local:
+        local_index.delete_document(doc_id)
+    else:
+        client.delete(
+            collection_name=COLLECTION_NAME,
+            points_selector=rest.FilterSelector(filter=_doc_filter(doc_id))
+        )
+    lexical.delete_document(doc_id)
 
-def search(query_vector, top_k=5):
-    res = client.search(collection_name=COLLECTION_NAME, query_vector=query_vector, limit=top_k)
+def document_points(doc_id: str) -> dict:
+    """{point_id: payload} for every point indexed under `doc_id`."""
+    if _local:
+        return local_index.document_points(doc_id)
+    out = {}
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=_doc_filter(doc_id),
+            limit=1000,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False
+        )
+        out.update((str(r.id), r.payload) for r in records)
+        if offset is None:
+            return out
+
+def update_payloads(payloads: dict):
+    """Replace the payload of existing points ({point_id: payload}); vectors are untouched."""
+    if not payloads:
+        return
+    if _local:
+        local_index.update_payloads(payloads)
+    else:
+        client.batch_update_points(
+            collection_name=COLLECTION_NAME,
+            update_operations=[
+                rest.OverwritePayloadOperation(overwrite_payload=rest.SetPayload(payload=payload, points=[pid]))
+                for pid, payload in payloads.items()
+            ]
+        )
+    lexical.update_payloads(payloads)
+
+def delete_points(ids: list):
+    if not ids:
+        return
+    if _local:
+        local_index.delete_points(ids)
+    else:
+        client.delete(collection_name=COLLECTION_NAME, points_selector=rest.PointIdsList(points=list(ids)))
+    lexical.delete_points(ids)
+
+def drop_collection():
+    """Delete every indexed vector and payload, the BM25 index and the document records (qdrant.py's reset)."""
+    if _local:
+        local_index.drop()
+    else:
+        client.delete_collection(collection_name=COLLECTION_NAME)
+    lexical.clear()
+    documents.clear()
+
+def search(
+    query_vector,
+    top_k=5,
+    vector_name: str = TEXT_VECTOR_NAME,
+    filters: Optional[dict] = None,
+    hnsw_ef: Optional[int] = None,
+    rescore: Optional[bool] = None
+):
+    """`hnsw_ef` / `rescore` override the QDRANT_PROFILE search defaults (Qdrant backend)."""
+    if _local:
+        return local_index.search(vector_name, query_vector, top_k=top_k, filters=filters)
+    res = client.search(**_search_request(query_vector, top_k, vector_name, filters, hnsw_ef, rescore))
+    return _hits(res)
+
+def _search_request(query_vector, top_k, vector_name, filters, hnsw_ef, rescore) -> dict:
+    return dict(
+        collection_name=COLLECTION_NAME,
+        query_vector=rest.NamedVector(name=vector_name, vector=query_vector),
+        query_filter=build_filter(filters),
+        search_params=search_params(collection_profile(), hnsw_ef=hnsw_ef, rescore=rescore),
+        limit=top_k
+    )
+
+def _hits(res) -> list:
     out = []
     for hit in res:
         out.append({
@@ -62,3 +438,44 @@ def search(query_vector, top_k=5):
             "metadata": hit.payload
         })
     return out
+
+# -------------------------------
+# Async search (query path)
+# -------------------------------
+# The event loop must not block on Qdrant while other queries are in flight, so
+# /query searches through an AsyncQdrantClient (pooled HTTP/gRPC connections).
+# It is created on first use, inside the running loop.
+_async_client = None
+
+def _get_async_client() -> AsyncQdrantClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncQdrantClient(
+            url=QDRANT_URL.split("://")[-1] if "://" in QDRANT_URL else QDRANT_URL,
+            prefer_grpc=_use_grpc,
+            grpc_port=QDRANT_GRPC_PORT
+        )
+    return _async_client
+
+async def search_async(
+    query_vector,
+    top_k=5,
+    vector_name: str = TEXT_VECTOR_NAME,
+    filters: Optional[dict] = None,
+    hnsw_ef: Optional[int] = None,
+    rescore: Optional[bool] = None
+):
+    """search() without blocking the event loop. The local backend runs on the loop's default executor."""
+    if _local:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(local_index.search, vector_name, query_vector, top_k=top_k, filters=filters)
+        )
+    res = await _get_async_client().search(**_search_request(query_vector, top_k, vector_name, filters, hnsw_ef, rescore))
+    return _hits(res)
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
@@ -1,306 +1,424 @@
 # app/ingest.py
+import hashlib
 import os
-import whisper
-from fastapi import UploadFile
+import time
+from collections import Counter
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from pydub.utils import which
 
-from .utils import save_upload, chunk_text_by_words
+from .utils import store_upload, discard_upload, stored_files, remove_stored_files
+from .chunking import iter_token_chunks
+from . import provenance
+from .embed_cache import normalize_text
 from .extractors import (
-    extract_text_from_pdf_bytes,
-    extract_text_from_docx_bytes,
-    extract_text_from_image_bytes,
-    transcribe_audio_bytes
+    iter_pdf_pages,
+    iter_pdf_pages_parallel,
+    extract_text_from_docx_file,
+    extract_text_from_image_file,
+    transcribe_audio_file
 )
-from .embeddings import embed_text, embed_image_bytes
-from .indexer import upsert_documents
-from .config import CHUNK_SIZE, CHUNK_OVERLAP, VECTOR_DIM
-
-# -------------------------------
-# Load Whisper model once globally
-# -------------------------------
-_whisper_model = whisper.load_model("small")  # You can change "small" → "medium", "large", etc.
-
-def process_upload(
-    file: UploadFile
-    # whisper_model=_whisper_model,
-    # ffmpeg_path="C:/ffmpeg/bin/ffmpeg.exe",
-    # ffprobe_path="C:/ffmpeg/bin/ffprobe.exe"
+from .embeddings import (
+    embed_texts,
+    embed_image_file,
+    text_embedding_dim,
+    image_embedding_dim,
+    text_max_tokens,
+    count_tokens,
+    token_offsets
+)
+from .indexer import (
+    ensure_collection,
+    upsert_batch,
+    upsert_documents,
+    consistency_barrier,
+    count_document_chunks,
+    delete_document,
+    delete_points,
+    document_points,
+    point_id,
+    update_payloads
+)
+from .jobs import stage_slot
+from . import documents, registry
+from .config import CHUNK_OVERLAP_TOKENS, INGEST_WINDOW, PDF_WORKERS, IMAGE_VECTOR_NAME
+
+
+def find_indexed_document(content_hash: str) -> Optional[Dict]:
+    """Result dict for the document that holds this content, if it is indexed, else None."""
+    doc_id = documents.owner(content_hash)
+    chunks = count_document_chunks(doc_id) if doc_id else 0
+    if not chunks:
+        return None
+    return {"doc_id": doc_id, "chunks_indexed": chunks, "duplicate": True}
+
+
+_collection_ready = False
+
+
+def _ensure_index():
+    """Create/validate the collection once per process, sized from the loaded models."""
+    global _collection_ready
+    if not _collection_ready:
+        ensure_collection(text_embedding_dim(), image_embedding_dim())
+        _collection_ready = True
+
+
+def _noop_progress(stage: Optional[str] = None, **progress):
+    pass
+
+
+def _windows(iterable: Iterable, size: int) -> Iterator[List]:
+    """Group an iterator into lists of at most `size` items."""
+    it = iter(iterable)
+    while True:
+        window = list(islice(it, size))
+        if not window:
+            return
+        yield window
+
+
+def _chunk_hash(text: str, seen: Counter) -> str:
+    # content hash of the chunk, suffixed with its occurrence number so
+    # repeated boilerplate within one document still gets distinct ids
+    h = hashlib.sha256(normalize_text(text).encode()).hexdigest()[:32]
+    n = seen[h]
+    seen[h] += 1
+    return f"{h}-{n}" if n else h
+
+
+def _new_stats() -> Dict:
+    return {"chunks": 0, "embedded": 0, "updated": 0, "unchanged": 0,
+            "embed_secs": 0.0, "upsert_secs": 0.0, "ids": set(), "moved": set(), "ocr_pages": Counter()}
+
+
+def _ocr_fields(ocr_pages: Dict[int, Dict], pages: Iterable[int]) -> Dict:
+    # engine / route / lowest confidence over the OCR'd pages a chunk spans (all None for text-layer pages)
+    found = [ocr_pages[p] for p in pages if p in ocr_pages]
+    confidences = [f["ocr_confidence"] for f in found if f.get("ocr_confidence") is not None]
+    return {
+        "ocr_engine": ",".join(sorted({f["ocr_engine"] for f in found if f.get("ocr_engine")})) or None,
+        "ocr_route": ",".join(sorted({f["ocr_route"] for f in found})) or None,
+        "ocr_confidence": min(confidences) if confidences else None,
+    }
+
+
+def _index_page_stream(
+    pages: Iterable[Dict],
+    doc_id: str,
+    filename: str,
+    progress: Callable[..., None],
+    segments: Optional[List[Dict]] = None,
+    existing: Optional[Dict[str, Dict]] = None,
+    stats: Optional[Dict] = None
+) -> Dict:
+    """
+    Chunk -> embed -> upsert a page stream in windows of INGEST_WINDOW chunks,
+    so memory stays bounded and early pages become searchable right away.
+    With `existing` ({point_id: payload} already indexed for doc_id) only chunks
+    whose hash isn't indexed yet are embedded and upserted; known chunks whose
+    position/provenance moved just get their payload rewritten.
+    Returns counters, timings, the ids of every chunk in the stream and the
+    ids whose payload was rewritten ("moved"). Pass `stats` (from _new_stats)
+    to see how far a run got if it fails.
+    """
+    if stats is None:
+        stats = _new_stats()
+    seen_hashes = Counter()
+
+    # page / line / audio-segment intervals, filled in as the chunker reads the pages
+    table = provenance.new_table()
+    if segments:
+        provenance.add_segments(table, segments)  # audio is a single page at offset 0
+
+    # OCR details of the pages read so far, for the payloads of the chunks they end up in
+    ocr_pages: Dict[int, Dict] = {}
+
+    def tracked(pages):
+        for page in pages:
+            if page.get("ocr_route") is not None:
+                ocr_pages[page["page"]] = page
+                stats["ocr_pages"][page.get("ocr_engine") or "none"] += 1
+            yield page
+
+    # sentence-aligned chunks sized to what the embedding model actually reads
+    chunk_stream = iter_token_chunks(
+        tracked(pages), count_tokens, text_max_tokens(), CHUNK_OVERLAP_TOKENS, token_offsets=token_offsets, table=table
+    )
+    for window in _windows(chunk_stream, INGEST_WINDOW):
+        payloads = []
+        for offset, c in enumerate(window):
+            chunk = c["text"]
+            payloads.append({
+                "text": chunk,
+                "filename": filename,
+                "doc_id": doc_id,
+                "chunk_index": stats["chunks"] + offset,
+                "chunk_hash": _chunk_hash(chunk, seen_hashes),
+                "source_type": "audio" if segments is not None else "text",
+                "char_start": c["start"],
+                "char_end": c["end"],
+                # page_range, page_number, line_range, audio_start, audio_end
+                **provenance.locate(table, c["start"], c["end"]),
+                # ocr_engine, ocr_route, ocr_confidence
+                **_ocr_fields(ocr_pages, c["pages"])
+            })
+        stats["chunks"] += len(payloads)
+
+        ids = [point_id(p) for p in payloads]
+        stats["ids"].update(ids)
+        if existing is None:
+            todo = payloads
+            moved = {}
+        else:
+            todo = [p for pid, p in zip(ids, payloads) if pid not in existing]
+            moved = {pid: p for pid, p in zip(ids, payloads) if pid in existing and existing[pid] != p}
+            stats["unchanged"] += len(payloads) - len(todo) - len(moved)
+
+        if todo:
+            # Embed the new chunks in batched forward passes
+            progress(stage="embedding")
+            t0 = time.perf_counter()
+            with stage_slot("embedding"):
+                embeddings = embed_texts([p["text"] for p in todo])
+            stats["embed_secs"] += time.perf_counter() - t0
+
+            # the embedding matrix goes to Qdrant as-is, in parallel batches
+            progress(stage="indexing")
+            t0 = time.perf_counter()
+            upsert_batch(embeddings, todo)
+            stats["upsert_secs"] += time.perf_counter() - t0
+            stats["embedded"] += len(todo)
+        if moved:
+            stats["moved"].update(moved)
+            update_payloads(moved)
+            stats["updated"] += len(moved)
+        progress(chunks_done=stats["chunks"])
+
+    return stats
+
+
+def process_saved_upload(
+    path: str,
+    doc_id: str,
+    filename: str,
+    content_type: Optional[str] = None,
+    progress: Callable[..., None] = _noop_progress,
+    replace: bool = False,
+    incremental: bool = False
 ):
     """
-    Handles uploaded file ingestion:
-    1. Save file
-    2. Extract text (PDF, DOCX, Image, Audio)
-    3. Chunk text
-    4. Embed text + images
-    5. Upsert into Qdrant
+    Handles ingestion of an already saved upload:
+    1. Extract text (PDF, DOCX, Image, Audio) as a stream of pages
+    2. Chunk text
+    3. Embed text + images
+    4. Upsert into Qdrant
+
+    Steps 2-4 run in fixed-size windows over the page stream, so a large PDF
+    is indexed progressively with bounded memory.
+    `progress(stage=..., **counters)` is called as the pipeline advances
+    (used by the background job queue to report status).
+    With `replace`, points already indexed for doc_id are dropped first.
+    With `incremental`, the new content is diffed against what doc_id has
+    indexed (by chunk hash): only new chunks are embedded, moved ones get
+    their payload updated and chunks no longer present are deleted. If an
+    incremental run fails, it is rolled back: chunks it added are deleted,
+    rewritten payloads are restored and an overwritten image vector is
+    re-embedded from doc_id's stored file, so the previous version stays
+    indexed.
     """
-    whisper_model = _whisper_model
     # ffmpeg_path = ffmpeg_path or which("ffmpeg")
     # ffprobe_path = ffprobe_path or which("ffprobe")
 
+    stats = _new_stats()
+    existing = None
     try:
-        # -------------------------------
-        # 1️⃣ Save uploaded file
-        # -------------------------------
-        path, doc_id = save_upload(file)
-        with open(path, "rb") as f:
-            file_bytes = f.read()
+        _ensure_index()
+        if replace:
+            delete_document(doc_id)
+        existing = document_points(doc_id) if incremental else None
 
-        mimetype = (file.content_type or "").lower()
+        mimetype = (content_type or "").lower()
         ext = os.path.splitext(path)[1].lower()
-        print(f"[DEBUG] Received file: {file.filename}, mimetype={mimetype}, ext={ext}")
+        print(f"[DEBUG] Received file: {filename}, mimetype={mimetype}, ext={ext}")
 
         # -------------------------------
-        # 2️⃣ Extract text based on file type
+        # 1️⃣ Extract text based on file type
         # -------------------------------
+        progress(stage="extracting")
         text = ""
+        segments = None
+        is_image = False
         if "application/pdf" in mimetype or ext == ".pdf":
-            extracted = extract_text_from_pdf_bytes(file_bytes)
-            text = extracted.get("text", "")
-        elif "application/vnd.openxmlformats-officedocument.wordprocessingml.document" in mimetype or ext in (".docx", ".doc"):
-            extracted = extract_text_from_docx_bytes(file_bytes)
-            text = extracted.get("text", "")
-        elif mimetype.startswith("image") or ext in (".png", ".jpg", ".jpeg"):
-            extracted = extract_text_from_image_bytes(file_bytes)
-            text = extracted.get("text", "")
-            print(f"extracted: {text}")
-        elif mimetype.startswith("audio") or ext in (".wav", ".mp3", ".m4a"):
-            trans = transcribe_audio_bytes(file_bytes, whisper_model)
-            extracted = {
-                "pages": [{"page": 1, "text": trans["text"], "char_count": len(trans["text"])}],
-                "text": trans["text"]
-            }
-            text = trans["text"]
+            # pages are pulled lazily by the chunker below
+            on_page = lambda done, total: progress(pages_done=done, pages_total=total)
+            if PDF_WORKERS > 1:
+                pages = iter_pdf_pages_parallel(path, workers=PDF_WORKERS, on_page=on_page)
+            else:
+                pages = iter_pdf_pages(path, on_page=on_page)
         else:
-            raise ValueError(f"Unsupported file type: mimetype={mimetype}, ext={ext}")
-
-        if not text.strip():
-            raise ValueError("No text extracted from the uploaded file.")
+            if "application/vnd.openxmlformats-officedocument.wordprocessingml.document" in mimetype or ext in (".docx", ".doc"):
+                extracted = extract_text_from_docx_file(path)
+            elif mimetype.startswith("image") or ext in (".png", ".jpg", ".jpeg"):
+                progress(stage="ocr")
+                extracted = extract_text_from_image_file(path)
+                is_image = True
+                print(f"extracted: {extracted.get('text', '')}")
+            elif mimetype.startswith("audio") or ext in (".wav", ".mp3", ".m4a"):
+                progress(stage="transcribing")
+                with stage_slot("asr"):
+                    # Whisper is shared process-wide via the registry (WHISPER_MODEL picks the size)
+                    trans = transcribe_audio_file(path, registry.get_optional("whisper"))
+                extracted = {
+                    "pages": [{"page": 1, "text": trans["text"], "char_count": len(trans["text"])}],
+                    "text": trans["text"],
+                    "segments": trans["segments"]  # with char offsets, for audio_start/audio_end
+                }
+            else:
+                raise ValueError(f"Unsupported file type: mimetype={mimetype}, ext={ext}")
 
-        print(f"[DEBUG] Extracted text length: {len(text)}")
+            text = extracted.get("text", "")
+            if not text.strip():
+                raise ValueError("No text extracted from the uploaded file.")
+            print(f"[DEBUG] Extracted text length: {len(text)}")
+            pages = extracted.get("pages", [])
+            segments = extracted.get("segments")
 
         # -------------------------------
-        # 3️⃣ Chunk text
+        # 2️⃣-4️⃣ Chunk, embed and upsert window by window
         # -------------------------------
-        # chunks = chunk_text_by_words(text, CHUNK_SIZE, CHUNK_OVERLAP)
-        # print(f"[DEBUG] Number of text chunks: {len(chunks)}")
-
-        # docs_to_index = []
-
-        # # -------------------------------
-        # # 4️⃣ Embed text chunks
-        # # -------------------------------
-        # for idx, chunk in enumerate(chunks):
-        #     embedding = embed_text(chunk)
-        #     if not embedding:
-        #         print(f"[WARN] Empty embedding for chunk {idx}")
-        #         continue
-
-        #     docs_to_index.append({
-        #         "id": f"{doc_id}_{idx}",
-        #         "embedding": embedding,
-        #         "payload": {
-        #             "text": chunk,
-        #             "filename": file.filename,
-        #             "doc_id": doc_id,
-        #             "chunk_index": idx,
-        #             "source_type": "text"
-        #         }
-        #     })
-
-#FOR PAGE NUMBERS
-        # chunks = chunk_text_by_words(text, CHUNK_SIZE, CHUNK_OVERLAP)
-        # print(f"[DEBUG] Number of text chunks: {len(chunks)}")
-
-        # docs_to_index = []
-
-        # # -------------------------------
-        # # 4️⃣ Embed text chunks
-        # # -------------------------------
-        # line_counter = 0  # global line counter for the document
-        # for idx, chunk in enumerate(chunks):
-        #     embedding = embed_text(chunk)
-        #     if not embedding:
-        #         print(f"[WARN] Empty embedding for chunk {idx}")
-        #         continue
-        #     # Determine page and line range for this chunk
-        #     chunk_start = line_counter
-        #     chunk_lines = chunk.split(". ")  # approximate: each sentence as a line
-        #     chunk_end = chunk_start + len(chunk_lines)
-
-        #     # Collect page and line info from pages data
-        #     # You can enhance this to find exact pages if needed
-        #     pages = extracted.get("pages", [])
-        #     pages_covered = []
-        #     for page in pages:
-        #         page_lines = [line['text'] for line in page['lines']]
-        #         if any(sentence in page_lines for sentence in chunk_lines):
-        #             pages_covered.append(page['page'])
-
-        #     docs_to_index.append({
-        #         "id": f"{doc_id}_{idx}",
-        #         "embedding": embedding,
-        #         "payload": {
-        #             "text": chunk,
-        #             "filename": file.filename,
-        #             "doc_id": doc_id,
-        #             "chunk_index": idx,
-        #             "source_type": "text",
-        #             "page_range": f"{pages_covered[0]}-{pages_covered[-1]}" if pages_covered else None,
-        #             "line_range": f"{chunk_start+1}-{chunk_end}",
-        #             "page_number": pages_covered[0] if pages_covered else None
-        #         }
-        #     })
-        #     line_counter = chunk_end  # update line counter for next chunk
+        _index_page_stream(pages, doc_id, filename, progress, segments=segments, existing=existing, stats=stats)
+        chunks_indexed, embed_secs, upsert_secs = stats["chunks"], stats["embed_secs"], stats["upsert_secs"]
+        chunks_per_sec = stats["embedded"] / embed_secs if embed_secs > 0 else 0.0
+        print(f"[DEBUG] Embedded {stats['embedded']} of {chunks_indexed} chunks in {embed_secs:.2f}s ({chunks_per_sec:.1f} chunks/sec)")
+
+        if chunks_indexed == 0 and not is_image:
+            raise ValueError("No text extracted from the uploaded file.")
 
         # -------------------------------
         # 5️⃣ Embed image globally (if applicable)
         # -------------------------------
-
-#AUDIO TIMESTAMPS
-        # chunks = chunk_text_by_words(text, CHUNK_SIZE, CHUNK_OVERLAP)
-        # docs_to_index = []
-
-        # line_counter = 0
-
-        # for idx, chunk in enumerate(chunks):
-        #     embedding = embed_text(chunk)
-        #     if not embedding:
-        #         continue
-
-        #     chunk_lines = chunk.split(". ")  # approximate sentence splitting
-        #     chunk_end = line_counter + len(chunk_lines)
-
-        #     pages = extracted.get("pages", [])
-        #     pages_covered = []
-        #     for page in pages:
-        #         page_lines = [line['text'] for line in page.get("lines", [])]
-        #         if any(sentence in page_lines for sentence in chunk_lines):
-        #             pages_covered.append(page['page'])
-
-        #     # ---- AUDIO TIMESTAMPS ----
-        #     audio_start, audio_end = None, None
-        #     if "segments" in extracted:  # Only audio
-        #         for seg in extracted["segments"]:
-        #             if any(line in seg["text"] for line in chunk_lines):
-        #                 if audio_start is None or seg["start"] < audio_start:
-        #                     audio_start = seg["start"]
-        #                 if audio_end is None or seg["end"] > audio_end:
-        #                     audio_end = seg["end"]
-
-
-        #     docs_to_index.append({
-        #         "id": f"{doc_id}_{idx}",
-        #         "embedding": embedding,
-        #         "payload": {
-        #             "text": chunk,
-        #             "filename": file.filename,
-        #             "doc_id": doc_id,
-        #             "chunk_index": idx,
-        #             "source_type": "audio" if "segments" in extracted else "text",
-        #             "page_range": f"{pages_covered[0]}-{pages_covered[-1]}" if pages_covered else None,
-        #             "line_range": f"{line_counter+1}-{chunk_end}",
-        #             "page_number": pages_covered[0] if pages_covered else None,
-        #             "audio_start": audio_start,
-        #             "audio_end": audio_end
-        #         }
-        #     })
-        #     line_counter = chunk_end
-
-#final 
-
-
-        chunks = chunk_text_by_words(text, CHUNK_SIZE, CHUNK_OVERLAP)
-        docs_to_index = []
-
-        line_counter = 0
-        pages = extracted.get("pages", [])
-
-# Build a global line->page map for text documents
-        line_to_page = {}
-        for page in pages:
-            for line in page.get("lines", []):
-                line_num = line["line_number"]
-                line_to_page[line_num] = page["page"]
-
-        for idx, chunk in enumerate(chunks):
-            embedding = embed_text(chunk)
-            if not embedding:
-                continue
-
-            chunk_lines = chunk.split(". ")  # approximate sentence splitting
-            chunk_start_line = line_counter + 1
-            chunk_end_line = line_counter + len(chunk_lines)
-
-            # Determine pages covered by line numbers
-            pages_covered = sorted({line_to_page.get(ln) for ln in range(chunk_start_line, chunk_end_line+1) if line_to_page.get(ln)})
-
-            # ---- AUDIO TIMESTAMPS ----
-            audio_start, audio_end = None, None
-            if "segments" in extracted:  # Only audio
-                # Find segments overlapping with chunk
-                for seg in extracted["segments"]:
-                    seg_text = seg["text"].strip()
-                    # naive: if any chunk line appears in segment
-                    if any(line.strip() in seg_text for line in chunk_lines):
-                        if audio_start is None or seg["start"] < audio_start:
-                            audio_start = seg["start"]
-                        if audio_end is None or seg["end"] > audio_end:
-                            audio_end = seg["end"]
-
-            docs_to_index.append({
-                "id": f"{doc_id}_{idx}",
-                "embedding": embedding,
-                "payload": {
-                    "text": chunk,
-                    "filename": file.filename,
-                    "doc_id": doc_id,
-                    "chunk_index": idx,
-                    "source_type": "audio" if "segments" in extracted else "text",
-                    "page_range": f"{pages_covered[0]}-{pages_covered[-1]}" if pages_covered else None,
-                    "line_range": f"{chunk_start_line}-{chunk_end_line}",
-                    "page_number": pages_covered[0] if pages_covered else None,
-                    "audio_start": audio_start,
-                    "audio_end": audio_end
-                }
-            })
-            line_counter = chunk_end_line
-
-
-        if mimetype.startswith("image") or ext in (".png", ".jpg", ".jpeg"):
+        if is_image:
             try:
-                img_embedding = embed_image_bytes(file_bytes)
+                img_embedding = embed_image_file(path)
                 if img_embedding:
-                    docs_to_index.append({
+                    stats["ids"].update(upsert_documents([{
                         "id": f"{doc_id}_image",
                         "embedding": img_embedding,
+                        "vector_name": IMAGE_VECTOR_NAME,
                         "payload": {
                             "text": text,
-                            "filename": file.filename,
+                            "filename": filename,
                             "doc_id": doc_id,
                             "chunk_index": "image",
-                            "source_type": "image"
+                            "source_type": "image",
+                            **_ocr_fields({p["page"]: p for p in pages if p.get("ocr_route") is not None}, [1])
                         }
-                    }) 
+                    }]))
+                    chunks_indexed += 1
             except Exception as e:
                 print(f"[WARN] Image embedding failed: {e}")
 
-        if not docs_to_index:
+        if not chunks_indexed:
             raise RuntimeError("No chunks or images to index!")
 
-        # -------------------------------
-        # 6️⃣ Upsert to Qdrant
-        # -------------------------------
-        print(f"[DEBUG] Preparing to upsert {len(docs_to_index)} documents to Qdrant")
-        upsert_documents(docs_to_index, vector_dim=VECTOR_DIM)
-        print(f"[DEBUG] Finished upserting documents")
+        removed = []
+        if incremental:
+            # chunks of the previous version that the new one no longer has
+            removed = [pid for pid in existing if pid not in stats["ids"]]
+            delete_points(removed)
+
+        # batches may have been sent with wait=False: make sure they're all applied
+        t0 = time.perf_counter()
+        consistency_barrier()
+        upsert_secs += time.perf_counter() - t0
+        points_per_sec = chunks_indexed / upsert_secs if upsert_secs > 0 else 0.0
+        print(f"[DEBUG] Finished upserting {chunks_indexed} documents in {upsert_secs:.2f}s ({points_per_sec:.1f} points/sec)")
 
-        return {
+        result = {
             "doc_id": doc_id,
-            "filename": file.filename,
-            "chunks_indexed": len(docs_to_index)
+            "filename": filename,
+            "chunks_indexed": chunks_indexed,
+            "chunks_per_sec": round(chunks_per_sec, 2),
+            "points_per_sec": round(points_per_sec, 2)
         }
+        if stats["ocr_pages"]:
+            result["ocr_pages"] = dict(stats["ocr_pages"])  # OCR'd pages per engine
+        if incremental:
+            result.update({
+                "chunks_added": stats["embedded"],
+                "chunks_updated": stats["updated"],
+                "chunks_unchanged": stats["unchanged"],
+                "chunks_removed": len(removed),
+            })
+        return result
 
     except Exception as e:
-        print(f"[ERROR] process_upload failed: {e}")
+        print(f"[ERROR] process_saved_upload failed: {e}")
+        if incremental:
+            if existing is not None:
+                _rollback_incremental(doc_id, existing, stats)
+            raise
+        # drop windows already upserted so a half-indexed doc isn't mistaken for a duplicate
+        try:
+            delete_document(doc_id)
+        except Exception as cleanup_err:
+            print(f"[WARN] Cleanup of partial index for {doc_id} failed: {cleanup_err}")
         raise
+
+
+def _rollback_incremental(doc_id: str, existing: Dict[str, Dict], stats: Dict):
+    # undo a failed incremental run: drop the chunks it added, restore the payloads it rewrote
+    # and the image vector it overwrote (doc_id's stored file is still the previous version)
+    try:
+        consistency_barrier()  # unwaited upserts must land before they're deleted
+        added = [pid for pid in stats["ids"] if pid not in existing]
+        delete_points(added)
+        update_payloads({pid: existing[pid] for pid in stats["moved"]})
+        images = [pid for pid in stats["ids"] if pid in existing and existing[pid].get("source_type") == "image"]
+        for pid in images:
+            upsert_documents([{
+                "id": f"{doc_id}_image",
+                "embedding": embed_image_file(stored_files(doc_id)[0]),
+                "vector_name": IMAGE_VECTOR_NAME,
+                "payload": existing[pid]
+            }])
+        consistency_barrier()
+        print(f"[DEBUG] Rolled back {doc_id}: removed {len(added)} new chunks, restored {len(stats['moved'])} payloads"
+              f" and {len(images)} image vectors")
+    except Exception as e:
+        print(f"[WARN] Rollback of {doc_id} failed, index may mix versions: {e}")
+
+
+def update_document(
+    path: str,
+    content_hash: str,
+    doc_id: str,
+    filename: str,
+    content_type: Optional[str] = None,
+    progress: Callable[..., None] = _noop_progress
+):
+    """
+    Replace doc_id's content with the staged upload at `path` (private to this
+    job): incremental re-index, then the upload becomes doc_id's stored file
+    so citation links keep working, and doc_id is recorded as holding
+    `content_hash`. On failure the stored file is left as it was.
+    """
+    try:
+        result = process_saved_upload(path, doc_id, filename, content_type, progress, incremental=True)
+        store_upload(path, doc_id)
+        documents.set_content_hash(doc_id, content_hash)
+    finally:
+        discard_upload(path)  # still there if the re-index failed
+    return {**result, "content_hash": content_hash}
+
+
+def remove_document(doc_id: str) -> Optional[Dict]:
+    """Delete doc_id's points and stored file; None if there was nothing to delete."""
+    chunks = count_document_chunks(doc_id)
+    delete_document(doc_id)
+    files = remove_stored_files(doc_id)
+    documents.forget(doc_id)
+    if not chunks and not files:
+        return None
+    return {"doc_id": doc_id, "chunks_deleted": chunks, "files_removed": len(files)}
@@ -0,0 +1,171 @@
+# app/jobs.py
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from .config import (
+    INGEST_WORKERS,
+    INGEST_QUEUE_SIZE,
+    INGEST_JOB_HISTORY,
+    OCR_CONCURRENCY,
+    ASR_CONCURRENCY,
+    EMBED_CONCURRENCY,
+)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the ingest queue cannot accept another job."""
+
+
+class JobActiveError(RuntimeError):
+    """Raised by an exclusive submit_job when the document already has a queued or running job."""
+
+    def __init__(self, job: Dict):
+        super().__init__(f"Document is being indexed by job {job['job_id']}")
+        self.job = job
+
+
+# -------------------------------
+# Per-stage concurrency limits
+# -------------------------------
+_stage_limits = {
+    "ocr": threading.BoundedSemaphore(OCR_CONCURRENCY),
+    "asr": threading.BoundedSemaphore(ASR_CONCURRENCY),
+    "embedding": threading.BoundedSemaphore(EMBED_CONCURRENCY),
+}
+
+
+@contextmanager
+def stage_slot(stage: str):
+    """Hold one slot of `stage` for the duration of the block (no-op for unknown stages)."""
+    sem = _stage_limits.get(stage)
+    if sem is None:
+        yield
+        return
+    with sem:
+        yield
+
+
+# -------------------------------
+# Job store
+# -------------------------------
+_jobs: "OrderedDict[str, Dict]" = OrderedDict()
+_jobs_lock = threading.Lock()
+_queue: "queue.Queue" = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def _update(job_id: str, **fields):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        progress = fields.pop("progress", None)
+        if progress:
+            job["progress"].update(progress)
+        job.update(fields)
+        job["updated_at"] = time.time()
+
+
+def _prune_history():
+    # drop the oldest finished jobs once we keep more than INGEST_JOB_HISTORY
+    finished = [jid for jid, j in _jobs.items() if j["status"] in ("done", "failed")]
+    for jid in finished[:max(0, len(_jobs) - INGEST_JOB_HISTORY)]:
+        del _jobs[jid]
+
+
+def _worker_loop():
+    while True:
+        job_id, fn, args, kwargs = _queue.get()
+        try:
+            _update(job_id, status="running", stage="starting", started_at=time.time())
+
+            def report(stage: Optional[str] = None, **progress):
+                fields = {"progress": progress}
+                if stage:
+                    fields["stage"] = stage
+                _update(job_id, **fields)
+
+            result = fn(*args, progress=report, **kwargs)
+            _update(job_id, status="done", stage="done", result=result, finished_at=time.time())
+        except Exception as e:
+            print(f"[ERROR] ingest job {job_id} failed: {e}")
+            _update(job_id, status="failed", error=str(e), finished_at=time.time())
+        finally:
+            _queue.task_done()
+
+
+def _ensure_workers():
+    with _workers_lock:
+        while len(_workers) < INGEST_WORKERS:
+            t = threading.Thread(target=_worker_loop, name=f"ingest-worker-{len(_workers)}", daemon=True)
+            t.start()
+            _workers.append(t)
+
+
+def submit_job(fn: Callable, *args, metadata: Optional[Dict] = None, exclusive: bool = False, **kwargs) -> str:
+    """
+    Queue `fn(*args, progress=<callback>, **kwargs)` on the ingest worker pool.
+    Returns the job id immediately; raises QueueFullError if the queue is full.
+    With `exclusive`, raises JobActiveError if metadata's doc_id already has a
+    queued or running job (checked and registered under one lock, so two
+    concurrent submits for a document can't both get through).
+    """
+    _ensure_workers()
+    job_id = str(uuid.uuid4())
+    now = time.time()
+    with _jobs_lock:
+        if exclusive:
+            active = _active_job_locked((metadata or {}).get("doc_id"))
+            if active:
+                raise JobActiveError(active)
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "stage": "queued",
+            "progress": {},
+            "error": None,
+            "result": None,
+            "created_at": now,
+            "updated_at": now,
+            **(metadata or {}),
+        }
+        _prune_history()
+    try:
+        _queue.put_nowait((job_id, fn, args, kwargs))
+    except queue.Full:
+        with _jobs_lock:
+            _jobs.pop(job_id, None)
+        raise QueueFullError(f"Ingest queue is full ({INGEST_QUEUE_SIZE} jobs waiting)")
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return {**job, "progress": dict(job["progress"])}
+
+
+def _active_job_locked(doc_id: Optional[str]) -> Optional[Dict]:
+    # caller holds _jobs_lock
+    for job in _jobs.values():
+        if doc_id is not None and job.get("doc_id") == doc_id and job["status"] in ("queued", "running"):
+            return {**job, "progress": dict(job["progress"])}
+    return None
+
+
+def find_active_job(doc_id: str) -> Optional[Dict]:
+    """A queued or running job for `doc_id`, if any (used to coalesce duplicate uploads)."""
+    with _jobs_lock:
+        return _active_job_locked(doc_id)
+
+
+def queue_depth() -> int:
+    return _queue.qsize()
@@ -0,0 +1,125 @@
+# app/lexical.py
+# Local BM25 index over text chunks (SQLite FTS5), maintained next to Qdrant
+# so exact identifiers (circular numbers, section codes, names) can be matched
+# lexically and fused with dense results.
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .config import LEXICAL_INDEX_PATH
+
+_conn = None
+_lock = threading.Lock()
+
+# keep identifiers like "12/2023" or "GST-R3B" as single tokens
+_TOKENIZER = "unicode61 tokenchars '-/'"
+_QUERY_TOKEN = re.compile(r"[\w/-]+", re.UNICODE)
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(LEXICAL_INDEX_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(LEXICAL_INDEX_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+            f"text, point_id UNINDEXED, doc_id UNINDEXED, payload UNINDEXED, tokenize=\"{_TOKENIZER}\")"
+        )
+        _conn = conn
+    return _conn
+
+
+def add_chunks(rows: Iterable[Tuple[str, str, str, Dict]]):
+    """rows: (point_id, doc_id, text, payload). Re-adding a point_id replaces it."""
+    rows = list(rows)
+    if not rows:
+        return
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany("DELETE FROM chunks WHERE point_id = ?", [(pid,) for pid, _, _, _ in rows])
+            conn.executemany(
+                "INSERT INTO chunks (text, point_id, doc_id, payload) VALUES (?, ?, ?, ?)",
+                [(text, pid, doc_id, json.dumps(payload)) for pid, doc_id, text, payload in rows]
+            )
+
+
+def delete_document(doc_id: str):
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+
+
+def delete_points(point_ids: Iterable[str]):
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany("DELETE FROM chunks WHERE point_id = ?", [(pid,) for pid in point_ids])
+
+
+def update_payloads(payloads: Dict[str, Dict]):
+    """Replace the stored payload of already indexed chunks ({point_id: payload})."""
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany(
+                "UPDATE chunks SET payload = ? WHERE point_id = ?",
+                [(json.dumps(payload), pid) for pid, payload in payloads.items()]
+            )
+
+
+def clear():
+    """Remove every chunk (collection reset)."""
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM chunks")
+
+
+def _match_expr(query: str) -> str:
+    # OR of quoted terms: any term may match, BM25 rewards rare/repeated ones
+    terms = {t.lower() for t in _QUERY_TOKEN.findall(query)}
+    return " OR ".join('"' + t.replace('"', '""') + '"' for t in sorted(terms))
+
+
+def filter_sql(filters: Optional[Dict]) -> Tuple[str, list]:
+    """SQL " AND ..." clauses (and params) equivalent to indexer.build_filter, on a JSON `payload` column."""
+    if not filters:
+        return "", []
+    clauses, params = [], []
+    for field in ("doc_id", "filename", "source_type", "ocr_engine"):
+        values = filters.get(field)
+        if values:
+            clauses.append(f"json_extract(payload, '$.{field}') IN ({','.join('?' * len(values))})")
+            params.extend(values)
+    if filters.get("page_from") is not None:
+        clauses.append("json_extract(payload, '$.page_number') >= ?")
+        params.append(filters["page_from"])
+    if filters.get("page_to") is not None:
+        clauses.append("json_extract(payload, '$.page_number') <= ?")
+        params.append(filters["page_to"])
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+def search(query: str, top_k: int = 5, filters: Optional[Dict] = None) -> List[Dict]:
+    """BM25 search; hits have the same shape as indexer.search (higher score is better)."""
+    expr = _match_expr(query)
+    if not expr:
+        return []
+    where, params = filter_sql(filters)
+    with _lock:
+        rows = _get_conn().execute(
+            "SELECT point_id, text, payload, bm25(chunks) AS rank FROM chunks "
+            f"WHERE chunks MATCH ?{where} ORDER BY rank LIMIT ?",
+            (expr, *params, top_k)
+        ).fetchall()
+    # sqlite's bm25() is negative, more negative = better match
+    return [
+        {"id": pid, "score": -rank, "text": text, "metadata": json.loads(payload)}
+        for pid, text, payload, rank in rows
+    ]
@@ -0,0 +1,160 @@
+# app/llm_scheduler.py
+# Admission control in front of the local LLM. Ollama works through requests
+# one (or a few) at a time, so at most LLM_CONCURRENCY generations run at once
+# and at most LLM_QUEUE_SIZE wait for a slot. Requests are counted when they
+# are admitted, before they first await, so a burst arriving together can't
+# all slip past the bound. Past that, requests are
+# rejected right away (LLMQueueFullError -> 429), and a request still waiting
+# after LLM_QUEUE_TIMEOUT gives up (LLMBusyError -> 503). Neither waits for the
+# LLM's own read timeout. Identical prompts already in flight share one
+# generation instead of queueing again.
+import asyncio
+import hashlib
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+from .config import LLM_CONCURRENCY, LLM_QUEUE_SIZE, LLM_QUEUE_TIMEOUT, LLM_MODEL
+
+
+class LLMQueueFullError(RuntimeError):
+    """Raised when the LLM wait queue cannot take another request."""
+
+
+class LLMBusyError(RuntimeError):
+    """Raised when a request waited LLM_QUEUE_TIMEOUT without getting an LLM slot."""
+
+
+_sem: Optional[asyncio.Semaphore] = None
+_admitted = 0  # admitted and not finished: generating or waiting for a slot
+_active = 0
+_inflight: Dict[str, asyncio.Future] = {}  # prompt key -> shared generation
+_counters = {
+    "admitted": 0,
+    "coalesced": 0,
+    "rejected_full": 0,
+    "rejected_timeout": 0,
+    "degraded": 0,
+    "wait_ms_total": 0.0,
+    "wait_ms_max": 0.0,
+    "generation_ms_total": 0.0,
+    "generations": 0,
+}
+
+
+def _get_sem() -> asyncio.Semaphore:
+    global _sem
+    if _sem is None:
+        _sem = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+    return _sem
+
+
+def _capacity() -> int:
+    return max(1, LLM_CONCURRENCY) + max(0, LLM_QUEUE_SIZE)
+
+
+def _queued() -> int:
+    # admitted requests that don't hold a slot yet
+    return max(0, _admitted - max(1, LLM_CONCURRENCY))
+
+
+def saturated() -> bool:
+    """True if a new request would be rejected (every slot and queue place is taken)."""
+    return _admitted >= _capacity()
+
+
+def check_admission():
+    """Raise LLMQueueFullError if a new request would be rejected."""
+    if saturated():
+        _counters["rejected_full"] += 1
+        raise LLMQueueFullError(f"LLM queue full ({_active} generating, {_admitted - _active} waiting)")
+
+
+def retry_after() -> int:
+    # seconds until the queue has probably drained, from the mean generation time
+    mean_s = (_counters["generation_ms_total"] / _counters["generations"] / 1000) if _counters["generations"] else 5.0
+    return max(1, math.ceil(mean_s * (_queued() + 1) / max(1, LLM_CONCURRENCY)))
+
+
+def note_degraded():
+    _counters["degraded"] += 1
+
+
+@asynccontextmanager
+async def slot():
+    """
+    Hold one LLM slot for the duration of the block. Raises LLMQueueFullError
+    immediately if the wait queue is full, LLMBusyError if no slot frees up
+    within LLM_QUEUE_TIMEOUT.
+    """
+    global _active, _admitted
+    check_admission()
+    _admitted += 1  # no await since the check: the next caller already sees this request
+    try:
+        sem = _get_sem()
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout=LLM_QUEUE_TIMEOUT if LLM_QUEUE_TIMEOUT > 0 else None)
+        except asyncio.TimeoutError:
+            _counters["rejected_timeout"] += 1
+            raise LLMBusyError(f"No LLM slot free after {LLM_QUEUE_TIMEOUT:.0f}s")
+        wait_ms = (time.perf_counter() - t0) * 1000
+        _counters["admitted"] += 1
+        _counters["wait_ms_total"] += wait_ms
+        _counters["wait_ms_max"] = max(_counters["wait_ms_max"], wait_ms)
+        _active += 1
+        t1 = time.perf_counter()
+        try:
+            yield
+        finally:
+            _active -= 1
+            sem.release()
+            _counters["generation_ms_total"] += (time.perf_counter() - t1) * 1000
+            _counters["generations"] += 1
+    finally:
+        _admitted -= 1
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(f"{LLM_MODEL}\0{prompt}".encode()).hexdigest()
+
+
+async def generate(prompt: str, fn: Callable[[str], Awaitable[str]]) -> str:
+    """
+    `await fn(prompt)` inside an LLM slot. If the same prompt is already being
+    generated, wait for that result instead. The shared generation runs in its
+    own task, so it keeps going for the others if one caller goes away.
+    """
+    key = prompt_key(prompt)
+    shared = _inflight.get(key)
+    if shared is not None:
+        _counters["coalesced"] += 1
+        return await asyncio.shield(shared)
+    check_admission()  # reject before creating any work
+
+    async def run():
+        async with slot():
+            return await fn(prompt)
+
+    task = asyncio.ensure_future(run())
+    _inflight[key] = task
+    task.add_done_callback(lambda t: _inflight.pop(key, None) if _inflight.get(key) is t else None)
+    return await asyncio.shield(task)
+
+
+def stats() -> Dict:
+    admitted = _counters["admitted"]
+    return {
+        "concurrency": max(1, LLM_CONCURRENCY),
+        "queue_size": LLM_QUEUE_SIZE,
+        "queue_timeout_s": LLM_QUEUE_TIMEOUT,
+        "active": _active,
+        "waiting": _admitted - _active,
+        "inflight_prompts": len(_inflight),
+        **{k: v for k, v in _counters.items() if k not in ("wait_ms_total", "wait_ms_max", "generation_ms_total")},
+        "avg_wait_ms": round(_counters["wait_ms_total"] / admitted, 2) if admitted else None,
+        "max_wait_ms": round(_counters["wait_ms_max"], 2),
+        "avg_generation_ms": round(_counters["generation_ms_total"] / _counters["generations"], 2)
+        if _counters["generations"] else None,
+    }
@@ -0,0 +1,347 @@
+# app/local_index.py
+# In-process vector index used instead of Qdrant when INDEX_BACKEND=local.
+# Each named vector is an append-only matrix file (LOCAL_INDEX_DTYPE, L2-normalised
+# rows, memory-mapped for search) plus rows in an SQLite table holding the point
+# id and payload. SQLite is the source of truth: vectors are fsync'd before the
+# rows referencing them are committed, and bytes past the last committed row (a
+# torn append) are truncated away on open.
+# Search is exact (one matrix product) until a vector has LOCAL_ANN_THRESHOLD
+# rows, then an IVF index (spherical k-means lists, rebuilt in memory) is probed.
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .config import LOCAL_INDEX_DIR, LOCAL_INDEX_DTYPE, LOCAL_ANN_THRESHOLD, LOCAL_ANN_NPROBE
+from .lexical import filter_sql
+
+_lock = threading.RLock()
+_conn = None
+_stores: Dict[str, Dict] = {}
+
+_SCORE_BLOCK = 65536  # rows upcast to float32 at a time when scoring
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        os.makedirs(LOCAL_INDEX_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(LOCAL_INDEX_DIR, "points.sqlite3"), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("CREATE TABLE IF NOT EXISTS vectors (name TEXT PRIMARY KEY, dim INTEGER, dtype TEXT, gen INTEGER)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS points (name TEXT, row INTEGER, point_id TEXT, doc_id TEXT, "
+            "payload TEXT, live INTEGER, PRIMARY KEY (name, row))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS points_id ON points (name, point_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS points_doc ON points (doc_id)")
+        _conn = conn
+    return _conn
+
+
+def _matrix_path(name: str, gen: int, dtype: str) -> str:
+    return os.path.join(LOCAL_INDEX_DIR, f"{name}.{gen}.{dtype}")
+
+
+def _remap(store: Dict):
+    # np.memmap can't map an empty file
+    store["matrix"] = (
+        np.memmap(store["path"], dtype=store["dtype"], mode="r", shape=(store["rows"], store["dim"]))
+        if store["rows"] else None
+    )
+
+
+def _open_store(name: str, dim: int, dtype: str, gen: int) -> Dict:
+    conn = _get_conn()
+    path = _matrix_path(name, gen, dtype)
+    # files of other generations are leftovers of an interrupted compaction
+    for stale in glob.glob(os.path.join(LOCAL_INDEX_DIR, f"{name}.*.*")):
+        if stale != path:
+            os.remove(stale)
+    rows = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM points WHERE name = ?", (name,)).fetchone()[0]
+    row_bytes = dim * np.dtype(dtype).itemsize
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size < rows * row_bytes:
+        raise RuntimeError(f"Local index '{path}' is missing committed vectors; delete {LOCAL_INDEX_DIR} and re-ingest.")
+    if size > rows * row_bytes:
+        print(f"[WARN] Truncating {size - rows * row_bytes} uncommitted bytes from {path}")
+        with open(path, "r+b") as f:
+            f.truncate(rows * row_bytes)
+    live = np.zeros(rows, dtype=bool)
+    live_rows = [r for (r,) in conn.execute("SELECT row FROM points WHERE name = ? AND live = 1", (name,))]
+    live[live_rows] = True
+    store = {"name": name, "dim": dim, "dtype": dtype, "gen": gen, "path": path,
+             "rows": rows, "live": live, "ivf": None}
+    _remap(store)
+    return store
+
+
+def ensure_vectors(dims: Dict[str, int]):
+    """Create (or open) one store per named vector; `dims` maps vector name -> size."""
+    with _lock:
+        conn = _get_conn()
+        for name, dim in dims.items():
+            meta = conn.execute("SELECT dim, dtype, gen FROM vectors WHERE name = ?", (name,)).fetchone()
+            if meta is None:
+                with conn:
+                    conn.execute("INSERT INTO vectors VALUES (?, ?, ?, 0)", (name, dim, LOCAL_INDEX_DTYPE))
+                meta = (dim, LOCAL_INDEX_DTYPE, 0)
+            if meta[0] != dim:
+                raise RuntimeError(
+                    f"Local index vector '{name}' has size {meta[0]}, the model produces {dim}; "
+                    f"delete {LOCAL_INDEX_DIR} (or run qdrant.py) to recreate it."
+                )
+            if name not in _stores:
+                _stores[name] = _open_store(name, *meta)
+
+
+def _store(name: str) -> Optional[Dict]:
+    # opened on first use in this process; None if the vector was never created
+    with _lock:
+        if name not in _stores:
+            meta = _get_conn().execute("SELECT dim, dtype, gen FROM vectors WHERE name = ?", (name,)).fetchone()
+            if meta is None:
+                return None
+            _stores[name] = _open_store(name, *meta)
+        return _stores[name]
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def upsert(name: str, ids: Sequence[str], matrix: np.ndarray, payloads: Sequence[dict]):
+    """Append points; an id that already exists is replaced (its old row is tombstoned)."""
+    block = _normalize(np.asarray(matrix, dtype=np.float32))
+    with _lock:
+        # looked up under the lock: a compaction swaps in a new store and deletes the old generation's file
+        store = _store(name)
+        if store is None:
+            raise RuntimeError(f"Local index vector '{name}' doesn't exist; call ensure_collection first.")
+        if block.shape[1] != store["dim"]:
+            raise ValueError(f"Vector '{name}' expects size {store['dim']}, got {block.shape[1]}")
+        block = block.astype(store["dtype"])
+        conn = _get_conn()
+        start = store["rows"]
+        # 1. vectors: drop any uncommitted tail, append, fsync
+        with open(store["path"], "ab") as f:
+            f.truncate(start * store["dim"] * np.dtype(store["dtype"]).itemsize)
+            f.write(block.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        # 2. rows: the commit makes the append visible
+        replaced = []
+        with conn:
+            for pid in ids:
+                replaced.extend(r for (r,) in conn.execute(
+                    "SELECT row FROM points WHERE name = ? AND point_id = ? AND live = 1", (name, pid)
+                ))
+            conn.executemany("UPDATE points SET live = 0 WHERE name = ? AND row = ?", [(name, r) for r in replaced])
+            conn.executemany(
+                "INSERT INTO points VALUES (?, ?, ?, ?, ?, 1)",
+                [(name, start + i, pid, payload.get("doc_id"), json.dumps(payload))
+                 for i, (pid, payload) in enumerate(zip(ids, payloads))]
+            )
+        store["rows"] = start + len(ids)
+        store["live"] = np.concatenate([store["live"], np.ones(len(ids), dtype=bool)])
+        store["live"][replaced] = False
+        _remap(store)
+        ivf = store["ivf"]
+        if ivf is not None:
+            ivf["assign"] = np.concatenate([ivf["assign"], _assign(ivf["centroids"], block)])
+
+
+def count(doc_id: str) -> int:
+    with _lock:
+        return _get_conn().execute("SELECT COUNT(*) FROM points WHERE doc_id = ? AND live = 1", (doc_id,)).fetchone()[0]
+
+
+def delete_document(doc_id: str):
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            dead = conn.execute("SELECT name, row FROM points WHERE doc_id = ? AND live = 1", (doc_id,)).fetchall()
+            conn.execute("UPDATE points SET live = 0 WHERE doc_id = ?", (doc_id,))
+        for name, row in dead:
+            if name in _stores:
+                _stores[name]["live"][row] = False
+        for name in {name for name, _ in dead}:
+            if name in _stores:
+                _maybe_compact(_stores[name])
+
+
+def delete_points(point_ids: Sequence[str]):
+    with _lock:
+        conn = _get_conn()
+        dead = []
+        with conn:
+            for pid in point_ids:
+                dead.extend(conn.execute(
+                    "SELECT name, row FROM points WHERE point_id = ? AND live = 1", (pid,)
+                ).fetchall())
+            conn.executemany("UPDATE points SET live = 0 WHERE name = ? AND row = ?", dead)
+        for name, row in dead:
+            if name in _stores:
+                _stores[name]["live"][row] = False
+        for name in {name for name, _ in dead}:
+            if name in _stores:
+                _maybe_compact(_stores[name])
+
+
+def document_points(doc_id: str) -> Dict[str, Dict]:
+    with _lock:
+        return {
+            pid: json.loads(payload) for pid, payload in _get_conn().execute(
+                "SELECT point_id, payload FROM points WHERE doc_id = ? AND live = 1", (doc_id,)
+            )
+        }
+
+
+def update_payloads(payloads: Dict[str, Dict]):
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany(
+                "UPDATE points SET payload = ?, doc_id = ? WHERE point_id = ? AND live = 1",
+                [(json.dumps(p), p.get("doc_id"), pid) for pid, p in payloads.items()]
+            )
+
+
+def _maybe_compact(store: Dict):
+    # rewrite the matrix without tombstoned rows once they outnumber live ones
+    live_rows = np.flatnonzero(store["live"])
+    dead = store["rows"] - len(live_rows)
+    if store["rows"] < 1024 or dead <= len(live_rows):
+        return
+    name, gen = store["name"], store["gen"] + 1
+    path = _matrix_path(name, gen, store["dtype"])
+    with open(path, "wb") as f:
+        for i in range(0, len(live_rows), _SCORE_BLOCK):
+            f.write(np.ascontiguousarray(store["matrix"][live_rows[i:i + _SCORE_BLOCK]]).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    conn = _get_conn()
+    with conn:
+        conn.execute("DELETE FROM points WHERE name = ? AND live = 0", (name,))
+        # ascending order: a row's new number is always free by the time it's assigned
+        conn.executemany(
+            "UPDATE points SET row = ? WHERE name = ? AND row = ?",
+            [(new, name, int(old)) for new, old in enumerate(live_rows) if new != old]
+        )
+        conn.execute("UPDATE vectors SET gen = ? WHERE name = ?", (gen, name))
+    store["matrix"] = None
+    _stores[name] = _open_store(name, store["dim"], store["dtype"], gen)
+    print(f"[DEBUG] Compacted local index '{name}': dropped {dead} deleted rows")
+
+
+# -------------------------------
+# IVF (approximate) index
+# -------------------------------
+def _assign(centroids: np.ndarray, block: np.ndarray) -> np.ndarray:
+    return np.argmax(block.astype(np.float32) @ centroids.T, axis=1).astype(np.int32)
+
+
+def _build_ivf(store: Dict) -> Dict:
+    live_rows = np.flatnonzero(store["live"])
+    nlist = int(np.clip(np.sqrt(len(live_rows)), 16, 4096))
+    rng = np.random.default_rng(0)
+    sample = store["matrix"][np.sort(rng.choice(live_rows, size=min(len(live_rows), nlist * 64), replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+    for _ in range(10):  # spherical k-means
+        labels = _assign(centroids, sample)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]
+        centroids = _normalize(sums)
+    assign = np.concatenate([
+        _assign(centroids, store["matrix"][i:i + _SCORE_BLOCK]) for i in range(0, store["rows"], _SCORE_BLOCK)
+    ])
+    print(f"[DEBUG] Built IVF index for '{store['name']}': {nlist} lists over {len(live_rows)} vectors")
+    return {"centroids": centroids, "assign": assign, "built_rows": store["rows"]}
+
+
+def _candidates(store: Dict, query: np.ndarray, allowed: np.ndarray, top_k: int) -> np.ndarray:
+    n_allowed = int(allowed.sum())
+    if n_allowed <= LOCAL_ANN_THRESHOLD:
+        return np.flatnonzero(allowed)
+    ivf = store["ivf"]
+    if ivf is None or store["rows"] > 2 * ivf["built_rows"]:
+        ivf = store["ivf"] = _build_ivf(store)
+    probes = np.argsort(-(ivf["centroids"] @ query))[:LOCAL_ANN_NPROBE]
+    cand = np.flatnonzero(np.isin(ivf["assign"], probes) & allowed)
+    return cand if len(cand) >= top_k else np.flatnonzero(allowed)
+
+
+def _score_rows(store: Dict, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+    matrix = store["matrix"]
+    if len(rows) == store["rows"]:
+        # full scan: contiguous blocks instead of fancy indexing
+        return np.concatenate([
+            np.asarray(matrix[i:i + _SCORE_BLOCK], dtype=np.float32) @ query
+            for i in range(0, store["rows"], _SCORE_BLOCK)
+        ])
+    return np.concatenate([
+        np.asarray(matrix[rows[i:i + _SCORE_BLOCK]], dtype=np.float32) @ query
+        for i in range(0, len(rows), _SCORE_BLOCK)
+    ])
+
+
+def search(name: str, query_vector, top_k: int = 5, filters: Optional[Dict] = None) -> List[Dict]:
+    """Cosine search; hits have the same shape as indexer.search."""
+    query = _normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+    with _lock:
+        store = _store(name)  # under the lock, so a concurrent compaction can't swap it out mid-search
+        if store is None or not store["rows"]:
+            return []
+        if filters:
+            where, params = filter_sql(filters)
+            allowed = np.zeros(store["rows"], dtype=bool)
+            matched = [r for (r,) in _get_conn().execute(
+                f"SELECT row FROM points WHERE name = ? AND live = 1{where}", (name, *params)
+            )]
+            allowed[matched] = True
+        else:
+            allowed = store["live"]
+        rows = _candidates(store, query, allowed, top_k)
+        if not len(rows):
+            return []
+        scores = _score_rows(store, rows, query)
+        if len(rows) == store["rows"]:
+            scores = np.where(allowed, scores, -np.inf)
+        k = min(top_k, int(np.isfinite(scores).sum()))
+        if not k:
+            return []
+        best = sorted(np.argpartition(-scores, k - 1)[:k], key=lambda i: -scores[i])
+        hit_rows = [int(rows[i]) for i in best]
+        by_row = {
+            row: (pid, payload) for row, pid, payload in _get_conn().execute(
+                f"SELECT row, point_id, payload FROM points WHERE name = ? AND row IN ({','.join('?' * len(hit_rows))})",
+                (name, *hit_rows)
+            )
+        }
+    out = []
+    for i, row in zip(best, hit_rows):
+        pid, payload = by_row[row]
+        payload = json.loads(payload)
+        out.append({"id": pid, "score": float(scores[i]), "text": payload.get("text", ""), "metadata": payload})
+    return out
+
+
+def drop():
+    """Delete every stored vector and payload."""
+    global _conn
+    with _lock:
+        _stores.clear()
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+        shutil.rmtree(LOCAL_INDEX_DIR, ignore_errors=True)
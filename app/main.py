@@ -1,12 +1,24 @@
 # app/main.py
 
+import asyncio
+import json
 import os
+import re
+import time
 from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from .ingest import process_upload
-from .retriever import retrieve
-from .synthesizer import synthesize
-from .models import IngestResponse, QueryRequest
+from .ingest import process_saved_upload, find_indexed_document, update_document, remove_document
+from .jobs import submit_job, get_job, find_active_job, QueueFullError, JobActiveError
+from .retriever import embed_query_async, retrieve_async
+from .synthesizer import build_prompt_with_stats, citations_for, stream_with_local_llm, synthesize_async
+from .utils import save_upload, store_upload, discard_upload, stored_files, UploadTooLargeError, UploadSizeLimit
+from . import answer_cache, documents, embed_cache, indexer, llm_scheduler, registry, synthesizer
+from .llm_scheduler import LLMQueueFullError, LLMBusyError
+from .config import RETRIEVAL_MODE, RERANK_ENABLED, RERANK_CANDIDATES, LLM_DEGRADE
+from .reranker import rerank, warm as warm_reranker
+from .models import IngestJobResponse, JobStatus, QueryRequest
 from fastapi.staticfiles import StaticFiles
 import os
 from fastapi.middleware.cors import CORSMiddleware
@@ -27,6 +39,9 @@ app.add_middleware(
     allow_headers=["*"],    # allow all headers
 )
 
+# reject oversized uploads before Starlette spools the multipart body to disk
+app.add_middleware(UploadSizeLimit, paths=("/ingest/upload", "/documents/"))
+
 # Make sure STORAGE_DIR exists
 STORAGE_DIR = "storage"
 os.makedirs(STORAGE_DIR, exist_ok=True)
@@ -35,22 +50,300 @@ os.makedirs(STORAGE_DIR, exist_ok=True)
 app.mount("/storage", StaticFiles(directory=STORAGE_DIR), name="storage")
 
 
-@app.post("/ingest/upload", response_model=IngestResponse)
-async def upload_endpoint(file: UploadFile = File(...)):
+@app.on_event("startup")
+async def warm_models():
+    if RERANK_ENABLED:
+        # the first reranked query shouldn't pay the cross-encoder load
+        await run_in_threadpool(warm_reranker)
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await indexer.close_async_client()
+    await synthesizer.close_async_client()
+
+
+@app.post("/ingest/upload", response_model=IngestJobResponse, status_code=202)
+async def upload_endpoint(file: UploadFile = File(...), force: bool = False):
+    # save (and hash) off the event loop, then hand the heavy pipeline to the worker pool
     try:
-        res = process_upload(file)
-        return {"doc_id": res["doc_id"], "filename": res["filename"], "status": "indexed", "chunks_indexed": res["chunks_indexed"]}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        staged, content_hash = await run_in_threadpool(save_upload, file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    # usually the content hash, unless that id now holds a replaced document's new content
+    doc_id = await run_in_threadpool(documents.assign, content_hash)
+    # checked first: a document that is still indexing already has some points
+    active = find_active_job(doc_id)
+    if active:
+        discard_upload(staged)
+        if force:
+            # re-indexing now would delete the points the running job is writing
+            raise HTTPException(status_code=409, detail=f"Document is being indexed by job {active['job_id']}")
+        return {"job_id": active["job_id"], "doc_id": doc_id, "filename": file.filename, "status": active["status"]}
+    if not force:
+        # same content already indexed: skip all the work
+        existing = await run_in_threadpool(find_indexed_document, content_hash)
+        if existing:
+            discard_upload(staged)
+            return {"job_id": None, "doc_id": existing["doc_id"], "filename": file.filename, "status": "duplicate",
+                    "chunks_indexed": existing["chunks_indexed"]}
+    path = await run_in_threadpool(store_upload, staged, doc_id)
+    try:
+        job_id = submit_job(
+            process_saved_upload, path, doc_id, file.filename, file.content_type, replace=force,
+            metadata={"doc_id": doc_id, "filename": file.filename}, exclusive=True
+        )
+    except JobActiveError as e:
+        # another upload of the same content got its job in first
+        if force:
+            raise HTTPException(status_code=409, detail=str(e))
+        return {"job_id": e.job["job_id"], "doc_id": doc_id, "filename": file.filename, "status": e.job["status"]}
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+    return {"job_id": job_id, "doc_id": doc_id, "filename": file.filename, "status": "queued"}
+
+def _check_document_id(doc_id: str):
+    # doc ids are SHA-256 hex digests; anything else can't exist (and mustn't reach the filesystem)
+    if not re.fullmatch(r"[0-9a-f]{64}", doc_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    active = find_active_job(doc_id)
+    if active:
+        raise HTTPException(status_code=409, detail=f"Document is being indexed by job {active['job_id']}")
+
+@app.put("/documents/{doc_id}", response_model=IngestJobResponse, status_code=202)
+async def replace_document_endpoint(doc_id: str, file: UploadFile = File(...)):
+    # new version of an existing document: re-indexed incrementally by chunk diff
+    _check_document_id(doc_id)
+    if not await run_in_threadpool(indexer.count_document_chunks, doc_id) and not stored_files(doc_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    try:
+        # staged privately: only the update job reads it, and it becomes doc_id's stored file on success
+        staged, content_hash = await run_in_threadpool(save_upload, file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if content_hash == await run_in_threadpool(documents.content_hash, doc_id):
+        discard_upload(staged)
+        return {"job_id": None, "doc_id": doc_id, "filename": file.filename, "status": "unchanged"}
+    try:
+        # the check in _check_document_id was before the upload was read; this one is atomic
+        job_id = submit_job(
+            update_document, staged, content_hash, doc_id, file.filename, file.content_type,
+            metadata={"doc_id": doc_id, "filename": file.filename}, exclusive=True
+        )
+    except (JobActiveError, QueueFullError) as e:
+        discard_upload(staged)
+        if isinstance(e, JobActiveError):
+            raise HTTPException(status_code=409, detail=str(e))
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+    return {"job_id": job_id, "doc_id": doc_id, "filename": file.filename, "status": "queued"}
+
+@app.delete("/documents/{doc_id}")
+def delete_document_endpoint(doc_id: str):
+    _check_document_id(doc_id)
+    result = remove_document(doc_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return result
+
+@app.get("/ingest/jobs/{job_id}", response_model=JobStatus)
+def job_status_endpoint(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+async def _retrieve(qr: QueryRequest):
+    use_rerank = (RERANK_ENABLED if qr.rerank is None else qr.rerank) and qr.modality == "text"
+    # over-fetch candidates for the cross-encoder, then keep the best top_k
+    fetch_k = max(qr.top_k, RERANK_CANDIDATES) if use_rerank else qr.top_k
+    filters = qr.filters.dict(exclude_none=True) if qr.filters else None
+    # the answer cache is keyed on the text embedding of the query; compute it
+    # once and let the dense leg reuse it
+    query_vector = None
+    if answer_cache.enabled():
+        query_vector, embed_ms = await embed_query_async(qr.q)
+    # nothing here blocks the event loop: encoding runs on a bounded pool,
+    # search on the async Qdrant client
+    hits, timings = await retrieve_async(
+        qr.q, top_k=fetch_k, modality=qr.modality, mode=qr.mode or RETRIEVAL_MODE, filters=filters,
+        query_vector=query_vector if qr.modality == "text" else None
+    )
+    if query_vector is not None:
+        timings["embed_ms"] = embed_ms
+    if use_rerank:
+        hits, rerank_info = await run_in_threadpool(rerank, qr.q, hits, qr.top_k)
+        timings.update(rerank_info)
+    return hits, timings, query_vector
+
+async def _cached_synthesis(hits, query_vector):
+    # a previous answer for a similar query over exactly these chunks, with
+    # citations in the order its [n] markers refer to
+    if query_vector is None or not hits:
+        return None
+    cached = answer_cache.lookup(query_vector, [h["id"] for h in hits])
+    if cached is None:
+        return None
+    by_id = {str(h["id"]): h for h in hits}
+    ordered = [by_id[i] for i in cached["chunk_ids"]]
+    prompt, context = await run_in_threadpool(build_prompt_with_stats, cached["query"], ordered)
+    return {
+        "answer": cached["answer"],
+        "citations": citations_for(ordered),
+        "prompt": prompt,
+        "context": context,
+        "cached": {"query": cached["query"], "similarity": cached["similarity"], "age_s": cached["age_s"]},
+    }
+
+def _cache_answer(qr: QueryRequest, hits, query_vector, answer: str):
+    if query_vector is not None and hits and answer and not answer.startswith("LLM error"):
+        answer_cache.store(query_vector, [h["id"] for h in hits], answer, qr.q)
+
+def _degrade(qr: QueryRequest) -> bool:
+    return LLM_DEGRADE if qr.degrade is None else qr.degrade
+
+def _overloaded(e: Exception) -> HTTPException:
+    # queue full: 429 right away; waited too long for a slot: 503
+    status = 429 if isinstance(e, LLMQueueFullError) else 503
+    return HTTPException(status_code=status, detail=str(e), headers={"Retry-After": str(llm_scheduler.retry_after())})
+
+def _degraded_synthesis(hits, e: Exception) -> dict:
+    # retrieval results only; the client shows the cited passages without an answer
+    llm_scheduler.note_degraded()
+    return {"answer": None, "citations": citations_for(hits), "prompt": None, "degraded": True, "reason": str(e)}
 
 @app.post("/query")
 async def query_endpoint(qr: QueryRequest):
     try:
-        hits = retrieve(qr.q, top_k=qr.top_k)
-        synth = synthesize(qr.q, hits)
-        return {"query": qr.q, "results": hits, "synthesis": synth}
+        hits, timings, query_vector = await _retrieve(qr)
+        t0 = time.perf_counter()
+        synth = await _cached_synthesis(hits, query_vector)
+        if synth is None:
+            try:
+                synth = await synthesize_async(qr.q, hits)
+                _cache_answer(qr, hits, query_vector, synth["answer"])
+            except (LLMQueueFullError, LLMBusyError) as e:
+                if not _degrade(qr):
+                    raise _overloaded(e)
+                synth = _degraded_synthesis(hits, e)
+        timings["llm_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        return {"query": qr.q, "results": hits, "synthesis": synth, "timings": timings}
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Retrieval timed out")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/query/stream")
+async def query_stream_endpoint(qr: QueryRequest):
+    """
+    Server-Sent Events: `retrieval` (results, citations, timings) as soon as
+    retrieval is done, then one `token` event per LLM chunk, then `done`
+    (full answer, time to first token, token counts), or `error`.
+    """
+    t_start = time.perf_counter()
+    try:
+        hits, timings, query_vector = await _retrieve(qr)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Retrieval timed out")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    cached = await _cached_synthesis(hits, query_vector)
+    if cached is None and not _degrade(qr):
+        # reject before any event is sent, so the client gets a plain 429
+        try:
+            llm_scheduler.check_admission()
+        except LLMQueueFullError as e:
+            raise _overloaded(e)
+    if cached is None:
+        prompt, context = await run_in_threadpool(build_prompt_with_stats, qr.q, hits)
+
+    async def events():
+        if cached is not None:
+            # the whole answer at once
+            yield _sse("retrieval", {"query": qr.q, "results": hits, "citations": cached["citations"], "timings": timings})
+            yield _sse("token", {"token": cached["answer"]})
+            yield _sse("done", {
+                "answer": cached["answer"],
+                "prompt": cached["prompt"],
+                "timings": {**timings, "first_token_ms": round((time.perf_counter() - t_start) * 1000, 2), "llm_ms": 0.0,
+                            "total_ms": round((time.perf_counter() - t_start) * 1000, 2)},
+                "context": cached["context"],
+                "cached": cached["cached"],
+            })
+            return
+        yield _sse("retrieval", {"query": qr.q, "results": hits, "citations": citations_for(hits), "timings": timings})
+        answer, first_token_ms, stats = [], None, {}
+        t0 = time.perf_counter()
+        try:
+            # streams hold an LLM slot but aren't coalesced (each client gets its own tokens)
+            async with llm_scheduler.slot():
+                # if the client disconnects, this generator is cancelled and the
+                # upstream stream is closed with it, so Ollama stops generating
+                async for chunk in stream_with_local_llm(prompt):
+                    if "token" in chunk:
+                        if first_token_ms is None:
+                            first_token_ms = round((time.perf_counter() - t_start) * 1000, 2)
+                        answer.append(chunk["token"])
+                        yield _sse("token", {"token": chunk["token"]})
+                    else:
+                        stats = chunk
+        except asyncio.CancelledError:
+            print(f"[DEBUG] /query/stream client disconnected after {len(answer)} chunks; generation cancelled")
+            raise
+        except (LLMQueueFullError, LLMBusyError) as e:
+            if _degrade(qr):
+                llm_scheduler.note_degraded()
+                yield _sse("done", {"answer": None, "degraded": True, "reason": str(e), "timings": timings})
+            else:
+                yield _sse("error", {"detail": str(e), "status": 429 if isinstance(e, LLMQueueFullError) else 503,
+                                     "retry_after": llm_scheduler.retry_after()})
+            return
+        except Exception as e:
+            yield _sse("error", {"detail": f"LLM error: {str(e) or type(e).__name__}"})
+            return
+        _cache_answer(qr, hits, query_vector, "".join(answer).strip())
+        yield _sse("done", {
+            "answer": "".join(answer).strip(),
+            "prompt": prompt,
+            "timings": {
+                **timings,
+                "first_token_ms": first_token_ms,
+                "llm_ms": round((time.perf_counter() - t0) * 1000, 2),
+                "total_ms": round((time.perf_counter() - t_start) * 1000, 2),
+            },
+            "context": context,
+            "prompt_tokens": stats.get("prompt_eval_count"),
+            "completion_tokens": stats.get("eval_count"),
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/models")
+def models_endpoint():
+    return {"models": registry.stats()}
+
+
+@app.get("/embedding-cache")
+def embedding_cache_endpoint():
+    return embed_cache.stats()
+
+
+@app.get("/llm")
+def llm_endpoint():
+    return llm_scheduler.stats()
+
+
+@app.get("/answer-cache")
+def answer_cache_endpoint():
+    return answer_cache.stats()
 
 @app.get("/")
 def root():
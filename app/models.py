@@ -1,16 +1,42 @@
 # app/models.py
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal
 
-class IngestResponse(BaseModel):
+class IngestJobResponse(BaseModel):
+    job_id: Optional[str] = None
     doc_id: str
     filename: str
     status: str
-    chunks_indexed: int
+    chunks_indexed: Optional[int] = None
+
+class JobStatus(BaseModel):
+    job_id: str
+    doc_id: Optional[str] = None
+    filename: Optional[str] = None
+    status: str
+    stage: str
+    progress: Dict
+    error: Optional[str] = None
+    result: Optional[Dict] = None
+    created_at: float
+    updated_at: float
+
+class QueryFilters(BaseModel):
+    doc_id: Optional[List[str]] = None
+    filename: Optional[List[str]] = None
+    source_type: Optional[List[Literal["text", "audio", "image"]]] = None
+    ocr_engine: Optional[List[str]] = None  # e.g. "paddle", "easyocr", "trocr", "paddle+trocr"
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
 
 class QueryRequest(BaseModel):
     q: str
     top_k: Optional[int] = 5
+    modality: Literal["text", "image"] = "text"  # "image": CLIP text->image search
+    mode: Optional[Literal["dense", "sparse", "hybrid"]] = None  # defaults to RETRIEVAL_MODE
+    rerank: Optional[bool] = None  # defaults to RERANK_ENABLED
+    filters: Optional[QueryFilters] = None  # scope the search to documents / file types / pages
+    degrade: Optional[bool] = None  # retrieval-only answer when the LLM is saturated; defaults to LLM_DEGRADE
 
 class Hit(BaseModel):
     id: str
@@ -0,0 +1,198 @@
+# app/packing.py
+# Context packing for the synthesizer prompt. Retrieved chunks overlap (each
+# chunk repeats the previous one's trailing sentences) and neighbouring chunks
+# are often retrieved together, so the hits are first merged into passages per
+# document, then near-duplicate passages are dropped, then passages are added
+# in retrieval order until the token budget (counted with the LLM's own
+# tokenizer) is spent. A passage keeps the citation numbers of every hit it
+# absorbed, e.g. "[2][5]", so the numbers still index the citations list.
+import re
+from typing import Callable, Dict, List, Tuple
+
+from .chunking import split_sentences
+from .config import LLM_TOKENIZER, PACK_DEDUP_THRESHOLD, TEXT_EMBED_MODEL
+from . import registry
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_MIN_OVERLAP_CHARS = 8  # shorter suffix/prefix matches are coincidence, not chunk overlap
+
+
+def _load_llm_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(LLM_TOKENIZER)
+
+
+registry.register("llm_tokenizer", _load_llm_tokenizer)
+
+
+def count_llm_tokens(texts: List[str]) -> Tuple[List[int], str]:
+    """
+    Token counts with the LLM's tokenizer (LLM_TOKENIZER). If it is unset or
+    can't be loaded (offline, gated weights), the embedding model's tokenizer
+    is used as an estimate. Returns (counts, name of the tokenizer used).
+    """
+    tokenizer = registry.get_optional("llm_tokenizer") if LLM_TOKENIZER else None
+    if tokenizer is not None:
+        return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]], LLM_TOKENIZER
+    from .embeddings import count_tokens
+    return count_tokens(texts), TEXT_EMBED_MODEL
+
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b` (KMP failure function)."""
+    probe = b + "\0" + a[-len(b):]
+    fail = [0] * len(probe)
+    for i in range(1, len(probe)):
+        k = fail[i - 1]
+        while k and probe[i] != probe[k]:
+            k = fail[k - 1]
+        if probe[i] == probe[k]:
+            k += 1
+        fail[i] = k
+    return fail[-1]
+
+
+def to_passages(hits: List[Dict]) -> List[Dict]:
+    """One passage per hit, labelled with its 1-based citation number."""
+    passages = []
+    for i, hit in enumerate(hits, start=1):
+        payload = hit.get("metadata") or hit.get("payload", {})
+        passages.append({
+            "labels": [i],
+            "text": hit.get("text", ""),
+            "source": payload.get("filename") or str(hit.get("id", "unknown")),
+            "doc_id": payload.get("doc_id"),
+            "source_type": payload.get("source_type"),
+            "first_index": payload.get("chunk_index"),
+            "last_index": payload.get("chunk_index"),
+            "start": payload.get("char_start"),
+            "end": payload.get("char_end"),
+        })
+    return passages
+
+
+def _adjacent(a: Dict, b: Dict) -> bool:
+    # b follows a in the same document: overlapping/touching character spans, or consecutive chunks
+    if a["doc_id"] is None or a["doc_id"] != b["doc_id"] or a["source_type"] != b["source_type"]:
+        return False
+    if None not in (a["end"], b["start"]) and b["start"] <= a["end"] + 1:
+        return True
+    return None not in (a["last_index"], b["first_index"]) and b["first_index"] <= a["last_index"] + 1
+
+
+def _merge_text(a: str, b: str) -> str:
+    if b in a:
+        return a
+    k = _overlap(a, b)
+    if k < _MIN_OVERLAP_CHARS:
+        return f"{a} {b}"
+    return a + b[k:]
+
+
+def merge_adjacent(passages: List[Dict]) -> Tuple[List[Dict], int]:
+    """
+    Merge passages that are adjacent or overlapping in the same document into
+    one, in document order, dropping the repeated text. Output is in
+    retrieval order (by best citation number). Returns (passages, merges).
+    """
+    def position(p):
+        return (p["start"] if p["start"] is not None else -1, p["first_index"] if p["first_index"] is not None else -1)
+
+    mergeable, out = [], []
+    for p in passages:
+        located = p["doc_id"] is not None and (p["start"] is not None or p["first_index"] is not None)
+        (mergeable if located else out).append(p)
+    mergeable.sort(key=lambda p: (p["doc_id"], str(p["source_type"]), position(p)))
+    merges = 0
+    current = None
+    for p in mergeable:
+        if current is not None and _adjacent(current, p):
+            current = {
+                **current,
+                "labels": current["labels"] + p["labels"],
+                "text": _merge_text(current["text"], p["text"]),
+                "last_index": max((i for i in (current["last_index"], p["last_index"]) if i is not None), default=None),
+                "end": max((e for e in (current["end"], p["end"]) if e is not None), default=None),
+            }
+            merges += 1
+            continue
+        if current is not None:
+            out.append(current)
+        current = dict(p)
+    if current is not None:
+        out.append(current)
+    for p in out:
+        p["labels"] = sorted(p["labels"])
+    return sorted(out, key=lambda p: p["labels"][0]), merges
+
+
+def _shingles(text: str) -> set:
+    words = [w.lower() for w in _WORD.findall(text)]
+    if len(words) < 3:
+        return set(words)
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def drop_near_duplicates(passages: List[Dict], threshold: float = PACK_DEDUP_THRESHOLD) -> Tuple[List[Dict], int]:
+    """
+    Drop passages whose word 3-grams are mostly (>= `threshold`, measured on
+    the smaller set) contained in a better-ranked passage. The kept passage
+    takes over their citation numbers. Returns (passages, dropped).
+    """
+    kept: List[Tuple[Dict, set]] = []
+    dropped = 0
+    for p in passages:
+        grams = _shingles(p["text"])
+        for other, other_grams in kept:
+            smaller = min(len(grams), len(other_grams))
+            if smaller and len(grams & other_grams) / smaller >= threshold:
+                other["labels"] = sorted(other["labels"] + p["labels"])
+                dropped += 1
+                break
+        else:
+            kept.append((p, grams))
+    return [p for p, _ in kept], dropped
+
+
+def fit_budget(
+    passages: List[Dict],
+    budget: int,
+    render: Callable[[Dict], str],
+    count: Callable[[List[str]], List[int]]
+) -> Tuple[List[Dict], Dict]:
+    """
+    Take passages in order while their rendered blocks fit in `budget` tokens
+    (<= 0: no limit). A passage that doesn't fit is cut to the whole sentences
+    that do; one where not even a sentence fits is left out.
+    Returns (passages, {"truncated", "omitted"}).
+    """
+    if budget <= 0 or not passages:
+        return passages, {"truncated": 0, "omitted": 0}
+    sizes = count([render(p) for p in passages])
+    out, used, truncated, omitted = [], 0, 0, 0
+    for p, size in zip(passages, sizes):
+        if used + size <= budget:
+            out.append(p)
+            used += size
+            continue
+        spans = split_sentences(p["text"])
+        overhead = count([render({**p, "text": ""})])[0]
+        sentence_sizes = count([p["text"][s:e] for s, e in spans]) if spans else []
+        room, end = budget - used - overhead, None
+        for (s, e), n in zip(spans, sentence_sizes):
+            if n + 1 > room:  # +1 for the joining space
+                break
+            room -= n + 1
+            end = e
+        if end is None:
+            omitted += 1
+            continue
+        cut = {**p, "text": p["text"][:end]}
+        size = count([render(cut)])[0]
+        if used + size > budget:
+            omitted += 1
+            continue
+        out.append(cut)
+        used += size
+        truncated += 1
+    return out, {"truncated": truncated, "omitted": omitted}
@@ -0,0 +1,83 @@
+# app/provenance.py
+# Character-offset interval table for one document, filled while its pages
+# stream through the chunker: page starts, sentence (line) starts and, for
+# audio, Whisper segment spans with their times. A chunk's citation fields
+# are then a binary search on its (start, end) character offsets.
+from array import array
+from bisect import bisect_right
+from typing import Dict, List
+
+
+def new_table() -> Dict:
+    return {
+        "page_starts": array("q"),
+        "pages": array("q"),
+        "sentence_starts": array("q"),  # sentence i + 1 is "line" i + 1 of the document
+        "segment_starts": array("q"),
+        "segment_ends": array("q"),
+        "segment_times": [],  # (start_sec, end_sec) per segment
+    }
+
+
+def add_page(table: Dict, offset: int, page_number: int):
+    table["page_starts"].append(offset)
+    table["pages"].append(page_number)
+
+
+def add_sentence(table: Dict, offset: int):
+    table["sentence_starts"].append(offset)
+
+
+def add_segments(table: Dict, segments: List[Dict], offset: int = 0):
+    """Whisper segments carrying char_start/char_end into a page that starts at `offset`."""
+    for seg in segments:
+        table["segment_starts"].append(offset + seg["char_start"])
+        table["segment_ends"].append(offset + seg["char_end"])
+        table["segment_times"].append((seg["start"], seg["end"]))
+
+
+def _find(starts: array, offset: int) -> int:
+    # index of the interval containing `offset` (the last one starting at or before it)
+    return max(0, bisect_right(starts, offset) - 1)
+
+
+def locate(table: Dict, start: int, end: int) -> Dict:
+    """Citation fields for the text at [start, end)."""
+    last = max(start, end - 1)
+    out = {"page_range": None, "page_number": None, "line_range": None, "audio_start": None, "audio_end": None}
+    if table["pages"]:
+        first_page = table["pages"][_find(table["page_starts"], start)]
+        last_page = table["pages"][_find(table["page_starts"], last)]
+        out["page_number"] = first_page
+        out["page_range"] = f"{first_page}-{last_page}"
+    if table["sentence_starts"]:
+        out["line_range"] = f"{_find(table['sentence_starts'], start) + 1}-{_find(table['sentence_starts'], last) + 1}"
+    if table["segment_times"]:
+        out["audio_start"] = table["segment_times"][_segment(table, start)][0]
+        out["audio_end"] = table["segment_times"][_segment(table, last)][1]
+    return out
+
+
+def _segment(table: Dict, offset: int) -> int:
+    # offsets in the gap before a segment (e.g. its leading space) belong to it
+    i = _find(table["segment_starts"], offset)
+    if offset >= table["segment_ends"][i] and i + 1 < len(table["segment_starts"]):
+        return i + 1
+    return i
+
+
+def segment_offsets(text: str, segments: List[Dict]) -> List[Dict]:
+    """
+    Add char_start/char_end (into `text`) to Whisper segments. The transcript
+    is the concatenation of the segment texts, so one forward scan finds them.
+    """
+    out = []
+    cursor = 0
+    for seg in segments:
+        piece = seg.get("text", "").strip()
+        pos = text.find(piece, cursor) if piece else -1
+        if pos < 0:
+            pos = cursor
+        out.append({**seg, "char_start": pos, "char_end": pos + len(piece)})
+        cursor = pos + len(piece)
+    return out
@@ -0,0 +1,263 @@
+# app/registry.py
+# Process-wide registry of heavy models (OCR, ASR, embedders).
+# Each model is loaded on first use, shared by every caller in the process,
+# and can be evicted when idle past MODEL_IDLE_TTL or when the loaded models
+# exceed MODEL_MEMORY_BUDGET_MB (least recently used first).
+import gc
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .config import (
+    TEXT_EMBED_MODEL,
+    IMAGE_CLIP_MODEL,
+    WHISPER_MODEL,
+    TROCR_MODEL,
+    RERANK_MODEL,
+    MODEL_IDLE_TTL,
+    MODEL_MEMORY_BUDGET_MB,
+    MODEL_RETRY_SECS,
+)
+
+
+# -------------------------------
+# Loaders
+# -------------------------------
+def _load_paddleocr():
+    from paddleocr import PaddleOCR
+    return PaddleOCR(use_angle_cls=True, lang='en', show_log=False)
+
+
+def _load_easyocr():
+    import easyocr
+    return easyocr.Reader(['en'], gpu=False)
+
+
+def _load_whisper():
+    import whisper
+    return whisper.load_model(WHISPER_MODEL)
+
+
+def _load_trocr():
+    from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+    processor = TrOCRProcessor.from_pretrained(TROCR_MODEL)
+    model = VisionEncoderDecoderModel.from_pretrained(TROCR_MODEL)
+    return processor, model
+
+
+def _load_text_embedder():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(TEXT_EMBED_MODEL)
+
+
+def _load_clip():
+    import open_clip
+    import torch
+    model, _, preprocess = open_clip.create_model_and_transforms(
+        IMAGE_CLIP_MODEL, pretrained='openai'
+    )
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model.to(device)
+    return model, preprocess, device
+
+
+def _load_reranker():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANK_MODEL)
+
+
+_LOADERS: Dict[str, Callable[[], Any]] = {
+    "paddleocr": _load_paddleocr,
+    "easyocr": _load_easyocr,
+    "whisper": _load_whisper,
+    "trocr": _load_trocr,
+    "text_embedder": _load_text_embedder,
+    "clip": _load_clip,
+    "reranker": _load_reranker,
+}
+
+
+# -------------------------------
+# Sizing
+# -------------------------------
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return None
+
+
+def _torch_bytes(obj) -> int:
+    if isinstance(obj, (tuple, list)):
+        return sum(_torch_bytes(o) for o in obj)
+    if hasattr(obj, "parameters") and hasattr(obj, "buffers"):
+        try:
+            return sum(t.numel() * t.element_size() for t in list(obj.parameters()) + list(obj.buffers()))
+        except Exception:
+            return 0
+    return 0
+
+
+# -------------------------------
+# Registry
+# -------------------------------
+_entries: Dict[str, Dict] = {}
+_failed: Dict[str, Dict] = {}  # name -> {"error", "at"} of the last failed load
+_lock = threading.RLock()
+_load_locks: Dict[str, threading.Lock] = {name: threading.Lock() for name in _LOADERS}
+_janitor = None
+
+
+def register(name: str, loader: Callable[[], Any]):
+    """Add or replace a loader (drops any instance already loaded under `name`)."""
+    with _lock:
+        _LOADERS[name] = loader
+        _load_locks.setdefault(name, threading.Lock())
+        _entries.pop(name, None)
+        _failed.pop(name, None)
+
+
+def get(name: str):
+    """Return the shared instance of `name`, loading it on first use."""
+    entry = _entries.get(name)
+    if entry is None:
+        if name not in _LOADERS:
+            raise KeyError(f"Unknown model: {name}")
+        with _load_locks[name]:
+            entry = _entries.get(name)
+            if entry is None:
+                entry = _load(name)
+        _enforce_budget(keep=name)
+    entry["last_used"] = time.time()
+    entry["uses"] += 1
+    return entry["model"]
+
+
+def get_optional(name: str):
+    """
+    Like get(), but returns None if the model cannot be loaded (missing
+    dependency, no weights, network down...). A failed load is not retried
+    for MODEL_RETRY_SECS, then the next call tries again.
+    """
+    failed = _failed.get(name)
+    if failed and time.time() - failed["at"] < MODEL_RETRY_SECS:
+        return None
+    try:
+        model = get(name)
+    except Exception as e:
+        with _lock:
+            _failed[name] = {"error": str(e), "at": time.time()}
+        print(f"[WARN] Model '{name}' unavailable (retry in {MODEL_RETRY_SECS:.0f}s): {e}")
+        return None
+    if failed:
+        with _lock:
+            _failed.pop(name, None)
+    return model
+
+
+def _load(name: str) -> Dict:
+    rss_before = _rss_bytes()
+    t0 = time.perf_counter()
+    model = _LOADERS[name]()
+    load_seconds = time.perf_counter() - t0
+    size = _torch_bytes(model)
+    if not size and rss_before is not None:
+        # not a torch model (e.g. Paddle): fall back to RSS growth during load
+        size = max(0, (_rss_bytes() or rss_before) - rss_before)
+    entry = {
+        "model": model,
+        "load_seconds": load_seconds,
+        "size_bytes": size,
+        "loaded_at": time.time(),
+        "last_used": time.time(),
+        "uses": 0,
+    }
+    with _lock:
+        _entries[name] = entry
+    print(f"[DEBUG] Loaded model '{name}' in {load_seconds:.1f}s (~{size / 2**20:.0f} MB)")
+    _start_janitor()
+    return entry
+
+
+def evict(name: str) -> bool:
+    """Drop the registry's reference to `name`; callers still holding it keep it alive."""
+    with _lock:
+        entry = _entries.pop(name, None)
+    if entry is None:
+        return False
+    del entry
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except Exception:
+        pass
+    print(f"[DEBUG] Evicted model '{name}'")
+    return True
+
+
+def evict_idle(ttl: float = MODEL_IDLE_TTL) -> List[str]:
+    if ttl <= 0:
+        return []
+    cutoff = time.time() - ttl
+    with _lock:
+        idle = [name for name, e in _entries.items() if e["last_used"] < cutoff]
+    return [name for name in idle if evict(name)]
+
+
+def _enforce_budget(keep: Optional[str] = None):
+    if MODEL_MEMORY_BUDGET_MB <= 0:
+        return
+    budget = MODEL_MEMORY_BUDGET_MB * 2**20
+    with _lock:
+        by_lru = sorted(_entries.items(), key=lambda kv: kv[1]["last_used"])
+        total = sum(e["size_bytes"] for _, e in by_lru)
+        victims = []
+        for name, e in by_lru:
+            if total <= budget:
+                break
+            if name == keep:
+                continue
+            victims.append(name)
+            total -= e["size_bytes"]
+    for name in victims:
+        evict(name)
+
+
+def _janitor_loop():
+    interval = max(1.0, MODEL_IDLE_TTL / 4)
+    while True:
+        time.sleep(interval)
+        evict_idle()
+
+
+def _start_janitor():
+    global _janitor
+    if MODEL_IDLE_TTL <= 0 or _janitor is not None:
+        return
+    with _lock:
+        if _janitor is None:
+            _janitor = threading.Thread(target=_janitor_loop, name="model-janitor", daemon=True)
+            _janitor.start()
+
+
+def stats() -> List[Dict]:
+    """Load time, approximate resident size and usage for every known model."""
+    now = time.time()
+    with _lock:
+        out = []
+        for name in _LOADERS:
+            e = _entries.get(name)
+            out.append({
+                "name": name,
+                "loaded": e is not None,
+                "load_seconds": round(e["load_seconds"], 3) if e else None,
+                "size_mb": round(e["size_bytes"] / 2**20, 1) if e else None,
+                "idle_seconds": round(now - e["last_used"], 1) if e else None,
+                "uses": e["uses"] if e else 0,
+                "error": _failed[name]["error"] if name in _failed else None,
+            })
+    return out
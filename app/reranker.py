@@ -0,0 +1,66 @@
+# app/reranker.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, List, Tuple
+
+from . import registry
+from .config import RERANK_BUDGET_MS, RERANK_MAX_CHARS
+
+# scoring runs off the request thread so a slow batch can be abandoned at the budget
+_WORKERS = 2
+_pool = ThreadPoolExecutor(max_workers=_WORKERS, thread_name_prefix="rerank")
+# one slot per worker: an abandoned batch keeps its slot until it actually finishes,
+# so a backlog of timed-out work can't queue up behind the pool
+_slots = threading.BoundedSemaphore(_WORKERS)
+
+
+def warm():
+    """Load the cross-encoder now (at startup) instead of on the first reranked query."""
+    return registry.get_optional("reranker")
+
+
+def _score(model, query: str, texts: List[str]) -> List[float]:
+    pairs = [(query, t[:RERANK_MAX_CHARS]) for t in texts]
+    # one batched forward pass over every candidate
+    return [float(s) for s in model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+
+
+def rerank(query: str, hits: List[Dict], top_k: int, budget_ms: float = RERANK_BUDGET_MS) -> Tuple[List[Dict], Dict]:
+    """
+    Re-order over-fetched `hits` with a cross-encoder and keep the best `top_k`.
+    If scoring doesn't finish within `budget_ms`, fails, or both scoring
+    workers are still busy, the original order is kept. Loading the model is
+    not counted against the budget. Returns (hits, info) where info has
+    rerank_ms and fallback.
+    """
+    if len(hits) <= 1:
+        return hits[:top_k], {"rerank_ms": 0.0, "fallback": False}
+    try:
+        model = registry.get("reranker")
+    except Exception as e:
+        print(f"[WARN] Rerank failed: {e}")
+        return hits[:top_k], {"rerank_ms": 0.0, "fallback": True}
+    if not _slots.acquire(blocking=False):
+        print("[WARN] Rerank workers busy; keeping retrieval order")
+        return hits[:top_k], {"rerank_ms": 0.0, "fallback": True}
+    t0 = time.perf_counter()
+    try:
+        future = _pool.submit(_score, model, query, [h.get("text", "") for h in hits])
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        scores = future.result(timeout=budget_ms / 1000 if budget_ms > 0 else None)
+    except FutureTimeout:
+        future.cancel()  # drops it if it hasn't started; a running batch finishes and frees its slot
+        print(f"[WARN] Rerank exceeded {budget_ms:.0f} ms budget; keeping retrieval order")
+        return hits[:top_k], {"rerank_ms": round((time.perf_counter() - t0) * 1000, 2), "fallback": True}
+    except Exception as e:
+        print(f"[WARN] Rerank failed: {e}")
+        return hits[:top_k], {"rerank_ms": round((time.perf_counter() - t0) * 1000, 2), "fallback": True}
+
+    ranked = sorted(zip(scores, hits), key=lambda sh: sh[0], reverse=True)[:top_k]
+    out = [{**hit, "retrieval_score": hit.get("score"), "score": score} for score, hit in ranked]
+    return out, {"rerank_ms": round((time.perf_counter() - t0) * 1000, 2), "fallback": False}
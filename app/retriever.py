@@ -1,8 +1,130 @@
 # app/retriever.py
-from .embeddings import embed_text
-from .indexer import search
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
-def retrieve(query: str, top_k: int = 5):
-    qv = embed_text(query)
-    results = search(qv, top_k=top_k)
-    return results
+from .embeddings import embed_text, embed_text_for_images
+from .indexer import search_async
+from . import lexical
+from .config import (
+    TEXT_VECTOR_NAME, IMAGE_VECTOR_NAME, RETRIEVAL_MODE, RRF_K, HYBRID_CANDIDATES,
+    QUERY_EMBED_WORKERS, QUERY_EMBED_TIMEOUT, QUERY_SEARCH_TIMEOUT,
+)
+
+# dense and sparse legs of a hybrid query run side by side
+_legs = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieve")
+# query encoding for the async path: a fixed number of threads, so a burst of
+# queries queues here instead of oversubscribing the CPU
+_embed_pool = ThreadPoolExecutor(max_workers=max(1, QUERY_EMBED_WORKERS), thread_name_prefix="query-embed")
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, round((time.perf_counter() - t0) * 1000, 2)
+
+
+def rrf_fuse(result_lists: Dict[str, List[Dict]], top_k: int, k: int = RRF_K) -> List[Dict]:
+    """
+    Reciprocal rank fusion: score = sum over legs of 1 / (k + rank).
+    Each fused hit keeps its payload and records its rank in every leg.
+    """
+    fused: Dict[str, Dict] = {}
+    for leg, hits in result_lists.items():
+        for rank, hit in enumerate(hits, start=1):
+            key = str(hit["id"])
+            entry = fused.setdefault(key, {**hit, "score": 0.0, "ranks": {}})
+            entry["score"] += 1.0 / (k + rank)
+            entry["ranks"][leg] = rank
+    return sorted(fused.values(), key=lambda h: h["score"], reverse=True)[:top_k]
+
+
+async def _timed_async(awaitable, timeout: float):
+    # timeout <= 0: no limit
+    t0 = time.perf_counter()
+    out = await asyncio.wait_for(awaitable, timeout=timeout if timeout > 0 else None)
+    return out, round((time.perf_counter() - t0) * 1000, 2)
+
+
+def _run(pool: ThreadPoolExecutor, fn, *args, **kwargs):
+    # a queued call is dropped if its awaiting task is cancelled (e.g. on timeout)
+    return asyncio.get_running_loop().run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+
+
+async def embed_query_async(query: str) -> Tuple[List[float], float]:
+    """Text embedding of `query` on the bounded encode pool: (vector, ms)."""
+    return await _timed_async(_run(_embed_pool, embed_text, query), QUERY_EMBED_TIMEOUT)
+
+
+async def _dense_async(
+    query: str, top_k: int, filters: Optional[Dict] = None, query_vector: Optional[List[float]] = None
+) -> Tuple[List[Dict], Dict[str, float]]:
+    if query_vector is None:
+        qv, embed_ms = await embed_query_async(query)
+    else:
+        qv, embed_ms = query_vector, 0.0
+    hits, search_ms = await _timed_async(
+        search_async(qv, top_k=top_k, vector_name=TEXT_VECTOR_NAME, filters=filters), QUERY_SEARCH_TIMEOUT
+    )
+    return hits, {"embed_ms": embed_ms, "search_ms": search_ms}
+
+
+async def retrieve_async(
+    query: str,
+    top_k: int = 5,
+    modality: str = "text",
+    mode: str = RETRIEVAL_MODE,
+    filters: Optional[Dict] = None,
+    query_vector: Optional[List[float]] = None
+) -> Tuple[List[Dict], Dict[str, float]]:
+    """
+    modality "text": chunk search, `mode` "dense", "sparse" (BM25) or "hybrid" (both, fused with RRF).
+    modality "image": cross-modal search over image vectors using CLIP's text tower.
+    `filters` (see indexer.build_filter) scopes every leg to matching payloads.
+    Returns (hits, per-stage latency in ms).
+
+    Nothing blocks the event loop: query encoding runs on a bounded thread
+    pool (QUERY_EMBED_WORKERS), vector search on the async Qdrant client and
+    BM25 on the retrieval pool. Each stage has its own
+    timeout (QUERY_EMBED_TIMEOUT, QUERY_SEARCH_TIMEOUT); asyncio.TimeoutError
+    propagates, except from the sparse leg of a hybrid query.
+    `query_vector` (from embed_query_async) skips encoding text queries again.
+    """
+    t0 = time.perf_counter()
+    if modality == "image":
+        qv, embed_ms = await _timed_async(_run(_embed_pool, embed_text_for_images, query), QUERY_EMBED_TIMEOUT)
+        hits, search_ms = await _timed_async(
+            search_async(qv, top_k=top_k, vector_name=IMAGE_VECTOR_NAME, filters=filters), QUERY_SEARCH_TIMEOUT
+        )
+        return hits, {"dense_ms": embed_ms + search_ms, "embed_ms": embed_ms, "search_ms": search_ms}
+    if mode == "dense":
+        hits, stages = await _dense_async(query, top_k, filters, query_vector)
+        return hits, {"dense_ms": round((time.perf_counter() - t0) * 1000, 2), **stages}
+    if mode == "sparse":
+        hits, ms = await _timed_async(_run(_legs, lexical.search, query, top_k, filters), QUERY_SEARCH_TIMEOUT)
+        return hits, {"sparse_ms": ms}
+
+    n = max(top_k, HYBRID_CANDIDATES)
+    dense, sparse = await asyncio.gather(
+        _timed_async(_dense_async(query, n, filters, query_vector), 0),  # its stages have their own timeouts
+        _timed_async(_run(_legs, lexical.search, query, n, filters), QUERY_SEARCH_TIMEOUT),
+        return_exceptions=True
+    )
+    if isinstance(dense, BaseException):
+        raise dense
+    (dense_hits, stages), dense_ms = dense
+    if isinstance(sparse, BaseException):
+        print(f"[WARN] Sparse retrieval failed: {sparse!r}")
+        sparse_hits, sparse_ms = [], None
+    else:
+        sparse_hits, sparse_ms = sparse
+    hits, fuse_ms = _timed(rrf_fuse, {"dense": dense_hits, "sparse": sparse_hits}, top_k)
+    return hits, {
+        "dense_ms": dense_ms,
+        **stages,
+        "sparse_ms": sparse_ms,
+        "fusion_ms": fuse_ms,
+        "total_ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
@@ -1,9 +1,14 @@
 # app/synthesizer.py
-from typing import List, Dict
+import asyncio
+import json
+from typing import AsyncIterator, List, Dict, Tuple
 import subprocess
 import shlex
 import os
 
+from .config import LLM_TOKENIZER, PROMPT_MAX_TOKENS
+from . import packing
+
 # def build_prompt(query: str, retrieved: List[Dict]) -> str:
 #     ctx = []
 #     for i, r in enumerate(retrieved, start=1):
@@ -16,72 +21,147 @@ import os
 #               + "\n".join(ctx) + f"\nQuestion: {query}\n\nAnswer with citation numbers like [1].")
 #     return prompt
 
-def build_prompt(query: str, retrieved: List[Dict]) -> str:
-    ctx = []
-    for i, r in enumerate(retrieved, start=1):
-        text = r.get("text", "")
-        src = r.get("payload", {}).get("filename", r.get("id", "unknown"))
-        ctx.append(f"[{i}] {text}\nSOURCE: {src}\n")
-    prompt = (
-        "You are a helpful assistant. Use ONLY the provided context snippets to answer the question. "
-        "Cite your sources using numbers in brackets like [1], [2], etc. "
-        "If the answer is not contained in the snippets, reply 'I don't know.'\n\nContext:\n"
-        + "\n".join(ctx)
+_PROMPT_HEAD = (
+    "You are a helpful assistant. Use ONLY the provided context snippets to answer the question. "
+    "Cite your sources using numbers in brackets like [1], [2], etc. "
+    "If the answer is not contained in the snippets, reply 'I don't know.'\n\nContext:\n"
+)
+
+
+def _render_passage(p: Dict) -> str:
+    labels = "".join(f"[{n}]" for n in p["labels"])
+    return f"{labels} {p['text']}\nSOURCE: {p['source']}\n"
+
+
+def _render_prompt(query: str, passages: List[Dict]) -> str:
+    return (
+        _PROMPT_HEAD
+        + "\n".join(_render_passage(p) for p in passages)
         + f"\nQuestion: {query}\n\nAnswer in full sentences and cite sources."
     )
 
-    return prompt
-
 
-#def generate_with_local_llm(prompt: str) -> str:
+def build_prompt_with_stats(query: str, retrieved: List[Dict]) -> Tuple[str, Dict]:
     """
-    Placeholder for local LLM. Options to replace:
-    - Call Ollama HTTP API if running locally
-    - Call a local llama.cpp/ggml binary via subprocess (echo to input file / run)
-    - Use text-generation-inference server HTTP
-    For now: return a short summary placeholder.
+    Prompt over the packed context (see packing.py): overlapping/adjacent
+    chunks of a document merged, near-duplicates dropped, fitted into
+    PROMPT_MAX_TOKENS. Passages are labelled with the citation numbers of the
+    hits they contain, which still index citations_for(retrieved).
+    Returns (prompt, stats) with prompt token counts before and after packing.
     """
-    # SAFETY: Do not call remote services by default. Replace below with an integration.
-    return "LOCAL-LLM-PLACEHOLDER — replace generate_with_local_llm() with your LLM call."
+    passages = packing.to_passages(retrieved)
+    unpacked = _render_prompt(query, passages)
+    passages, merged = packing.merge_adjacent(passages)
+    passages, deduplicated = packing.drop_near_duplicates(passages)
+    tokenizer = []
+
+    def count(texts: List[str]) -> List[int]:
+        counts, name = packing.count_llm_tokens(texts)
+        tokenizer[:] = [name]
+        return counts
+
+    budget = 0  # no limit
+    if PROMPT_MAX_TOKENS > 0:
+        # what the instructions and question leave for context (fit_budget reads 0 as unlimited)
+        budget = max(1, PROMPT_MAX_TOKENS - count([_render_prompt(query, [])])[0])
+    passages, fit = packing.fit_budget(passages, budget, _render_passage, count)
+    prompt = _render_prompt(query, passages)
+    before, after = count([unpacked, prompt])
+    return prompt, {
+        "prompt_tokens_before": before,
+        "prompt_tokens": after,
+        "passages": len(passages),
+        "merged": merged,
+        "deduplicated": deduplicated,
+        **fit,
+        "cited": sorted(n for p in passages for n in p["labels"]),
+        "tokenizer": tokenizer[0] if tokenizer else None,
+        # counts are an estimate unless LLM_TOKENIZER was used
+        "tokenizer_fallback": bool(tokenizer) and tokenizer[0] != LLM_TOKENIZER,
+    }
+
+
+def build_prompt(query: str, retrieved: List[Dict]) -> str:
+    return build_prompt_with_stats(query, retrieved)[0]
+
+
+import httpx
+
+from .config import LLM_URL, LLM_MODEL, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, LLM_MAX_CONNECTIONS
+from . import llm_scheduler
+
+# keep-alive connections to Ollama, reused across requests
+_async_client = None
 
-import requests
 
-def generate_with_local_llm(prompt: str) -> str:
+def _get_async_client() -> httpx.AsyncClient:
+    # created on first use, inside the running event loop
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            base_url=LLM_URL,
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+        )
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def _generate_request(prompt: str, stream: bool = False) -> dict:
+    return {"model": LLM_MODEL, "prompt": prompt, "stream": stream}
+
+
+def _response_text(data: dict) -> str:
+    # Some Ollama versions return 'generations'
+    if "response" in data:
+        return data["response"].strip()
+    elif "generations" in data and len(data["generations"]) > 0:
+        return data["generations"][0].get("text", "").strip()
+    else:
+        return "LLM returned no text."
+
+
+async def generate_with_local_llm_async(prompt: str) -> str:
     """
-    Calls local Llama 3.2 3B model via Ollama HTTP API.
+    Calls the local model (Llama 3.2 3B by default) via the Ollama HTTP API on
+    the pooled async client; the event loop stays free while Ollama generates.
     """
     try:
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={
-                "model": "llama3.2:3b",
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=90
-        )
+        response = await _get_async_client().post("/api/generate", json=_generate_request(prompt))
         response.raise_for_status()
-        data = response.json()
-        # Some Ollama versions return 'generations'
-        if "response" in data:
-            return data["response"].strip()
-        elif "generations" in data and len(data["generations"]) > 0:
-            return data["generations"][0].get("text", "").strip()
-        else:
-            return "LLM returned no text."
+        return _response_text(response.json())
     except Exception as e:
-        return f"LLM error: {e}"
-
-# def synthesize(query: str, retrieved: List[Dict]) -> Dict:
-#     prompt = build_prompt(query, retrieved)
-#     answer = generate_with_local_llm(prompt)
-#     citations = [r["id"] for r in retrieved]
-#     return {"answer": answer, "citations": citations, "prompt": prompt}
+        # httpx timeouts often carry no message
+        return f"LLM error: {str(e) or type(e).__name__}"
 
-def synthesize(query: str, retrieved: List[Dict]) -> Dict:
-    prompt = build_prompt(query, retrieved)
-    answer = generate_with_local_llm(prompt)
+async def stream_with_local_llm(prompt: str) -> AsyncIterator[Dict]:
+    """
+    Ollama in streaming mode: yields {"token": str} as text arrives, then one
+    {"done": True, ...} with Ollama's final counters (prompt_eval_count,
+    eval_count, ...). Closing the generator early (client gone) closes the
+    connection, which makes Ollama stop generating. Errors propagate.
+    """
+    async with _get_async_client().stream("POST", "/api/generate", json=_generate_request(prompt, stream=True)) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(data["error"])
+            if data.get("response"):
+                yield {"token": data["response"]}
+            if data.get("done"):
+                yield {k: v for k, v in data.items() if k not in ("response", "context")}
+                return
 
+def citations_for(retrieved: List[Dict]) -> List[Dict]:
     citations = []
     for r in retrieved:
         payload = r.get("metadata") or r.get("payload", {})
@@ -96,9 +176,20 @@ def synthesize(query: str, retrieved: List[Dict]) -> Dict:
             "audio_start": payload.get("audio_start"),
             "audio_end": payload.get("audio_end")
         })
+    return citations
+
+async def synthesize_async(query: str, retrieved: List[Dict]) -> Dict:
+    """
+    Goes through the LLM scheduler: raises LLMQueueFullError / LLMBusyError when
+    the LLM is saturated; identical in-flight prompts share one generation.
+    """
+    # packing tokenizes every passage: keep it off the event loop
+    prompt, context = await asyncio.get_running_loop().run_in_executor(None, build_prompt_with_stats, query, retrieved)
+    answer = await llm_scheduler.generate(prompt, generate_with_local_llm_async)
 
     return {
         "answer": answer,
-        "citations": citations,
-        "prompt": prompt
+        "citations": citations_for(retrieved),
+        "prompt": prompt,
+        "context": context
     }
@@ -1,32 +1,148 @@
 # app/utils.py
+import hashlib
 import os
-import uuid
-from typing import Tuple
+import shutil
+import tempfile
+from typing import List, Tuple
 from fastapi import UploadFile
-from .config import STORAGE_DIR, CHUNK_SIZE, CHUNK_OVERLAP
+from .config import STORAGE_DIR, UPLOAD_TMP_DIR, UPLOAD_CHUNK_BYTES, MAX_UPLOAD_BYTES
 
 os.makedirs(STORAGE_DIR, exist_ok=True)
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
+
+
+_FORM_OVERHEAD = 64 * 1024  # multipart boundaries and part headers on top of the file itself
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware capping request bodies on `paths` before the form is
+    parsed, so an oversized upload is never spooled to disk: a Content-Length
+    over the limit gets 413 without reading the body, and a body without one
+    (chunked) is counted as it arrives and cut off with 413 once it passes
+    the limit. save_upload() still checks the file size itself.
+    """
+
+    def __init__(self, app, paths=(), limit: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.paths = tuple(paths)
+        self.limit = limit + _FORM_OVERHEAD if limit else 0
+
+    def _applies(self, scope) -> bool:
+        return (
+            self.limit > 0 and scope["type"] == "http" and scope["method"] in ("POST", "PUT")
+            and scope["path"].startswith(self.paths)
+        )
+
+    async def __call__(self, scope, receive, send):
+        if not self._applies(scope):
+            return await self.app(scope, receive, send)
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.limit:
+            return await self._reject(send)
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    exceeded = True
+                    raise UploadTooLargeError(f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded:
+                # the form parser turns the error into its own response; answer 413 instead
+                if message["type"] == "http.response.start" and not started:
+                    started = True
+                    await self._reject(send)
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLargeError:
+            if not started:
+                await self._reject(send)
+
+    async def _reject(self, send):
+        body = f'{{"detail":"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
 
 def save_upload(file: UploadFile) -> Tuple[str, str]:
+    """
+    Stream the upload to a private file in UPLOAD_TMP_DIR in UPLOAD_CHUNK_BYTES
+    blocks while hashing it. Returns (staged path, SHA-256 hex digest of the
+    content). The caller either moves it into STORAGE_DIR with store_upload()
+    once the document it belongs to is known, or drops it with discard_upload().
+    Raises UploadTooLargeError past MAX_UPLOAD_BYTES.
+    """
     ext = os.path.splitext(file.filename)[1]
-    doc_id = str(uuid.uuid4())
+    sha = hashlib.sha256()
+    size = 0
+    # written outside STORAGE_DIR so partial uploads are never served by /storage
+    # (keeps the extension: the extractors dispatch on it)
+    fd, staged_path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR, suffix=ext)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                block = file.file.read(UPLOAD_CHUNK_BYTES)
+                if not block:
+                    break
+                size += len(block)
+                if MAX_UPLOAD_BYTES and size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLargeError(f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+                sha.update(block)
+                f.write(block)
+    except BaseException:
+        discard_upload(staged_path)
+        raise
+    return staged_path, sha.hexdigest()
+
+
+def store_upload(staged_path: str, doc_id: str) -> str:
+    """Move a staged upload into STORAGE_DIR as doc_id's stored file (replacing any previous one)."""
+    ext = os.path.splitext(staged_path)[1]
     out_path = os.path.join(STORAGE_DIR, f"{doc_id}{ext}")
-    with open(out_path, "wb") as f:
-        f.write(file.file.read())
-    return out_path, doc_id
-
-def chunk_text_by_words(text: str, chunk_size:int=CHUNK_SIZE, overlap:int=CHUNK_OVERLAP):
-    if not text:
-        return []
-    words = text.split()
-    chunks = []
-    i = 0
-    n = len(words)
-    while i < n:
-        j = min(i + chunk_size, n)
-        chunk = " ".join(words[i:j])
-        chunks.append(chunk)
-        if j == n:
-            break
-        i = j - overlap
-    return chunks
+    for old in stored_files(doc_id):
+        if old != out_path:
+            os.unlink(old)  # an earlier version with another extension
+    shutil.move(staged_path, out_path)  # a rename when both dirs are on one filesystem
+    return out_path
+
+
+def discard_upload(staged_path: str):
+    if os.path.exists(staged_path):
+        os.unlink(staged_path)
+
+
+def stored_files(doc_id: str) -> List[str]:
+    """Files saved in STORAGE_DIR for doc_id (one per extension it was uploaded with)."""
+    return [
+        os.path.join(STORAGE_DIR, name) for name in os.listdir(STORAGE_DIR)
+        if os.path.splitext(name)[0] == doc_id
+    ]
+
+
+def remove_stored_files(doc_id: str) -> List[str]:
+    files = stored_files(doc_id)
+    for path in files:
+        os.unlink(path)
+    return files
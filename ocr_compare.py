@@ -0,0 +1,26 @@
+# Compare OCR engines on your own scans.
+# Usage: python ocr_compare.py scan1.png scan2.jpg document.pdf
+import json
+import sys
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+
+from app.extractors import compare_ocr_engines, pixmap_to_array
+
+
+def load_images(path):
+    if path.lower().endswith(".pdf"):
+        with fitz.open(path) as doc:
+            for i in range(len(doc)):
+                pix = doc.load_page(i).get_pixmap(dpi=200)
+                yield f"{path}#page={i + 1}", pixmap_to_array(pix).copy()
+    else:
+        yield path, np.asarray(Image.open(path).convert("RGB"))
+
+
+for path in sys.argv[1:]:
+    for name, img in load_images(path):
+        print(f"=== {name}")
+        print(json.dumps(compare_ocr_engines(img), indent=2, ensure_ascii=False))
@@ -47,23 +47,30 @@
 
 
 
-from qdrant_client import QdrantClient, models
-
-# Initialize the client
-client = QdrantClient(host="localhost", port=6333) # Replace with your Qdrant instance details
-
-collection_name = "documents" # Replace with the name of your collection
-
-# 1. Delete the collection
-print(f"Deleting collection: {collection_name}")
-client.delete_collection(collection_name=collection_name)
-print(f"Collection '{collection_name}' deleted.")
-
-# 2. Recreate the collection (with the same configuration if desired)
-print(f"Recreating collection: {collection_name}")
-client.recreate_collection(
-    collection_name=collection_name,
-    vectors_config=models.VectorParams(size=512, distance=models.Distance.COSINE), # Adjust size and distance as per your original collection
-    # Add other configuration parameters if needed, e.g., on_disk_payload=True
-)
-print(f"Collection '{collection_name}' recreated.")
\ No newline at end of file
+import argparse
+
+from app.indexer import COLLECTION_NAME, COLLECTION_PROFILES, ensure_collection, apply_profile, drop_collection
+from app.config import QDRANT_PROFILE
+from app.embeddings import text_embedding_dim, image_embedding_dim
+
+parser = argparse.ArgumentParser(description="Recreate the vector collection (Qdrant or the local index), or change its Qdrant storage profile in place.")
+parser.add_argument("--profile", choices=list(COLLECTION_PROFILES), default=QDRANT_PROFILE)
+parser.add_argument("--apply", action="store_true", help="apply --profile to the existing collection instead of recreating it")
+args = parser.parse_args()
+
+collection_name = COLLECTION_NAME # set QDRANT_URL / QDRANT_COLLECTION to target another instance
+
+if args.apply:
+    print(f"Applying profile '{args.profile}' to collection: {collection_name}")
+    apply_profile(args.profile)
+    print("Done; Qdrant re-indexes in the background (watch the collection status until it is green).")
+else:
+    # 1. Delete the collection
+    print(f"Deleting collection: {collection_name}")
+    drop_collection()
+    print(f"Collection '{collection_name}' deleted.")
+
+    # 2. Recreate the collection with named 'text' and 'image' vectors sized from the models
+    print(f"Recreating collection: {collection_name} (profile '{args.profile}')")
+    ensure_collection(text_embedding_dim(), image_embedding_dim(), profile_name=args.profile)
+    print(f"Collection '{collection_name}' recreated.")
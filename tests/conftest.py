@@ -0,0 +1,15 @@
+# tests/conftest.py
+# app.config reads the environment at import time: point every on-disk store
+# at a throwaway directory and use the in-process vector index before any
+# app module is imported.
+import os
+import tempfile
+
+_root = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ.setdefault("INDEX_BACKEND", "local")
+os.environ.setdefault("LOCAL_INDEX_DIR", os.path.join(_root, "vectors"))
+os.environ.setdefault("LEXICAL_INDEX_PATH", os.path.join(_root, "lexical.sqlite3"))
+os.environ.setdefault("DOCUMENTS_DB_PATH", os.path.join(_root, "documents.sqlite3"))
+os.environ.setdefault("EMBED_CACHE_MAX_MB", "0")
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_root, "storage"))
+os.environ.setdefault("UPLOAD_TMP_DIR", os.path.join(_root, "uploads"))
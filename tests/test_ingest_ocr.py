@@ -0,0 +1,71 @@
+# tests/test_ingest_ocr.py
+import numpy as np
+import pytest
+
+ingest = pytest.importorskip("app.ingest")  # needs the ingestion dependencies (pydub, PyMuPDF, ...)
+from app import indexer, registry
+
+
+class _Tokenizer:
+    is_fast = False
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [t.split() for t in texts]}
+
+
+class _Embedder:
+    max_seq_length = 22  # 20-token chunks
+    tokenizer = _Tokenizer()
+
+    def get_sentence_embedding_dimension(self):
+        return 4
+
+    def encode(self, texts, batch_size, convert_to_numpy):
+        return np.array([[len(t), 1.0, 2.0, 3.0] for t in texts], dtype=np.float32)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def fake_embedder():
+    registry.register("text_embedder", _Embedder)
+    indexer.ensure_collection(4, 3)
+    yield
+    registry.register("text_embedder", registry._load_text_embedder)
+
+
+def _sentence(word: str, n: int = 15) -> str:  # one sentence per chunk
+    return " ".join(f"{word}{i}" for i in range(n)) + "."
+
+
+def test_ocr_details_reach_the_indexed_payload():
+    doc_id = "a" * 64
+    pages = [
+        {"page": 1, "text": _sentence("text"), "ocr_engine": None, "ocr_route": None, "ocr_confidence": None},
+        {"page": 2, "text": _sentence("scan") + " " + _sentence("more"),
+         "ocr_engine": "paddle", "ocr_route": "printed", "ocr_confidence": 0.91},
+        {"page": 3, "text": _sentence("hand"), "ocr_engine": "trocr", "ocr_route": "handwritten", "ocr_confidence": None},
+    ]
+    stats = ingest._index_page_stream(pages, doc_id, "scan.pdf", ingest._noop_progress)
+    assert stats["ocr_pages"] == {"paddle": 1, "trocr": 1}
+
+    payloads = indexer.document_points(doc_id).values()
+    by_pages = {p["page_range"]: p for p in payloads}
+    assert by_pages["1-1"]["ocr_engine"] is None and by_pages["1-1"]["ocr_confidence"] is None
+    assert by_pages["2-2"]["ocr_engine"] == "paddle"
+    assert by_pages["2-2"]["ocr_route"] == "printed"
+    assert by_pages["2-2"]["ocr_confidence"] == 0.91
+    assert by_pages["3-3"]["ocr_engine"] == "trocr" and by_pages["3-3"]["ocr_route"] == "handwritten"
+
+    hits = indexer.search([1.0, 1.0, 2.0, 3.0], top_k=10, filters={"doc_id": [doc_id], "ocr_engine": ["paddle"]})
+    assert hits and all(h["metadata"]["ocr_engine"] == "paddle" for h in hits)
+    indexer.delete_document(doc_id)
+
+
+def test_ocr_fields_of_a_chunk_spanning_pages():
+    ocr_pages = {
+        2: {"ocr_engine": "paddle", "ocr_route": "printed", "ocr_confidence": 0.9},
+        3: {"ocr_engine": "trocr", "ocr_route": "handwritten", "ocr_confidence": 0.6},
+    }
+    assert ingest._ocr_fields(ocr_pages, [1]) == {"ocr_engine": None, "ocr_route": None, "ocr_confidence": None}
+    assert ingest._ocr_fields(ocr_pages, [2, 3]) == {
+        "ocr_engine": "paddle,trocr", "ocr_route": "handwritten,printed", "ocr_confidence": 0.6
+    }
@@ -0,0 +1,69 @@
+# tests/test_llm_scheduler.py
+import asyncio
+
+import pytest
+
+from app import llm_scheduler
+from app.llm_scheduler import LLMQueueFullError
+
+
+@pytest.fixture(autouse=True)
+def scheduler(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "LLM_CONCURRENCY", 1)
+    monkeypatch.setattr(llm_scheduler, "LLM_QUEUE_SIZE", 1)
+    monkeypatch.setattr(llm_scheduler, "LLM_QUEUE_TIMEOUT", 5.0)
+    monkeypatch.setattr(llm_scheduler, "_sem", None)  # bound to the test's event loop on first use
+    monkeypatch.setattr(llm_scheduler, "_admitted", 0)
+    monkeypatch.setattr(llm_scheduler, "_active", 0)
+    monkeypatch.setattr(llm_scheduler, "_inflight", {})
+    return llm_scheduler
+
+
+async def _slow(prompt: str) -> str:
+    await asyncio.sleep(0.05)
+    return prompt.upper()
+
+
+def test_burst_is_bounded_by_concurrency_plus_queue():
+    async def burst():
+        return await asyncio.gather(
+            *(llm_scheduler.generate(f"prompt {i}", _slow) for i in range(6)), return_exceptions=True
+        )
+
+    results = asyncio.run(burst())
+    served = [r for r in results if isinstance(r, str)]
+    rejected = [r for r in results if isinstance(r, LLMQueueFullError)]
+    assert len(served) == 2  # one generating + one queued
+    assert len(rejected) == 4
+    assert llm_scheduler.stats()["waiting"] == 0 and llm_scheduler._admitted == 0
+
+
+def test_burst_of_direct_slots_is_bounded():
+    admitted = []
+
+    async def request(i):
+        async with llm_scheduler.slot():
+            admitted.append(i)
+            await asyncio.sleep(0.05)
+
+    async def burst():
+        return await asyncio.gather(*(request(i) for i in range(6)), return_exceptions=True)
+
+    results = asyncio.run(burst())
+    assert len(admitted) == 2
+    assert sum(isinstance(r, LLMQueueFullError) for r in results) == 4
+
+
+def test_identical_prompts_share_one_generation():
+    async def burst():
+        return await asyncio.gather(*(llm_scheduler.generate("same", _slow) for _ in range(6)))
+
+    assert asyncio.run(burst()) == ["SAME"] * 6
+
+
+def test_capacity_frees_up_after_the_burst():
+    async def run():
+        await asyncio.gather(*(llm_scheduler.generate(f"p{i}", _slow) for i in range(6)), return_exceptions=True)
+        return await llm_scheduler.generate("later", _slow)
+
+    assert asyncio.run(run()) == "LATER"